@@ -0,0 +1,148 @@
+"""绘制预览的每次鼠标移动耗时基准测试
+
+在一张大截图上模拟箭头/细线/矩形的拖动绘制，测量每个鼠标移动事件
+从处理事件到重绘完成的耗时。对比旧做法（场景里的临时 QGraphicsLineItem/
+QGraphicsRectItem，每次移动 setLine/setRect）和 CustomGraphicsView 的
+前景层预览（只重绘预览前后覆盖的区域）。
+
+用法:
+    python benchmarks/bench_draw_preview.py [--size 7680x4320] [--moves 200] [--zoom 0.25]
+"""
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import Qt, QEvent, QPointF, QLineF
+from PyQt5.QtGui import QColor, QPen, QPixmap, QPainter, QLinearGradient, QMouseEvent
+
+from image_composer_pyqt import ImageComposer, DraggablePixmapItem
+
+
+def make_pixmap(width, height):
+    """带渐变内容的大图（避免纯色图被特殊优化）"""
+    pixmap = QPixmap(width, height)
+    painter = QPainter(pixmap)
+    gradient = QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QColor(30, 90, 200))
+    gradient.setColorAt(1, QColor(240, 200, 60))
+    painter.fillRect(pixmap.rect(), gradient)
+    painter.end()
+    return pixmap
+
+
+def stroke_points(view, moves):
+    """视口中一段绕圈的拖动轨迹"""
+    center = view.viewport().rect().center()
+    radius = min(view.viewport().width(), view.viewport().height()) / 3
+    return [QPointF(center.x() + radius * math.cos(i / moves * 2 * math.pi) * i / moves,
+                    center.y() + radius * math.sin(i / moves * 2 * math.pi) * i / moves)
+            for i in range(1, moves + 1)]
+
+
+def measure_moves(app, on_move, points):
+    """每次移动：处理事件并立即完成重绘，返回每次的耗时（毫秒）"""
+    timings = []
+    for point in points:
+        start = time.perf_counter()
+        on_move(point)
+        app.processEvents()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def run_overlay(app, window, kind, points):
+    view = window.view
+    viewport = view.viewport()
+    origin = view.viewport().rect().center()
+    mode_action = {'arrow': window.arrow_action, 'line': window.line_action, 'rect': window.rect_action}[kind]
+    mode_action.setChecked(True)
+    {'arrow': window.toggle_arrow_mode, 'line': window.toggle_line_mode, 'rect': window.toggle_rect_mode}[kind]()
+
+    app.sendEvent(viewport, QMouseEvent(QEvent.MouseButtonPress, QPointF(origin), Qt.LeftButton, Qt.LeftButton,
+                                        Qt.NoModifier))
+
+    def on_move(point):
+        app.sendEvent(viewport, QMouseEvent(QEvent.MouseMove, point, Qt.NoButton, Qt.LeftButton, Qt.NoModifier))
+
+    timings = measure_moves(app, on_move, points)
+    # 起点和终点太近时不创建标注，不影响后续测量
+    app.sendEvent(viewport, QMouseEvent(QEvent.MouseButtonRelease, QPointF(origin), Qt.LeftButton, Qt.NoButton,
+                                        Qt.NoModifier))
+    setattr(window, f"{kind}_mode", False)
+    mode_action.setChecked(False)
+    {'arrow': window.toggle_arrow_mode, 'line': window.toggle_line_mode, 'rect': window.toggle_rect_mode}[kind]()
+    return timings
+
+
+def run_legacy(app, window, kind, points):
+    """旧做法：场景里的临时图形项，每次移动修改它的几何形状"""
+    view = window.view
+    scene = window.scene
+    start = view.mapToScene(view.viewport().rect().center())
+    pen = QPen(QColor(255, 0, 0, 150), 2 if kind == 'line' else 3, Qt.DashLine)
+    if kind == 'rect':
+        temp = scene.addRect(start.x(), start.y(), 0, 0, pen)
+    else:
+        temp = scene.addLine(start.x(), start.y(), start.x(), start.y(), pen)
+
+    def on_move(point):
+        scene_pos = view.mapToScene(point.toPoint())
+        if kind == 'rect':
+            temp.setRect(min(start.x(), scene_pos.x()), min(start.y(), scene_pos.y()),
+                         abs(scene_pos.x() - start.x()), abs(scene_pos.y() - start.y()))
+        else:
+            temp.setLine(QLineF(start, scene_pos))
+
+    timings = measure_moves(app, on_move, points)
+    scene.removeItem(temp)
+    app.processEvents()
+    return timings
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return statistics.mean(timings), statistics.median(timings), p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', default='7680x4320', help='底图尺寸')
+    parser.add_argument('--moves', type=int, default=200, help='每次拖动的鼠标移动事件数')
+    parser.add_argument('--zoom', type=float, default=0.25, help='视图缩放比例')
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    window = ImageComposer()
+    window.resize(1600, 1000)
+    window.show()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    item = DraggablePixmapItem(make_pixmap(width, height))
+    window.scene.addItem(item)
+    window.update_scene_rect()
+    window.view.resetTransform()
+    window.view.scale(args.zoom, args.zoom)
+    window.view.centerOn(item)
+    app.processEvents()
+
+    points = stroke_points(window.view, args.moves)
+    print(f"底图 {width}x{height}，视图缩放 {args.zoom}，每次拖动 {args.moves} 个移动事件（毫秒/事件）")
+    print(f"{'kind':>6} | {'legacy mean':>11} {'median':>7} {'p95':>7} | {'overlay mean':>12} {'median':>7} {'p95':>7}")
+    for kind in ('arrow', 'line', 'rect'):
+        legacy = summarize(run_legacy(app, window, kind, points))
+        overlay = summarize(run_overlay(app, window, kind, points))
+        print(f"{kind:>6} | {legacy[0]:11.2f} {legacy[1]:7.2f} {legacy[2]:7.2f} | "
+              f"{overlay[0]:12.2f} {overlay[1]:7.2f} {overlay[2]:7.2f}")
+
+    window.snapshot_manager.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""导出渲染耗时基准测试：scene.render 与整数偏移直接合成
+
+模拟最常见的导出内容：几张未缩放的截图并排放置，上面画了一些箭头和文字。
+对比 scene.render 整张渲染（原做法）和 compose_scene_image 的直接拷贝合成，
+同时检查合成结果里没有被标注盖住的图片区域是否与原图逐像素一致
+（箭头超出图片时画布原点有小数，scene.render 会对图片插值，两者整体不再相同）。
+
+用法:
+    python benchmarks/bench_export_compose.py [--count 4] [--size 2560x1440] [--arrows 10]
+                                              [--format rgb888] [--output rgb888] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import Qt, QPointF, QRectF
+from PyQt5.QtGui import QColor, QImage, QPainter, QLinearGradient, QRegion
+
+from image_composer_pyqt import (ComposerScene, DraggablePixmapItem, AnnotationLayer, compose_scene_image,
+                                 paste_position, qimage_to_qpixmap)
+
+PIXMAP_FORMATS = {'rgb888': QImage.Format_RGB888, 'rgb32': QImage.Format_RGB32}
+
+
+def make_pixmap(width, height, hue, image_format):
+    """带渐变内容的截图替身（避免纯色图被特殊优化），按导入时的方式转成 QPixmap"""
+    image = QImage(width, height, QImage.Format_RGB32)
+    painter = QPainter(image)
+    gradient = QLinearGradient(0, 0, width, height)
+    gradient.setColorAt(0, QColor.fromHsv(hue, 200, 220))
+    gradient.setColorAt(1, QColor.fromHsv((hue + 120) % 360, 160, 120))
+    painter.fillRect(image.rect(), gradient)
+    painter.end()
+    return qimage_to_qpixmap(image.convertToFormat(image_format))
+
+
+def pixels(image):
+    """QImage 的 RGB32 像素（高 x 宽的 uint32 数组，复制一份）"""
+    image = image.convertToFormat(QImage.Format_RGB32)
+    data = image.constBits()
+    data.setsize(image.sizeInBytes())
+    return np.frombuffer(data, np.uint32).reshape(image.height(), image.bytesPerLine() // 4)[:, :image.width()].copy()
+
+
+def image_areas_match(scene, source_rect, composed):
+    """合成结果中没有被标注盖住的图片区域是否与原图逐像素一致"""
+    origin = source_rect.topLeft()
+    layer = scene.annotations
+    covered = QRegion()
+    for record in layer.records.values():
+        covered += QRegion(layer.scene_rect(record).translated(-origin).toAlignedRect().adjusted(-1, -1, 1, 1))
+    output = pixels(composed)
+    for item in scene.items_of(DraggablePixmapItem):
+        top_left = paste_position(item, origin)
+        source = pixels(item.pixmap().toImage())
+        target = output[top_left.y():top_left.y() + source.shape[0], top_left.x():top_left.x() + source.shape[1]]
+        mask = np.ones(source.shape, bool)
+        for rect in covered.rects():
+            rect = rect.translated(-top_left)
+            mask[max(0, rect.top()):max(0, rect.bottom() + 1), max(0, rect.left()):max(0, rect.right() + 1)] = False
+        if target.shape != source.shape or not np.array_equal(target[mask], source[mask]):
+            return False
+    return True
+
+
+def scene_render(scene, source_rect, width, height, image_format):
+    """原做法：白底 + scene.render"""
+    image = QImage(width, height, image_format)
+    image.fill(Qt.white)
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setRenderHint(QPainter.SmoothPixmapTransform)
+    scene.render(painter, QRectF(0, 0, width, height), source_rect, Qt.IgnoreAspectRatio)
+    painter.end()
+    return image
+
+
+def best_of(repeat, func):
+    """多次运行取最快一次（毫秒）和最后一次的结果"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=4, help='并排的截图数量')
+    parser.add_argument('--size', default='2560x1440', help='每张截图的尺寸')
+    parser.add_argument('--arrows', type=int, default=10, help='箭头数量')
+    parser.add_argument('--format', choices=sorted(PIXMAP_FORMATS), default='rgb888',
+                        help='截图的像素格式（导入的不透明截图是 rgb888）')
+    parser.add_argument('--output', choices=sorted(PIXMAP_FORMATS), default='rgb888',
+                        help='输出图片的像素格式（JPEG 导出和分块 PNG 导出用 rgb888，合并用 rgb32）')
+    parser.add_argument('--repeat', type=int, default=5, help='每种做法的运行次数')
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    width, height = (int(v) for v in args.size.lower().split('x'))
+
+    scene = ComposerScene()
+    for i in range(args.count):
+        item = DraggablePixmapItem(make_pixmap(width, height, i * 70, PIXMAP_FORMATS[args.format]))
+        item.setPos(i * width, 0)
+        scene.addItem(item)
+    for i in range(args.arrows):
+        x = (i + 0.5) * args.count * width / max(1, args.arrows)
+        scene.annotations.add_record(AnnotationLayer.make_record(
+            'arrow', start=QPointF(x, height * 0.2), end=QPointF(x + 300, height * 0.7)))
+    scene.annotations.add_record(AnnotationLayer.make_record(
+        'text', pos=QPointF(40, 40), text='导出基准测试', font_size=48))
+
+    source_rect = scene.itemsBoundingRect()
+    out_width, out_height = int(source_rect.width()), int(source_rect.height())
+    print(f"{args.count} 张 {width}x{height} 截图 + {args.arrows} 个箭头，输出 {out_width}x{out_height}")
+
+    output_format = PIXMAP_FORMATS[args.output]
+    render_ms, rendered = best_of(args.repeat, lambda: scene_render(scene, source_rect, out_width, out_height,
+                                                                    output_format))
+    compose_ms, composed = best_of(args.repeat, lambda: compose_scene_image(scene, source_rect, out_width, out_height,
+                                                                            output_format))
+    if composed is None:
+        print("当前布局不满足直接合成条件")
+        return
+
+    print(f"scene.render:        {render_ms:8.1f} ms")
+    print(f"compose_scene_image: {compose_ms:8.1f} ms  ({render_ms / compose_ms:.2f}x)")
+    print(f"与 scene.render 逐像素一致: {'是' if rendered == composed else '否'}")
+    print(f"图片区域与原图逐像素一致: {'是' if image_areas_match(scene, source_rect, composed) else '否'}")
+    app.quit()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""拼图耗时基准测试：join_images 随图片数量的变化
+
+生成若干张截图大小的随机图片，按网格（或一行/一列）拼接，输出每种数量下的
+总耗时、每张图的平均耗时和输出尺寸，用来确认耗时随图片数量线性增长。
+
+用法:
+    python benchmarks/bench_join.py [--counts 25,50,100,200] [--size 1920x1080] [--mode grid] [--gutter 8]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+from image_composer_pyqt import join_images
+
+
+def make_images(count, width, height, distinct=16):
+    """随机内容的截图替身；只生成 distinct 张不同的图循环使用，避免基准本身占满内存"""
+    rng = np.random.default_rng(0)
+    images = []
+    for _ in range(min(count, distinct)):
+        pixels = rng.integers(0, 2 ** 24, size=(height, width), dtype=np.uint32) | np.uint32(0xFF000000)
+        images.append(QImage(pixels.data, width, height, width * 4, QImage.Format_RGB32).copy())
+    return [images[i % len(images)] for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', default='25,50,100,200', help='逗号分隔的图片数量')
+    parser.add_argument('--size', default='1920x1080', help='每张图片的尺寸')
+    parser.add_argument('--mode', default='grid', choices=('row', 'column', 'grid'), help='拼接方式')
+    parser.add_argument('--gutter', type=int, default=8, help='间距（像素）')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    print(f"{args.mode} 拼接 {width}x{height} 的图片，间距 {args.gutter}")
+    print(f"{'count':>6} | {'total ms':>9} {'ms/image':>9} | output")
+    for count in (int(v) for v in args.counts.split(',')):
+        images = make_images(count, width, height)
+        start = time.perf_counter()
+        output = join_images(images, args.mode, gutter=args.gutter)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{count:>6} | {elapsed:9.1f} {elapsed / count:9.2f} | {output.width()}x{output.height()}")
+        del output
+
+
+if __name__ == '__main__':
+    main()
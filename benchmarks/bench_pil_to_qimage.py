@@ -0,0 +1,91 @@
+"""PIL -> QImage/QPixmap 转换基准测试
+
+对比旧的转换路径（convert('RGBA') + tobytes + QImage + fromImage）和
+image_composer_pyqt.pil_to_qimage 的原生格式包装路径。
+
+用法:
+    python benchmarks/bench_pil_to_qimage.py [--repeat 5] [--sizes 1920x1080,3840x2160,7680x4320]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from PyQt5.QtWidgets import QApplication
+from PyQt5.QtGui import QImage, QPixmap
+
+from image_composer_pyqt import pil_to_qimage, qimage_to_qpixmap
+
+
+def legacy_pil_to_qpixmap(pil_image):
+    """旧实现：始终转换为 RGBA，再 tobytes，再构造 QImage"""
+    if pil_image.mode != 'RGBA':
+        pil_image = pil_image.convert('RGBA')
+    data = pil_image.tobytes('raw', 'RGBA')
+    qimage = QImage(data, pil_image.width, pil_image.height, QImage.Format_RGBA8888)
+    return QPixmap.fromImage(qimage)
+
+
+def new_pil_to_qpixmap(pil_image):
+    return qimage_to_qpixmap(pil_to_qimage(pil_image))
+
+
+def make_image(mode, width, height):
+    """生成带渐变内容的测试图片（避免纯色图被特殊优化）"""
+    base = Image.linear_gradient('L').resize((width, height))
+    if mode == 'L':
+        return base
+    if mode == 'P':
+        return base.convert('P')
+    rgb = Image.merge('RGB', (base, base.transpose(Image.FLIP_LEFT_RIGHT), base.transpose(Image.FLIP_TOP_BOTTOM)))
+    if mode == 'RGBA':
+        rgb.putalpha(base)
+    elif mode == 'RGBA-opaque':
+        rgb.putalpha(255)
+    return rgb
+
+
+def measure(func, image, repeat):
+    """返回 (最快耗时秒, Python 层峰值分配字节)"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(image)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(image)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sizes', default='1920x1080,3840x2160,7680x4320')
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)  # noqa: F841  QPixmap 需要 QApplication
+
+    print(f"{'size':>10} {'mode':>11} | {'legacy ms':>10} {'legacy MB':>10} | {'new ms':>8} {'new MB':>8} | "
+          f"speedup | pixmap bpp old/new")
+    for size in args.sizes.split(','):
+        width, height = (int(v) for v in size.lower().split('x'))
+        for mode in ('RGB', 'RGBA', 'RGBA-opaque', 'L', 'P'):
+            image = make_image(mode, width, height)
+            old_time, old_peak = measure(legacy_pil_to_qpixmap, image, args.repeat)
+            new_time, new_peak = measure(new_pil_to_qpixmap, image, args.repeat)
+            old_depth = legacy_pil_to_qpixmap(image).depth()
+            new_depth = new_pil_to_qpixmap(image).depth()
+            print(f"{size:>10} {mode:>11} | {old_time * 1000:10.1f} {old_peak / 2**20:10.1f} | "
+                  f"{new_time * 1000:8.1f} {new_peak / 2**20:8.1f} | {old_time / new_time:6.2f}x | "
+                  f"{old_depth}/{new_depth}")
+
+
+if __name__ == '__main__':
+    main()
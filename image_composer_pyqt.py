@@ -4,14 +4,29 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QGraphicsView, QGraphics
                              QAction, QStatusBar, QGraphicsItem, QSizePolicy, QPushButton,
                              QWidget, QHBoxLayout, QSystemTrayIcon, QMenu, QDialog,
                              QVBoxLayout, QLabel, QLineEdit, QDialogButtonBox, QStyle,
-                             QGraphicsLineItem, QGraphicsPolygonItem, QGraphicsItemGroup,
-                             QGraphicsRectItem, QListWidget, QListWidgetItem, QAbstractItemView,
-                             QCheckBox, QGraphicsTextItem, QInputDialog, QTextEdit)
-from PyQt5.QtCore import Qt, QPointF, QRectF, QSize, QPropertyAnimation, pyqtProperty, QSettings, pyqtSignal, QObject, QLineF, QTimer, QUrl
-from PyQt5.QtGui import QPixmap, QImage, QPainter, QKeySequence, QIcon, QPen, QColor, QPolygonF, QBrush, QFont
+                             QListView, QAbstractItemView, QStyleOptionGraphicsItem,
+                             QCheckBox, QInputDialog, QTextEdit, QComboBox, QSpinBox, QFormLayout)
+from PyQt5.QtCore import (Qt, QPoint, QPointF, QRect, QRectF, QSize, QSizeF, QPropertyAnimation, pyqtProperty, QSettings, pyqtSignal,
+                          QObject, QLineF, QTimer, QUrl, QRunnable, QThreadPool, QFileSystemWatcher,
+                          QAbstractListModel, QModelIndex)
+from PyQt5.QtGui import (QPixmap, QImage, QPainter, QKeySequence, QIcon, QPen, QColor, QPolygonF, QBrush, QFont,
+                         QFontMetricsF, QTransform, QRegion, QPainterPath)
 from PyQt5.QtMultimedia import QMediaPlayer, QMediaContent
+from PyQt5 import sip
 from PIL import Image
+import numpy as np
 import os
+import math
+import heapq
+import bisect
+import hashlib
+import struct
+import zlib
+import json
+import shutil
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 
@@ -22,6 +37,24 @@ load_dotenv()
 INPUT_DIR = os.getenv('INPUT_DIR', os.path.join(os.path.expanduser("~"), "OneDrive", "图片", "Screenshots"))
 # 从环境变量获取桌面目录，默认为 OneDrive\Desktop
 DESKTOP_DIR = os.getenv('desktop_dir', os.path.join(os.path.expanduser("~"), "OneDrive", "Desktop"))
+# 预解码最新截图的缓存上限（MB）
+PREDECODE_CACHE_MB = int(os.getenv('PREDECODE_CACHE_MB', '512'))
+# 选择器缩略图的磁盘缓存目录和容量上限（MB）
+THUMBNAIL_CACHE_DIR = os.getenv('THUMBNAIL_CACHE_DIR', os.path.join(
+    os.getenv('LOCALAPPDATA') or os.path.join(os.path.expanduser("~"), ".cache"), "ImageComposer", "thumbnails"))
+THUMBNAIL_CACHE_MB = int(os.getenv('THUMBNAIL_CACHE_MB', '200'))
+# 撤销快照可占用的内存上限（MB）
+SNAPSHOT_BUDGET_MB = int(os.getenv('SNAPSHOT_BUDGET_MB', '1024'))
+# 内存中保留的最近快照数量，更早的快照压缩后转存到临时目录
+SNAPSHOT_RAM_COUNT = int(os.getenv('SNAPSHOT_RAM_COUNT', '3'))
+# 导入时显示代理图的最长边（像素），超过时先解码缩小版，原图按需加载；0 表示关闭代理
+PROXY_MAX_EDGE = int(os.getenv('PROXY_MAX_EDGE', '2560'))
+# 视图缩小时绘制用的多级缩略图（mipmap）缓存上限（MB）
+MIPMAP_CACHE_MB = int(os.getenv('MIPMAP_CACHE_MB', '256'))
+# 图片缩小到当前像素的该比例以下时，缩放停止后把显示用的 pixmap 重采样到实际显示尺寸；0 表示关闭
+RESAMPLE_BELOW_SCALE = float(os.getenv('RESAMPLE_BELOW_SCALE', '0.75'))
+# 导入时自动裁边：与边框颜色每个通道相差不超过该值的像素视为空白边框
+AUTO_TRIM_TOLERANCE = int(os.getenv('AUTO_TRIM_TOLERANCE', '8'))
 import ctypes
 from ctypes import wintypes
 import threading
@@ -163,128 +196,275 @@ class GlobalHotkey:
 
 # ===== 快照管理系统 =====
 
+_next_item_uid = 1
+
+
+def item_uid(item):
+    """场景项（或标注记录）的稳定编号：合并撤销后重建的项目沿用原编号，撤销记录靠它找到当前对象"""
+    global _next_item_uid
+    if isinstance(item, dict):
+        if item.get('uid') is None:
+            item['uid'] = _next_item_uid
+            _next_item_uid += 1
+        return item['uid']
+    uid = getattr(item, 'uid', None)
+    if uid is None:
+        uid = item.uid = _next_item_uid
+        _next_item_uid += 1
+    return uid
+
+
+def pixel_buffer_info(buffer):
+    """像素缓冲的 (去重键, 字节数)；QPixmap/QImage 隐式共享的副本去重键相同"""
+    if isinstance(buffer, QPixmap):
+        return ('pixmap', buffer.cacheKey()), buffer.width() * buffer.height() * buffer.depth() // 8
+    if isinstance(buffer, QImage):
+        return ('image', buffer.cacheKey()), buffer.bytesPerLine() * buffer.height()
+    return ('pil', id(buffer)), buffer.width * buffer.height * len(buffer.getbands())
+
+
+def encode_snapshot_value(value):
+    """把快照里的 Qt 值转换为可写入 JSON 的形式"""
+    if isinstance(value, QPointF):
+        return {'point': [value.x(), value.y()]}
+    if isinstance(value, QSize):
+        return {'size': [value.width(), value.height()]}
+    if isinstance(value, QRectF):
+        return {'rect': [value.x(), value.y(), value.width(), value.height()]}
+    return value
+
+
+def decode_snapshot_value(value):
+    if isinstance(value, dict):
+        if 'point' in value:
+            return QPointF(*value['point'])
+        if 'size' in value:
+            return QSize(*value['size'])
+        if 'rect' in value:
+            return QRectF(*value['rect'])
+    return value
+
+
+class SnapshotSpillSignals(QObject):
+    spilled = pyqtSignal(int, bool)  # 快照编号, 是否成功
+
+
+class SnapshotSpillTask(QRunnable):
+    """在线程池中把快照的像素压缩为 PNG，并写入清单文件"""
+    def __init__(self, snapshot_id, directory, manifest, buffers, signals):
+        super().__init__()
+        self.snapshot_id = snapshot_id
+        self.directory = directory
+        self.manifest = manifest  # 不含像素的快照描述
+        self.buffers = buffers    # [(文件名, QImage)]
+        self.signals = signals
+
+    def run(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for name, buffer in self.buffers:
+                path = os.path.join(self.directory, name)
+                if not buffer.save(path, 'PNG'):
+                    raise IOError(f"无法写入 {path}")
+            with open(os.path.join(self.directory, 'manifest.json'), 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f, ensure_ascii=False)
+            success = True
+        except Exception as e:
+            print(f"快照转存失败: {e}")
+            success = False
+        self.signals.spilled.emit(self.snapshot_id, success)
+
+
 class SnapshotManager:
-    """快照管理器 - 保存和恢复画布状态"""
-    def __init__(self):
-        self.snapshots = []  # 快照列表
-        self.max_snapshots = 50  # 最大快照数量
+    """快照管理器 - 保存和恢复画布状态
 
-    def save_snapshot(self, scene, image_items_data):
-        """
-        保存当前画布状态为快照
-        scene: QGraphicsScene
-        image_items_data: 图片项的原始数据列表
-        """
+    快照直接引用图片项的像素缓冲而不复制：QPixmap/QImage 是隐式共享的，
+    只有在像素被修改时才会真正复制（写时复制）；PIL 原图在程序中从不原地修改。
+    快照数量不设上限，而是按共享去重后的总字节数限制在 budget_bytes 以内。
+
+    快照由撤销栈中的合并记录按编号引用；超出预算被丢弃的快照，对应的合并
+    就不能再撤销。只有最近 ram_count 个快照留在内存里；更早的快照在后台线程无损压缩为
+    PNG 加一个 JSON 清单，存到临时目录，内存中只留下 {'id', 'spilled_dir'}。
+    恢复时从磁盘读回，对调用方透明，只是慢一些。
+    """
+    def __init__(self, budget_bytes=SNAPSHOT_BUDGET_MB * 1024 * 1024, ram_count=SNAPSHOT_RAM_COUNT):
+        self.snapshots = []  # 快照列表
+        self.budget_bytes = budget_bytes  # 快照像素占用的内存上限
+        self.ram_count = max(2, ram_count)  # 留在内存中的最近快照数量（至少两个，撤销一步不用读磁盘）
+        self.next_id = 1
+        self.spill_root = None  # 临时目录，第一次转存时创建
+        self.spilling = set()   # 正在转存的快照编号
+        self.spill_pool = QThreadPool()
+        self.spill_pool.setMaxThreadCount(1)
+        self.spill_signals = SnapshotSpillSignals()
+        self.spill_signals.spilled.connect(self.on_spilled)
+
+    def save_snapshot(self, scene):
+        """保存当前画布状态为快照，返回快照编号"""
         snapshot = {
+            'id': self.next_id,
             'images': [],
-            'arrows': [],
-            'lines': [],
-            'rects': [],
-            'texts': []
+            'annotations': []
         }
 
-        for item in scene.items():
-            if isinstance(item, DraggablePixmapItem):
-                snapshot['images'].append({
-                    'pixmap': item.pixmap().copy(),
-                    'original_image': item.original_image.copy() if item.original_image else None,
-                    'pos': QPointF(item.pos()),
-                    'z_value': item.zValue(),
-                    'user_scale': item.user_scale,
-                    'file_path': item.file_path
-                })
-            elif isinstance(item, ArrowItem):
-                snapshot['arrows'].append({
-                    'start': QPointF(item.start_point),
-                    'end': QPointF(item.end_point),
-                    'pos': QPointF(item.pos()),
-                    'z_value': item.zValue()
-                })
-            elif isinstance(item, LineItem):
-                snapshot['lines'].append({
-                    'start': QPointF(item.start_point),
-                    'end': QPointF(item.end_point),
-                    'pos': QPointF(item.pos()),
-                    'z_value': item.zValue()
-                })
-            elif isinstance(item, RectItem):
-                snapshot['rects'].append({
-                    'start': QPointF(item.start_point),
-                    'end': QPointF(item.end_point),
-                    'pos': QPointF(item.pos()),
-                    'z_value': item.zValue()
-                })
-            elif isinstance(item, TextItem):
-                snapshot['texts'].append({
-                    'text': item.toPlainText(),
-                    'pos': QPointF(item.pos()),
-                    'z_value': item.zValue(),
-                    'font_size': item.font_size
-                })
+        for item in scene.items_of(DraggablePixmapItem):
+            snapshot['images'].append({
+                'uid': item_uid(item),
+                'pixmap': item.full_resolution_pixmap(),  # 与场景共享像素，不复制
+                'pos': QPointF(item.pos()),
+                'z_value': item.zValue(),
+                'user_scale': item.user_scale,
+                'file_path': item.file_path,
+                'source_size': QSize(item.source_size),
+                'crop': QRectF(item.crop) if item.crop is not None else None
+            })
 
-        self.snapshots.append(snapshot)
+        # 箭头、线条、矩形框和文字都是标注层里的记录
+        for record in scene.annotations.records.values():
+            snapshot['annotations'].append(AnnotationLayer.copy_record(record))
 
-        # 限制快照数量
-        if len(self.snapshots) > self.max_snapshots:
-            self.snapshots.pop(0)
+        self.next_id += 1
+        self.snapshots.append(snapshot)
 
-        return len(self.snapshots)
+        # 较早的快照转存到磁盘
+        for old_snapshot in self.snapshots[:-self.ram_count]:
+            self.spill(old_snapshot)
 
-    def restore_snapshot(self, scene):
-        """恢复到上一个快照状态"""
-        if len(self.snapshots) < 2:
-            return False, 0
+        # 超出内存预算时丢弃最旧的快照（至少保留最新的两个，保证能撤销一步）
+        while len(self.snapshots) > 2 and self.memory_bytes() > self.budget_bytes:
+            self.discard(self.snapshots.pop(0))
 
-        # 移除当前状态（最后一个快照）
-        self.snapshots.pop()
+        return snapshot['id']
 
-        # 获取要恢复的快照
-        snapshot = self.snapshots[-1]
+    def spill(self, snapshot):
+        """提交后台任务把快照转存到磁盘（已转存或正在转存的跳过）"""
+        if 'spilled_dir' in snapshot or snapshot['id'] in self.spilling:
+            return
+        if self.spill_root is None:
+            self.spill_root = tempfile.mkdtemp(prefix='image_composer_snapshots_')
 
-        # 清空当前场景
-        scene.clear()
+        manifest = {}
+        buffers = []
+        for kind, entries in snapshot.items():
+            if kind == 'id':
+                continue
+            manifest[kind] = []
+            for index, data in enumerate(entries):
+                entry = {}
+                for key, value in data.items():
+                    if key == 'pixmap' and value is not None:
+                        name = f"{kind}_{index}_{key}.png"
+                        # QPixmap 只能在主线程使用；光栅后端的 toImage() 与 pixmap 共享像素
+                        buffers.append((name, value.toImage()))
+                        entry[key] = {'blob': name}
+                    else:
+                        entry[key] = encode_snapshot_value(value)
+                manifest[kind].append(entry)
+
+        self.spilling.add(snapshot['id'])
+        directory = os.path.join(self.spill_root, str(snapshot['id']))
+        self.spill_pool.start(SnapshotSpillTask(snapshot['id'], directory, manifest, buffers, self.spill_signals))
+
+    def on_spilled(self, snapshot_id, success):
+        """转存完成：把内存中的快照替换为磁盘引用"""
+        self.spilling.discard(snapshot_id)
+        directory = os.path.join(self.spill_root, str(snapshot_id))
+        for index, snapshot in enumerate(self.snapshots):
+            if snapshot['id'] == snapshot_id:
+                if success:
+                    self.snapshots[index] = {'id': snapshot_id, 'spilled_dir': directory}
+                else:
+                    shutil.rmtree(directory, ignore_errors=True)
+                return
+        # 转存期间快照已被丢弃或恢复
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def load(self, snapshot):
+        """返回完整的快照数据（已转存的从磁盘读回）"""
+        if 'spilled_dir' not in snapshot:
+            return snapshot
+        directory = snapshot['spilled_dir']
+        with open(os.path.join(directory, 'manifest.json'), encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        loaded = {'id': snapshot['id']}
+        for kind, entries in manifest.items():
+            loaded[kind] = []
+            for entry in entries:
+                data = {}
+                for key, value in entry.items():
+                    if isinstance(value, dict) and 'blob' in value:
+                        data[key] = QPixmap.fromImage(QImage(os.path.join(directory, value['blob'])))
+                    else:
+                        data[key] = decode_snapshot_value(value)
+                loaded[kind].append(data)
+        return loaded
+
+    def discard(self, snapshot):
+        """丢弃快照，删除它在磁盘上的数据"""
+        if 'spilled_dir' in snapshot:
+            shutil.rmtree(snapshot['spilled_dir'], ignore_errors=True)
+
+    def memory_bytes(self):
+        """快照引用的像素缓冲总字节数（多个快照共享的缓冲只计一次；已转存的不计）"""
+        buffers = {}
+        for snapshot in self.snapshots:
+            for img_data in snapshot.get('images', []):
+                if img_data['pixmap'] is not None:
+                    key, size = pixel_buffer_info(img_data['pixmap'])
+                    buffers[key] = size
+        return sum(buffers.values())
+
+    def find(self, snapshot_id):
+        for snapshot in self.snapshots:
+            if snapshot['id'] == snapshot_id:
+                return snapshot
+        return None
+
+    def has_snapshot(self, snapshot_id):
+        """快照是否还在（可能已因超出预算被丢弃）"""
+        return self.find(snapshot_id) is not None
+
+    def restore_snapshot(self, snapshot_id, scene):
+        """把快照中的项目重新添加到场景（不清空场景），返回新建的项目；快照不存在时返回 None"""
+        snapshot = self.find(snapshot_id)
+        if snapshot is None:
+            return None
+
+        # 已转存的快照需要从磁盘读回
+        snapshot = self.load(snapshot)
+        items = []
 
         # 恢复图片
         for img_data in snapshot['images']:
             item = DraggablePixmapItem(
                 img_data['pixmap'],
-                img_data['original_image'],
-                file_path=img_data['file_path']
+                file_path=img_data['file_path'],
+                source_size=img_data['source_size']
             )
+            item.set_crop(img_data.get('crop'))
             item.user_scale = img_data['user_scale']
             item.setScale(img_data['user_scale'])
             item.setPos(img_data['pos'])
             item.setZValue(img_data['z_value'])
+            item.uid = img_data['uid']
             scene.addItem(item)
+            items.append(item)
+
+        # 恢复箭头、线条、矩形框和文字
+        for record_data in snapshot['annotations']:
+            record = AnnotationLayer.copy_record(record_data)
+            scene.annotations.add_record(record)
+            items.append(record)
 
-        # 恢复箭头
-        for arrow_data in snapshot['arrows']:
-            arrow = ArrowItem(arrow_data['start'], arrow_data['end'])
-            arrow.setPos(arrow_data['pos'])
-            arrow.setZValue(arrow_data['z_value'])
-            scene.addItem(arrow)
-
-        # 恢复线条
-        for line_data in snapshot['lines']:
-            line = LineItem(line_data['start'], line_data['end'])
-            line.setPos(line_data['pos'])
-            line.setZValue(line_data['z_value'])
-            scene.addItem(line)
-
-        # 恢复矩形
-        for rect_data in snapshot['rects']:
-            rect = RectItem(rect_data['start'], rect_data['end'])
-            rect.setPos(rect_data['pos'])
-            rect.setZValue(rect_data['z_value'])
-            scene.addItem(rect)
-
-        # 恢复文字
-        for text_data in snapshot['texts']:
-            text = TextItem(text_data['text'], text_data['pos'], text_data['font_size'])
-            text.setZValue(text_data['z_value'])
-            scene.addItem(text)
-
-        return True, len(self.snapshots)
+        return items
+
+    def discard_snapshot(self, snapshot_id):
+        """撤销记录不再需要某个快照时释放它"""
+        snapshot = self.find(snapshot_id)
+        if snapshot is not None:
+            self.snapshots.remove(snapshot)
+            self.discard(snapshot)
 
     def get_snapshot_count(self):
         """获取当前快照数量"""
@@ -292,70 +472,216 @@ class SnapshotManager:
 
     def clear(self):
         """清空所有快照"""
+        for snapshot in self.snapshots:
+            self.discard(snapshot)
         self.snapshots.clear()
 
-    def has_snapshots(self):
-        """是否有快照可以撤销"""
-        return len(self.snapshots) > 1
-
+    def close(self):
+        """程序退出时等待转存任务结束并删除临时目录"""
+        self.spill_pool.waitForDone()
+        self.snapshots.clear()
+        if self.spill_root is not None:
+            shutil.rmtree(self.spill_root, ignore_errors=True)
 
-# 保留旧的类名以兼容
-class DrawingUndoStack:
-    """绘图操作撤销栈 - 支持箭头、线条、矩形、文字的撤销"""
-    def __init__(self):
-        self.undo_stack = []  # 存储操作记录: {'type': 'add'/'delete', 'scene': scene, 'items': [items]}
-
-    def push_add_item(self, scene, item):
-        """记录添加绘图元素的操作"""
-        self.undo_stack.append({
-            'type': 'add',
-            'scene': scene,
-            'items': [item]
-        })
 
-    def push_delete_items(self, scene, items):
-        """记录删除绘图元素的操作"""
-        if items:
-            self.undo_stack.append({
-                'type': 'delete',
-                'scene': scene,
-                'items': list(items)
-            })
 
-    def undo(self):
-        """撤销最近一次绘图操作"""
-        if not self.undo_stack:
-            return False
+class CommandStack:
+    """统一的撤销/重做栈
 
-        action = self.undo_stack.pop()
-        scene = action['scene']
-        items = action['items']
+    每条记录只保存变化的部分（增量），撤销和重做只处理涉及的项目
+    （项目可以是图片，也可以是标注层里的记录）：
+        {'type': 'add' / 'remove', 'items': [项目]}
+        {'type': 'move', 'changes': [(项目, 旧位置, 旧层级, 新位置, 新层级)]}
+        {'type': 'scale', 'changes': [(项目, 旧缩放, 新缩放)]}
+        {'type': 'stitch', 'changes': [(图片, 旧位置, 旧裁剪, 新位置, 新裁剪)]}
+        {'type': 'text' / 'font', 'changes': [(项目, 旧值, 新值)]}
+        {'type': 'merge', 'snapshot_id': 快照编号, 'merged_item': 合并图, 'restored_items': [项目]}
+    合并会清空场景，撤销合并时由 SnapshotManager 按快照重建项目，重建的项目沿用
+    原来的 uid；其他记录通过 uid 找到项目当前对应的对象。
+    """
+    LABELS = {'add': '添加', 'remove': '删除', 'move': '移动', 'scale': '缩放',
+              'text': '编辑文字', 'font': '调整字号', 'merge': '合并', 'stitch': '拼接'}
+    MAX_COMMANDS = 500
+    MERGE_INTERVAL = 1.0  # 连续缩放在这个时间内合并为一条记录（秒）
+
+    def __init__(self, scene, snapshot_manager):
+        self.scene = scene
+        self.snapshot_manager = snapshot_manager
+        self.undo_stack = []
+        self.redo_stack = []
+        self.items = {}  # uid -> 项目当前对应的对象
+
+    def track(self, item):
+        self.items[item_uid(item)] = item
+        return item
+
+    def resolve(self, item):
+        """项目当前对应的对象（合并撤销后可能是重建的新对象）；已不存在时返回 None"""
+        current = self.items.get(item_uid(item), item)
+        if isinstance(current, dict):
+            return current
+        if sip.isdeleted(current):
+            current = item
+        return None if sip.isdeleted(current) else current
+
+    def push(self, command):
+        """记录一次已经完成的操作"""
+        for key in ('items', 'changes'):
+            for entry in command.get(key, []):
+                self.track(entry[0] if isinstance(entry, tuple) else entry)
+        if command['type'] == 'merge':
+            self.track(command['merged_item'])
+        command['time'] = datetime.now().timestamp()
+
+        self.undo_stack.append(command)
+        self.drop_commands(self.redo_stack)
+        self.redo_stack.clear()
+        if len(self.undo_stack) > self.MAX_COMMANDS:
+            self.drop_commands([self.undo_stack.pop(0)])
+
+    def push_add(self, items):
+        if items:
+            self.push({'type': 'add', 'items': list(items)})
 
-        if action['type'] == 'add':
-            # 撤销添加操作 = 删除元素
-            for item in items:
-                if item.scene() == scene:
-                    scene.removeItem(item)
-        elif action['type'] == 'delete':
-            # 撤销删除操作 = 恢复元素
-            for item in items:
-                scene.addItem(item)
+    def push_remove(self, items):
+        if items:
+            self.push({'type': 'remove', 'items': list(items)})
 
-        return True
+    def push_changes(self, command_type, changes):
+        """记录属性变化；连续的同类操作（如多次 Ctrl+=）作用于同一批项目时合并为一条"""
+        if command_type in ('move', 'stitch'):
+            changes = [change for change in changes if change[1] != change[3] or change[2] != change[4]]
+        else:
+            changes = [change for change in changes if change[1] != change[2]]
+        if not changes:
+            return
+        last = self.undo_stack[-1] if self.undo_stack else None
+        now = datetime.now().timestamp()
+        if (last is not None and not self.redo_stack and last['type'] == command_type
+                and command_type in ('scale', 'font')
+                and now - last['time'] < self.MERGE_INTERVAL
+                and [item_uid(change[0]) for change in last['changes']] == [item_uid(change[0]) for change in changes]):
+            last['changes'] = [old[:-1] + (new[-1],) for old, new in zip(last['changes'], changes)]
+            last['time'] = now
+            return
+        self.push({'type': command_type, 'changes': changes})
 
-    def redo(self):
-        return False
+    def drop_commands(self, commands):
+        """丢弃记录时释放合并记录引用的快照"""
+        for command in commands:
+            if command['type'] == 'merge':
+                self.snapshot_manager.discard_snapshot(command['snapshot_id'])
 
     def can_undo(self):
         """是否有操作可以撤销"""
-        return len(self.undo_stack) > 0
+        return bool(self.undo_stack)
 
     def can_redo(self):
-        return False
+        return bool(self.redo_stack)
+
+    def undo(self):
+        """撤销最近一次操作，返回 (记录, 图片数量变化)；无法撤销时记录为 None"""
+        if not self.undo_stack:
+            return None, 0
+        command = self.undo_stack.pop()
+        if command['type'] == 'merge' and not self.snapshot_manager.has_snapshot(command['snapshot_id']):
+            # 快照已因超出内存预算被丢弃，更早的记录也无法再撤销
+            self.drop_commands(self.undo_stack)
+            self.undo_stack.clear()
+            return None, 0
+        delta = self.apply(command, undo=True)
+        self.redo_stack.append(command)
+        return command, delta
+
+    def redo(self):
+        """重做最近一次撤销的操作，返回 (记录, 图片数量变化)"""
+        if not self.redo_stack:
+            return None, 0
+        command = self.redo_stack.pop()
+        delta = self.apply(command, undo=False)
+        self.undo_stack.append(command)
+        return command, delta
+
+    def add_items(self, items):
+        delta = 0
+        for item in items:
+            item = self.resolve(item)
+            if isinstance(item, dict):
+                self.scene.annotations.add_record(item)
+                self.track(item)
+            elif item is not None and item.scene() is None:
+                self.scene.addItem(item)
+                self.track(item)
+                if isinstance(item, DraggablePixmapItem) and not item.loading:
+                    delta += 1
+        return delta
+
+    def remove_items(self, items):
+        delta = 0
+        for item in items:
+            item = self.resolve(item)
+            if isinstance(item, dict):
+                self.scene.annotations.remove_record(item)
+            elif item is not None and item.scene() is self.scene:
+                self.scene.removeItem(item)
+                if isinstance(item, DraggablePixmapItem) and not item.loading:
+                    delta -= 1
+        return delta
+
+    def apply(self, command, undo):
+        """执行记录的反向（undo=True）或正向操作，返回图片数量变化"""
+        command_type = command['type']
+        if command_type == 'add':
+            return self.remove_items(command['items']) if undo else self.add_items(command['items'])
+        if command_type == 'remove':
+            return self.add_items(command['items']) if undo else self.remove_items(command['items'])
+
+        if command_type == 'merge':
+            if undo:
+                delta = self.remove_items([command['merged_item']])
+                restored = self.snapshot_manager.restore_snapshot(command['snapshot_id'], self.scene)
+                for item in restored:
+                    self.track(item)
+                command['restored_items'] = restored
+                return delta + sum(1 for item in restored if isinstance(item, DraggablePixmapItem))
+            return self.remove_items(command['restored_items']) + self.add_items([command['merged_item']])
+
+        layer = self.scene.annotations
+        for change in command['changes']:
+            item = self.resolve(change[0])
+            if item is None:
+                continue
+            if isinstance(item, dict) and not layer.contains_record(item):
+                continue
+            value = change[1] if undo else change[-1]
+            if command_type == 'move':
+                _, old_pos, old_z, new_pos, new_z = change
+                if isinstance(item, dict):
+                    layer.set_record_pos(item, old_pos if undo else new_pos)
+                    layer.set_record_z(item, old_z if undo else new_z)
+                else:
+                    item.setPos(old_pos if undo else new_pos)
+                    self.scene.set_item_z(item, old_z if undo else new_z)
+            elif command_type == 'scale':
+                item.user_scale = value
+                item.setScale(item.user_scale)
+            elif command_type == 'stitch':
+                _, old_pos, old_crop, new_pos, new_crop = change
+                item.set_crop(old_crop if undo else new_crop)
+                item.setPos(old_pos if undo else new_pos)
+            elif command_type == 'text':
+                layer.set_text(item, value)
+            elif command_type == 'font':
+                layer.set_font_size(item, value)
+        return 0
 
     def clear(self):
         """清空撤销栈"""
+        self.drop_commands(self.undo_stack)
+        self.drop_commands(self.redo_stack)
         self.undo_stack.clear()
+        self.redo_stack.clear()
+        self.items.clear()
 
 
 class HotkeySignalEmitter(QObject):
@@ -363,16 +689,184 @@ class HotkeySignalEmitter(QObject):
     show_signal = pyqtSignal()
 
 
+# ===== 最近图片索引 =====
+
+class RecentImageIndex(QObject):
+    """图片目录的常驻索引，按创建时间回答"最新N张"查询
+
+    目录修改时间（或文件监视器）没有变化时直接复用上次结果；变化时用
+    os.scandir 增量更新，只对新出现的文件取 stat（Windows 上 DirEntry
+    自带 stat 信息，不需要额外系统调用）。Top-N 查询用堆而不是全量排序。
+    文件监视器发现变化后稍等片刻自动刷新，索引内容变化时发出 changed 信号。
+    """
+    IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+
+    changed = pyqtSignal()
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self.entries = {}  # 文件名 -> 创建时间
+        self.dir_mtime = None
+        self.dirty = True
+
+        # 截图工具创建、写入、重命名产生的连续变化合并为一次刷新
+        self.refresh_timer = QTimer()
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.timeout.connect(self.refresh_and_notify)
+
+        # 文件监视器：目录内容变化时标记需要刷新
+        self.watcher = QFileSystemWatcher()
+        self.watcher.directoryChanged.connect(self.mark_dirty)
+        self.watch_directory()
+
+    def watch_directory(self):
+        if os.path.isdir(self.directory) and not self.watcher.directories():
+            self.watcher.addPath(self.directory)
+
+    def mark_dirty(self, *args):
+        self.dirty = True
+        self.refresh_timer.start(300)
+
+    def refresh_and_notify(self):
+        if self.refresh():
+            self.changed.emit()
+
+    def exists(self):
+        return os.path.isdir(self.directory)
+
+    def refresh(self):
+        """同步索引与磁盘；返回索引内容是否发生了变化"""
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            changed = bool(self.entries)
+            self.entries.clear()
+            self.dir_mtime = None
+            return changed
+
+        if not self.dirty and dir_mtime == self.dir_mtime:
+            return False
+        self.dirty = False
+        self.dir_mtime = dir_mtime
+        self.watch_directory()
+
+        old_entries = self.entries
+        entries = {}
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                name = entry.name
+                if not name.lower().endswith(self.IMAGE_EXTENSIONS):
+                    continue
+                if os.name != 'nt' and name in old_entries:
+                    entries[name] = old_entries[name]
+                    continue
+                try:
+                    if entry.is_file():
+                        entries[name] = entry.stat().st_ctime
+                except OSError:
+                    continue
+
+        changed = entries != old_entries
+        self.entries = entries
+        return changed
+
+    def count(self):
+        """目录中的图片总数"""
+        self.refresh()
+        return len(self.entries)
+
+    def newest(self, count):
+        """返回最新的 count 张图片 [(完整路径, 文件名, 创建时间)]，从新到旧"""
+        self.refresh()
+        top = heapq.nlargest(count, self.entries.items(), key=lambda entry: entry[1])
+        return [(os.path.join(self.directory, name), name, create_time) for name, create_time in top]
+
+    def all_entries(self):
+        """返回全部图片 [(文件名, 创建时间)]，从新到旧（不拼接路径，供大目录列表使用）"""
+        self.refresh()
+        return sorted(self.entries.items(), key=lambda entry: entry[1], reverse=True)
+
+
+class ImageFileModel(QAbstractListModel):
+    """目录中全部图片的列表模型（按创建时间从新到旧）
+
+    只保存路径和时间；缩略图由选择器按可见范围请求，生成后放进一个有上限的
+    LRU 图标缓存，滚出很远的行会释放图标，再次可见时从磁盘缓存重新读取。
+    """
+    MAX_ICONS = 300
+
+    def __init__(self, directory, entries, parent=None):
+        super().__init__(parent)
+        self.directory = directory
+        self.entries = entries        # [(文件名, 创建时间)]
+        self.icons = OrderedDict()    # 路径 -> QIcon
+        self.placeholder = QPixmap(ThumbnailCache.SIZE, ThumbnailCache.SIZE)
+        self.placeholder.fill(QColor(235, 235, 235))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def file_path(self, row):
+        return os.path.join(self.directory, self.entries[row][0])
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        filename, create_time = self.entries[index.row()]
+        file_path = os.path.join(self.directory, filename)
+        if role == Qt.DisplayRole:
+            time_str = datetime.fromtimestamp(create_time).strftime("%Y-%m-%d %H:%M:%S")
+            return f"{filename}\n{time_str}"
+        if role == Qt.DecorationRole:
+            icon = self.icons.get(file_path)
+            if icon is None:
+                return self.placeholder
+            self.icons.move_to_end(file_path)
+            return icon
+        if role == Qt.UserRole:
+            return file_path
+        return None
+
+    def has_icon(self, file_path):
+        return file_path in self.icons
+
+    def set_thumbnail(self, row, file_path, thumbnail):
+        self.icons[file_path] = QIcon(QPixmap.fromImage(thumbnail))
+        while len(self.icons) > self.MAX_ICONS:
+            self.icons.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
 class CustomImagePicker(QDialog):
-    """自定义图片选择器，按创建时间排序，只显示最新5张"""
-    def __init__(self, default_path, parent=None):
+    """自定义图片选择器，按创建时间排序，显示目录中的全部图片
+
+    列表是虚拟化的：只为滚动到可见范围内（以及前方预取范围内）的行生成缩略图，
+    滚出视口的行撤回尚未开始的缩略图任务。
+    """
+    PREFETCH_ROWS = 10  # 可见范围之后预取的行数
+
+    def __init__(self, default_path, parent=None, recent_index=None):
         super().__init__(parent)
-        self.setWindowTitle("选择图片文件 (最新5张)")
+        self.setWindowTitle("选择图片文件")
         self.setModal(True)
         self.resize(900, 700)
 
         self.selected_files = []
         self.default_path = default_path
+        self.recent_index = recent_index or RecentImageIndex(default_path)
+        self.model = None
+
+        # 缩略图磁盘缓存（后台生成完成后更新图标）
+        self.thumbnails = ThumbnailCache.instance()
+        self.thumbnails.signals.ready.connect(self.on_thumbnail_ready)
+        self.requested = {}  # 本对话框已提交、尚未返回的缩略图：路径 -> 行号
+
+        # 滚动/缩放时合并多次可见范围更新
+        self.visible_timer = QTimer(self)
+        self.visible_timer.setSingleShot(True)
+        self.visible_timer.timeout.connect(self.update_visible_thumbnails)
 
         self.init_ui()
         self.load_images()
@@ -387,16 +881,21 @@ class CustomImagePicker(QDialog):
         layout.addWidget(self.path_label)
 
         # 提示信息
-        info_label = QLabel("显示最新的5张图片，按创建时间从新到旧排序。双击或勾选文件进行选择。")
+        info_label = QLabel("显示目录中的全部图片，按创建时间从新到旧排序。双击或勾选文件进行选择。")
         info_label.setStyleSheet("color: gray; font-size: 11px; padding: 5px;")
         layout.addWidget(info_label)
 
         # 文件列表
-        self.file_list = QListWidget()
+        self.file_list = QListView()
         self.file_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.file_list.setIconSize(QSize(200, 200))  # 设置大尺寸高清缩略图
+        self.file_list.setIconSize(QSize(ThumbnailCache.SIZE, ThumbnailCache.SIZE))  # 设置大尺寸高清缩略图
         self.file_list.setSpacing(10)  # 增加项目间距
-        self.file_list.itemDoubleClicked.connect(self.on_item_double_clicked)
+        self.file_list.setUniformItemSizes(True)  # 所有行等高，不必逐行计算尺寸
+        self.file_list.setLayoutMode(QListView.Batched)  # 大目录分批布局，对话框先显示出来
+        self.file_list.setBatchSize(1000)
+        self.file_list.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.file_list.doubleClicked.connect(self.on_item_double_clicked)
+        self.file_list.verticalScrollBar().valueChanged.connect(self.schedule_visible_update)
         layout.addWidget(self.file_list)
 
         # 底部按钮栏
@@ -429,73 +928,108 @@ class CustomImagePicker(QDialog):
             self.path_label.setText(f"目录不存在: {self.default_path}")
             return
 
-        # 支持的图片格式
-        image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-
-        # 获取所有图片文件及其创建时间
-        files_with_time = []
-        for filename in os.listdir(self.default_path):
-            if filename.lower().endswith(image_extensions):
-                file_path = os.path.join(self.default_path, filename)
-                try:
-                    # 获取文件创建时间
-                    create_time = os.path.getctime(file_path)
-                    files_with_time.append((file_path, filename, create_time))
-                except Exception:
-                    continue
-
-        # 按创建时间从新到旧排序（时间大的在前）
-        files_with_time.sort(key=lambda x: x[2], reverse=True)
-
-        # 只取前5张图片
-        files_with_time = files_with_time[:5]
-
-        # 加载前5张图片（带高清缩略图）
-        for file_path, filename, create_time in files_with_time:
-            # 格式化时间
-            time_str = datetime.fromtimestamp(create_time).strftime("%Y-%m-%d %H:%M:%S")
-
-            # 创建高清缩略图
-            try:
-                pixmap = QPixmap(file_path)
-                if not pixmap.isNull():
-                    # 使用高质量缩放，保持宽高比
-                    thumbnail = pixmap.scaled(200, 200, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                    icon = QIcon(thumbnail)
-                else:
-                    icon = QIcon()
-            except Exception:
-                icon = QIcon()
-
-            # 创建列表项
-            item = QListWidgetItem(icon, f"{filename}\n{time_str}")
-            item.setData(Qt.UserRole, file_path)  # 存储完整路径
-            self.file_list.addItem(item)
-
-        # 更新计数
-        total_count = len([f for f in os.listdir(self.default_path)
-                          if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp'))])
-        self.path_label.setText(f"目录: {self.default_path}  (显示最新 {len(files_with_time)}/{total_count} 张)")
+        # 从索引中取全部图片（按创建时间从新到旧），缩略图稍后按可见范围生成
+        entries = self.recent_index.all_entries()
+        self.model = ImageFileModel(self.recent_index.directory, entries, self)
+        self.file_list.setModel(self.model)
+
+        self.path_label.setText(f"目录: {self.default_path}  (共 {len(entries)} 张)")
+        self.schedule_visible_update()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.schedule_visible_update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.schedule_visible_update()
+
+    def schedule_visible_update(self, *args):
+        self.visible_timer.start(30)
+
+    def visible_rows(self):
+        """当前视口内的行范围 (first, last)；没有行时返回 None"""
+        if self.model is None or self.model.rowCount() == 0:
+            return None
+        viewport = self.file_list.viewport().rect()
+        first = self.row_near(viewport.top(), 1)
+        last = self.row_near(viewport.bottom(), -1)
+        first_row = first if first is not None else 0
+        if last is None:
+            # 分批布局尚未完成或视口底部在列表末尾之后：按行高估算一屏的行数
+            row_height = self.file_list.sizeHintForRow(0) + self.file_list.spacing()
+            last = first_row + viewport.height() // max(1, row_height) + 1
+        last_row = min(self.model.rowCount() - 1, last)
+        return first_row, max(first_row, last_row)
+
+    def row_near(self, y, step):
+        """视口中 y 处的行；y 落在行间距里时沿 step 方向找最近的行"""
+        x = self.file_list.spacing() + 1
+        for offset in range(0, 2 * self.file_list.spacing() + 2):
+            index = self.file_list.indexAt(QPoint(x, y + offset * step))
+            if index.isValid():
+                return index.row()
+        return None
+
+    def update_visible_thumbnails(self):
+        """为可见行和预取范围请求缩略图，撤回已滚出范围的任务"""
+        rows = self.visible_rows()
+        if rows is None:
+            return
+        first_row, last_row = rows
+        # 预取：向下多取 PREFETCH_ROWS 行，向上多取少量
+        wanted_first = max(0, first_row - self.PREFETCH_ROWS // 2)
+        wanted_last = min(self.model.rowCount() - 1, last_row + self.PREFETCH_ROWS)
+        for file_path, row in list(self.requested.items()):
+            if not wanted_first <= row <= wanted_last:
+                self.thumbnails.cancel(file_path)
+                del self.requested[file_path]
+
+        for row in range(wanted_first, wanted_last + 1):
+            file_path = self.model.file_path(row)
+            if file_path in self.requested or self.model.has_icon(file_path):
+                continue
+            # 可见行优先于预取行
+            priority = 1 if first_row <= row <= last_row else 0
+            self.requested[file_path] = row
+            self.thumbnails.request(file_path, priority)
+
+    def on_thumbnail_ready(self, file_path, thumbnail):
+        """后台缩略图生成完成"""
+        row = self.requested.pop(file_path, None)
+        if row is not None:
+            self.model.set_thumbnail(row, file_path, thumbnail)
+
+    def done(self, result):
+        # 对话框关闭后撤回排队中的任务，不再接收缩略图更新
+        self.visible_timer.stop()
+        for file_path in self.requested:
+            self.thumbnails.cancel(file_path)
+        self.requested.clear()
+        try:
+            self.thumbnails.signals.ready.disconnect(self.on_thumbnail_ready)
+        except TypeError:
+            pass
+        super().done(result)
 
     def select_all(self):
         """全选"""
-        for i in range(self.file_list.count()):
-            self.file_list.item(i).setSelected(True)
+        self.file_list.selectAll()
 
     def deselect_all(self):
         """取消全选"""
         self.file_list.clearSelection()
 
-    def on_item_double_clicked(self, item):
+    def on_item_double_clicked(self, index):
         """双击文件项，直接选中该文件并关闭对话框"""
-        file_path = item.data(Qt.UserRole)
+        file_path = index.data(Qt.UserRole)
         self.selected_files = [file_path]
         self.accept()
 
     def accept_selection(self):
-        """确认选择"""
-        selected_items = self.file_list.selectedItems()
-        self.selected_files = [item.data(Qt.UserRole) for item in selected_items]
+        """确认选择（按列表顺序）"""
+        selected = sorted(self.file_list.selectionModel().selectedIndexes(), key=lambda index: index.row())
+        self.selected_files = [index.data(Qt.UserRole) for index in selected]
         self.accept()
 
     def get_selected_files(self):
@@ -588,146 +1122,783 @@ class HotkeySettingsDialog(QDialog):
         return self.hotkey_edit.text().strip()
 
 
-class LineItem(QGraphicsItemGroup):
-    """可拖拽的细线"""
-    def __init__(self, start_point, end_point):
-        super().__init__()
-        self.setFlag(QGraphicsItem.ItemIsMovable, True)
-        self.setFlag(QGraphicsItem.ItemIsSelectable, True)
-        self.setFlag(QGraphicsItem.ItemSendsGeometryChanges, True)
+class JoinDialog(QDialog):
+    """拼图设置对话框：拼接方式、网格列数和间距"""
+    def __init__(self, image_count, mode='row', columns=0, gutter=0, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("拼图")
+        self.setModal(True)
 
-        self.start_point = start_point
-        self.end_point = end_point
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel(f"按原始像素拼接 {image_count} 张图片，保存为 PNG 到桌面"))
+
+        form = QFormLayout()
+        self.mode_combo = QComboBox()
+        for key, label in JOIN_MODES.items():
+            self.mode_combo.addItem(label, key)
+        self.mode_combo.setCurrentIndex(max(0, self.mode_combo.findData(mode)))
+        form.addRow("拼接方式:", self.mode_combo)
+
+        # 0 表示自动（接近正方形）
+        self.columns_spin = QSpinBox()
+        self.columns_spin.setRange(0, max(1, image_count))
+        self.columns_spin.setSpecialValueText("自动")
+        self.columns_spin.setValue(min(columns, image_count))
+        form.addRow("网格列数:", self.columns_spin)
+
+        self.gutter_spin = QSpinBox()
+        self.gutter_spin.setRange(0, 500)
+        self.gutter_spin.setSuffix(" 像素")
+        self.gutter_spin.setValue(gutter)
+        form.addRow("间距:", self.gutter_spin)
+        layout.addLayout(form)
+
+        self.mode_combo.currentIndexChanged.connect(self.update_columns_enabled)
+        self.update_columns_enabled()
 
-        # 细线样式 - 使用较细的红色线
-        self.pen = QPen(QColor(255, 0, 0), 2, Qt.SolidLine)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
 
-        # 创建线条
-        self.line = QGraphicsLineItem()
+        self.setLayout(layout)
 
-        self.addToGroup(self.line)
+    def update_columns_enabled(self):
+        self.columns_spin.setEnabled(self.mode_combo.currentData() == 'grid')
 
-        self.update_line()
+    def get_options(self):
+        """返回 (拼接方式, 网格列数, 间距)"""
+        return self.mode_combo.currentData(), self.columns_spin.value(), self.gutter_spin.value()
 
-        self.setCursor(Qt.OpenHandCursor)
 
-    def update_line(self):
-        """更新线条的位置"""
-        # 设置线条
-        line = QLineF(self.start_point, self.end_point)
-        self.line.setLine(line)
-        self.line.setPen(self.pen)
+class ArrangeDialog(QDialog):
+    """自动排列设置对话框：目标宽高比和间距"""
+    def __init__(self, image_count, aspect=0.0, gutter=0, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("自动排列")
+        self.setModal(True)
 
-    def mousePressEvent(self, event):
-        self.setCursor(Qt.ClosedHandCursor)
-        # 选中时自动置顶
-        if self.scene():
-            max_z = 0
-            for item in self.scene().items():
-                if isinstance(item, (DraggablePixmapItem, ArrowItem, LineItem, RectItem)):
-                    max_z = max(max_z, item.zValue())
-            self.setZValue(max_z + 1)
-        super().mousePressEvent(event)
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel(f"紧凑排列 {image_count} 张图片，尽量减小导出画布的面积"))
+
+        form = QFormLayout()
+        self.aspect_combo = QComboBox()
+        for value, label in ARRANGE_ASPECTS.items():
+            self.aspect_combo.addItem(label, value)
+        index = min(range(self.aspect_combo.count()), key=lambda i: abs(self.aspect_combo.itemData(i) - aspect))
+        self.aspect_combo.setCurrentIndex(index)
+        form.addRow("宽高比:", self.aspect_combo)
+
+        self.gutter_spin = QSpinBox()
+        self.gutter_spin.setRange(0, 500)
+        self.gutter_spin.setSuffix(" 像素")
+        self.gutter_spin.setValue(gutter)
+        form.addRow("间距:", self.gutter_spin)
+        layout.addLayout(form)
 
-    def mouseReleaseEvent(self, event):
-        self.setCursor(Qt.OpenHandCursor)
-        super().mouseReleaseEvent(event)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
 
+        self.setLayout(layout)
 
-class RectItem(QGraphicsItemGroup):
-    """可拖拽的矩形框"""
-    def __init__(self, start_point, end_point):
-        super().__init__()
-        self.setFlag(QGraphicsItem.ItemIsMovable, True)
-        self.setFlag(QGraphicsItem.ItemIsSelectable, True)
-        self.setFlag(QGraphicsItem.ItemSendsGeometryChanges, True)
+    def get_options(self):
+        """返回 (目标宽高比（0 表示自动）, 间距)"""
+        return self.aspect_combo.currentData(), self.gutter_spin.value()
+
+
+# 标注层本身在所有图片之上，只画没有被任何图片压住的标注（图片置顶时 Z 值每次只加 1）
+ANNOTATION_LAYER_Z = 1e9
+
+# 各种标注的样式：箭头和矩形框 3 像素、细线 2 像素的红色实线，文字为红色粗体
+ANNOTATION_COLOR = QColor(255, 0, 0)
+ANNOTATION_PEN_WIDTHS = {'arrow': 3, 'line': 2, 'rect': 3}
+ARROW_HEAD_SIZE = 15
+TEXT_MARGIN = 4  # 与 QGraphicsTextItem 的文档边距一致
 
-        self.start_point = start_point
-        self.end_point = end_point
 
-        # 矩形框样式 - 红色边框，无填充
-        self.pen = QPen(QColor(255, 0, 0), 3, Qt.SolidLine)
+def arrow_head_polygon(start, end, size=ARROW_HEAD_SIZE):
+    """箭头头部的三角形（尖端在 end）"""
+    line = QLineF(start, end)
+    ux, uy = line.dx() / line.length(), line.dy() / line.length()
+    p1 = end - QPointF(size * (ux + 0.5 * uy), size * (uy - 0.5 * ux))
+    p2 = end - QPointF(size * (ux - 0.5 * uy), size * (uy + 0.5 * ux))
+    return QPolygonF([end, p1, p2])
 
-        # 创建矩形
-        self.rect = QGraphicsRectItem()
 
-        self.addToGroup(self.rect)
+def distance_to_segment(point, start, end):
+    """点到线段的距离"""
+    dx, dy = end.x() - start.x(), end.y() - start.y()
+    length_squared = dx * dx + dy * dy
+    t = 0.0
+    if length_squared > 0:
+        t = max(0.0, min(1.0, ((point.x() - start.x()) * dx + (point.y() - start.y()) * dy) / length_squared))
+    return math.hypot(point.x() - start.x() - t * dx, point.y() - start.y() - t * dy)
 
-        self.update_rect()
 
+class AnnotationLayer(QGraphicsItem):
+    """所有箭头、细线、矩形框和文字的标注层
+
+    每个标注只是一条字典记录（不再是一组 QGraphicsItem），整层在一次 paint()
+    中绘制与重绘区域相交的记录。记录按所在的网格单元登记，点击、框选和局部
+    重绘只检查附近单元里的记录。选中、拖动和置顶由标注层自己处理：
+        {'uid', 'kind': 'arrow'/'line'/'rect'/'text', 'pos', 'z_value',
+         'start', 'end'（形状，相对 pos）, 'text', 'font_size'（文字）,
+         'seq'（加入场景的顺序）, 'bounds'（相对 pos 的边界，含线宽）}
+
+    标注和图片共用一套层叠顺序：先比 Z 值，相同时后加入的在上面（与 Qt 对顶层项目的
+    处理一致）。被某张图片压住的标注由紧贴在这张图片下方的 AnnotationSlice 绘制，
+    其余的由标注层自己绘制；AnnotationSlice 的数量不超过图片数。
+    """
+    GRID_SIZE = 256
+    HIT_TOLERANCE = 3  # 点中细线/箭头的最小距离（场景单位）
+    _fonts = {}
+
+    def __init__(self):
+        super().__init__()
+        self.setZValue(ANNOTATION_LAYER_Z)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
         self.setCursor(Qt.OpenHandCursor)
+        self.records = {}       # uid -> 记录
+        self.selected = set()   # 选中记录的 uid
+        self.grid = {}          # (列, 行) -> {uid}
+        self.cells = {}         # uid -> 记录所在的网格单元
+        self.top_z = 0
+        self.bounds = QRectF()  # 所有记录的边界（删除/移动后可能偏大，见 refresh_bounds）
+        self.bounds_stale = False
+        self.drag = None        # 拖动中：起点和各项目的起始位置
+        self.owners = {}        # uid -> 绘制它的 AnnotationSlice（不在其中的由标注层自己绘制）
+        self.slices = {}        # 图片项 -> 紧贴在它下方的 AnnotationSlice
+        self.stack_order = None  # 按层叠顺序排列的 (层叠键, 图片项)；None 表示需要重新排序
+
+    # ----- 记录 -----
+
+    @staticmethod
+    def make_record(kind, pos=None, **fields):
+        record = {'uid': None, 'kind': kind, 'pos': QPointF(pos) if pos is not None else QPointF(0, 0),
+                  'z_value': 0}
+        record.update(fields)
+        return record
+
+    @staticmethod
+    def copy_record(record):
+        """不含缓存字段的独立副本（快照用）"""
+        return {key: QPointF(value) if isinstance(value, QPointF) else value
+                for key, value in record.items() if key not in ('bounds', 'seq')}
+
+    @classmethod
+    def text_font(cls, font_size):
+        font = cls._fonts.get(font_size)
+        if font is None:
+            font = cls._fonts[font_size] = QFont("Microsoft YaHei", font_size)
+            font.setBold(True)
+        return font
+
+    def local_bounds(self, record):
+        kind = record['kind']
+        if kind == 'text':
+            metrics = QFontMetricsF(self.text_font(record['font_size']))
+            lines = record['text'].split('\n')
+            width = max(metrics.horizontalAdvance(line) for line in lines)
+            return QRectF(0, 0, width + 2 * TEXT_MARGIN, metrics.height() * len(lines) + 2 * TEXT_MARGIN)
+        rect = QRectF(record['start'], record['end']).normalized()
+        if kind == 'arrow':
+            rect = rect.united(arrow_head_polygon(record['start'], record['end']).boundingRect())
+        # 线宽的一半，再留 1 像素给抗锯齿
+        margin = ANNOTATION_PEN_WIDTHS[kind] / 2 + 1
+        return rect.adjusted(-margin, -margin, margin, margin)
+
+    def scene_rect(self, record):
+        return record['bounds'].translated(record['pos'])
+
+    def contains_record(self, record):
+        return self.records.get(record['uid']) is record
+
+    def add_record(self, record):
+        """添加记录（已在标注层中的跳过），返回是否添加"""
+        if record['uid'] is None:
+            record['uid'] = item_uid(record)
+        if record['uid'] in self.records:
+            return False
+        record['bounds'] = self.local_bounds(record)
+        record['seq'] = self.scene().next_stack_seq()
+        self.records[record['uid']] = record
+        self.index(record)
+        self.top_z = max(self.top_z, record['z_value'])
+        self.grow_bounds(self.scene_rect(record))
+        self.place(record)
+        self.update(self.scene_rect(record))
+        return True
+
+    def remove_record(self, record):
+        """移除记录，返回是否移除"""
+        if not self.contains_record(record):
+            return False
+        uid = record['uid']
+        del self.records[uid]
+        self.unindex(uid)
+        self.selected.discard(uid)
+        self.owners.pop(uid, None)
+        self.bounds_stale = True
+        self.update(self.scene_rect(record))
+        return True
 
-    def update_rect(self):
-        """更新矩形的位置和大小"""
-        # 计算矩形区域（处理任意方向的拖拽）
-        x = min(self.start_point.x(), self.end_point.x())
-        y = min(self.start_point.y(), self.end_point.y())
-        width = abs(self.end_point.x() - self.start_point.x())
-        height = abs(self.end_point.y() - self.start_point.y())
+    def clear(self):
+        self.prepareGeometryChange()
+        self.records.clear()
+        self.selected.clear()
+        self.grid.clear()
+        self.cells.clear()
+        self.top_z = 0
+        self.bounds = QRectF()
+        self.bounds_stale = False
+        self.drag = None
+        # AnnotationSlice 随 QGraphicsScene.clear() 一起删除了
+        self.owners.clear()
+        self.slices.clear()
+        self.stack_order = None
+
+    def set_record_pos(self, record, pos):
+        old_rect = self.scene_rect(record)
+        record['pos'] = QPointF(pos)
+        self.reindex(record, old_rect)
+
+    def set_record_z(self, record, z_value):
+        record['z_value'] = z_value
+        self.top_z = max(self.top_z, z_value)
+        self.place(record)
+        self.update(self.scene_rect(record))
+
+    def bring_to_front(self, record):
+        """放到所有图片和标注之上（已经在最上面时不变）"""
+        top = max(self.top_z, self.scene().max_z(SCENE_ITEM_TYPES))
+        if record['z_value'] == top and self.owners.get(record['uid']) is None and all(
+                other['z_value'] < top or other['seq'] <= record['seq'] for other in self.records.values()):
+            return
+        self.set_record_z(record, top + 1)
+
+    def set_text(self, record, text):
+        record['text'] = text
+        self.update_record_bounds(record)
+
+    def set_font_size(self, record, font_size):
+        record['font_size'] = font_size
+        self.update_record_bounds(record)
+
+    def update_record_bounds(self, record):
+        old_rect = self.scene_rect(record)
+        record['bounds'] = self.local_bounds(record)
+        self.reindex(record, old_rect)
+
+    # ----- 与图片的层叠顺序 -----
+
+    @staticmethod
+    def stack_key(record):
+        return record['z_value'], record['seq']
+
+    def restack(self):
+        """图片加入、移除或 Z 值改变后，重新确定每条记录由谁绘制"""
+        self.stack_order = None
+        if not self.records and not self.slices:
+            return
+        for record in self.records.values():
+            self.place(record)
+        # 下方的图片已经不在场景里的 AnnotationSlice 不再需要（正在拖动的除外）
+        scene = self.scene()
+        for anchor, slice_item in list(self.slices.items()):
+            if anchor.scene() is not scene and slice_item is not scene.mouseGrabberItem():
+                if slice_item.scene() is not None:
+                    scene.removeItem(slice_item)
+                del self.slices[anchor]
+
+    def image_stack_order(self):
+        if self.stack_order is None:
+            self.stack_order = sorted((image_stack_key(item), item)
+                                      for item in self.scene().items_of(DraggablePixmapItem))
+        return self.stack_order
+
+    def place(self, record):
+        """把记录交给压在它上面、最低的那张图片下方的 AnnotationSlice；上面没有图片时由标注层绘制"""
+        order = self.image_stack_order()
+        index = bisect.bisect_right(order, (self.stack_key(record),))
+        owner = self.slice_below(order[index][1]) if index < len(order) else None
+        uid = record['uid']
+        if self.owners.get(uid) is owner:
+            return
+        if owner is None:
+            del self.owners[uid]
+        else:
+            self.owners[uid] = owner
+        self.update(self.scene_rect(record))
+
+    def slice_below(self, anchor):
+        """紧贴在图片 anchor 下方的 AnnotationSlice（Z 值相同，插入顺序排在它前面）"""
+        slice_item = self.slices.get(anchor)
+        if slice_item is None:
+            slice_item = self.slices[anchor] = AnnotationSlice(self)
+        if slice_item.scene() is None or slice_item.zValue() != anchor.zValue():
+            scene = self.scene()
+            if slice_item.scene() is not None and slice_item is not scene.mouseGrabberItem():
+                scene.removeItem(slice_item)
+            slice_item.setZValue(anchor.zValue())
+            if slice_item.scene() is None:
+                scene.addItem(slice_item)
+            slice_item.stackBefore(anchor)
+        return slice_item
+
+    def owns(self, item):
+        """item 是否是标注层本身或它的 AnnotationSlice"""
+        return item is self or isinstance(item, AnnotationSlice)
+
+    def drawn_by(self, record, owner):
+        return self.owners.get(record['uid'], self) is owner
+
+    # ----- 网格索引 -----
+
+    def cell_range(self, rect):
+        size = self.GRID_SIZE
+        columns = range(math.floor(rect.left() / size), math.floor(rect.right() / size) + 1)
+        rows = range(math.floor(rect.top() / size), math.floor(rect.bottom() / size) + 1)
+        return columns, rows
+
+    def index(self, record):
+        columns, rows = self.cell_range(self.scene_rect(record))
+        cells = [(column, row) for column in columns for row in rows]
+        self.cells[record['uid']] = cells
+        for cell in cells:
+            self.grid.setdefault(cell, set()).add(record['uid'])
+
+    def unindex(self, uid):
+        for cell in self.cells.pop(uid, ()):
+            uids = self.grid[cell]
+            uids.discard(uid)
+            if not uids:
+                del self.grid[cell]
+
+    def reindex(self, record, old_rect):
+        self.unindex(record['uid'])
+        self.index(record)
+        new_rect = self.scene_rect(record)
+        self.bounds_stale = True
+        self.grow_bounds(new_rect)
+        self.update(old_rect)
+        self.update(new_rect)
+
+    def records_in(self, rect):
+        """边界与 rect 相交的记录"""
+        columns, rows = self.cell_range(rect)
+        if len(columns) * len(rows) > len(self.grid):
+            # 区域比登记的单元还多（缩小查看或导出整个画布），直接检查所有记录
+            candidates = self.records.keys()
+        else:
+            candidates = set()
+            for column in columns:
+                for row in rows:
+                    candidates.update(self.grid.get((column, row), ()))
+        return [self.records[uid] for uid in candidates if self.scene_rect(self.records[uid]).intersects(rect)]
+
+    def hit_test(self, record, point):
+        local = point - record['pos']
+        if not record['bounds'].contains(local):
+            return False
+        if record['kind'] in ('rect', 'text'):
+            return True
+        tolerance = max(self.HIT_TOLERANCE, ANNOTATION_PEN_WIDTHS[record['kind']] / 2)
+        if distance_to_segment(local, record['start'], record['end']) <= tolerance:
+            return True
+        return (record['kind'] == 'arrow'
+                and arrow_head_polygon(record['start'], record['end']).containsPoint(local, Qt.OddEvenFill))
+
+    def record_at(self, point, kinds=None, owner=None):
+        """point 处最上层的记录；owner 不为 None 时只找由它绘制的记录"""
+        hits = [record for record in self.records_in(QRectF(point, QSizeF(1e-3, 1e-3)))
+                if (kinds is None or record['kind'] in kinds) and self.hit_test(record, point)
+                and (owner is None or self.drawn_by(record, owner))]
+        return max(hits, key=self.stack_key, default=None)
+
+    # ----- 边界 -----
+
+    def grow_bounds(self, rect):
+        bounds = self.bounds.united(rect) if not self.bounds.isNull() else QRectF(rect)
+        if bounds != self.bounds:
+            self.prepare_bounds_change()
+            self.bounds = bounds
+
+    def prepare_bounds_change(self):
+        # AnnotationSlice 和标注层共用同一个边界
+        self.prepareGeometryChange()
+        for slice_item in self.slices.values():
+            slice_item.prepareGeometryChange()
+
+    def refresh_bounds(self):
+        """删除或移动记录后收紧边界（导出、合并计算画布范围前调用）"""
+        if not self.bounds_stale:
+            return
+        bounds = QRectF()
+        for record in self.records.values():
+            rect = self.scene_rect(record)
+            bounds = bounds.united(rect) if not bounds.isNull() else rect
+        self.bounds_stale = False
+        if bounds != self.bounds:
+            self.prepare_bounds_change()
+            self.bounds = bounds
+
+    def boundingRect(self):
+        return self.bounds
+
+    def contains(self, point):
+        return self.record_at(point, owner=self) is not None
+
+    def collidesWithPath(self, path, mode=Qt.IntersectsItemShape):
+        return self.owner_collides(self, path)
+
+    def owner_collides(self, owner, path):
+        rect = path.boundingRect()
+        if rect.width() <= 2 and rect.height() <= 2:
+            return self.record_at(rect.center(), owner=owner) is not None
+        return any(self.drawn_by(record, owner) for record in self.records_in(rect))
+
+    # ----- 选中 -----
+
+    def selected_records(self, kinds=None):
+        records = [self.records[uid] for uid in self.selected]
+        return [record for record in records if kinds is None or record['kind'] in kinds]
+
+    def set_selection(self, uids):
+        changed = self.selected.symmetric_difference(uids)
+        self.selected = set(uids)
+        for uid in changed:
+            if uid in self.records:
+                self.update(self.scene_rect(self.records[uid]))
+
+    def clear_selection(self):
+        self.set_selection(set())
+
+    def select_in(self, rect, base=()):
+        """框选：base 之外再选中与 rect 相交的记录"""
+        self.set_selection(set(base) | {record['uid'] for record in self.records_in(rect)})
+
+    # ----- 绘制 -----
+
+    def paint(self, painter, option, widget=None):
+        self.paint_records(painter, option, self)
+
+    def paint_records(self, painter, option, owner):
+        """绘制由 owner 负责的、与重绘区域相交的记录"""
+        records = [record for record in self.records_in(option.exposedRect) if self.drawn_by(record, owner)]
+        for record in sorted(records, key=self.stack_key):
+            pos = record['pos']
+            painter.translate(pos)
+            kind = record['kind']
+            if kind == 'text':
+                painter.setFont(self.text_font(record['font_size']))
+                painter.setPen(ANNOTATION_COLOR)
+                painter.drawText(record['bounds'].adjusted(TEXT_MARGIN, TEXT_MARGIN, -TEXT_MARGIN, -TEXT_MARGIN),
+                                 Qt.AlignLeft | Qt.AlignTop, record['text'])
+            else:
+                painter.setPen(QPen(ANNOTATION_COLOR, ANNOTATION_PEN_WIDTHS[kind], Qt.SolidLine))
+                painter.setBrush(Qt.NoBrush)
+                if kind == 'rect':
+                    painter.drawRect(QRectF(record['start'], record['end']).normalized())
+                else:
+                    painter.drawLine(QLineF(record['start'], record['end']))
+                    if kind == 'arrow':
+                        painter.setBrush(QBrush(ANNOTATION_COLOR))
+                        painter.drawPolygon(arrow_head_polygon(record['start'], record['end']))
 
-        self.rect.setRect(x, y, width, height)
-        self.rect.setPen(self.pen)
-        self.rect.setBrush(QBrush(Qt.transparent))  # 透明填充
+            if record['uid'] in self.selected:
+                # 与 QGraphicsItem 一致的虚线选中框
+                painter.setPen(QPen(option.palette.windowText(), 0, Qt.DashLine))
+                painter.setBrush(Qt.NoBrush)
+                painter.drawRect(record['bounds'])
+            painter.translate(-pos)
+
+    # ----- 鼠标：点选、置顶和拖动 -----
 
     def mousePressEvent(self, event):
-        self.setCursor(Qt.ClosedHandCursor)
+        self.press(event, self)
+
+    def press(self, event, owner):
+        """在 owner（标注层或 AnnotationSlice）上按下鼠标"""
+        record = self.record_at(event.scenePos(), owner=owner)
+        if record is None or event.button() != Qt.LeftButton:
+            event.ignore()
+            return
+
+        uid = record['uid']
+        if event.modifiers() & Qt.ControlModifier:
+            self.set_selection(self.selected ^ {uid})
+        elif uid not in self.selected:
+            self.scene().clearSelection()
+            self.set_selection({uid})
+
         # 选中时自动置顶
-        if self.scene():
-            max_z = 0
-            for item in self.scene().items():
-                if isinstance(item, (DraggablePixmapItem, ArrowItem, LineItem, RectItem)):
-                    max_z = max(max_z, item.zValue())
-            self.setZValue(max_z + 1)
-        super().mousePressEvent(event)
+        self.bring_to_front(record)
+        owner.setCursor(Qt.ClosedHandCursor)
+
+        # 与 Qt 的多选拖动一致：选中的图片和标注一起移动
+        self.drag = {
+            'owner': owner,
+            'start': event.scenePos(),
+            'records': [(self.records[uid], QPointF(self.records[uid]['pos'])) for uid in self.selected],
+            'items': [(item, QPointF(item.pos())) for item in self.scene().selectedItems()
+                      if item.flags() & QGraphicsItem.ItemIsMovable],
+        }
+        event.accept()
+
+    def mouseMoveEvent(self, event):
+        if self.drag is None:
+            return
+        delta = event.scenePos() - self.drag['start']
+        for record, start_pos in self.drag['records']:
+            if self.contains_record(record):
+                self.set_record_pos(record, start_pos + delta)
+        for item, start_pos in self.drag['items']:
+            item.setPos(start_pos + delta)
 
     def mouseReleaseEvent(self, event):
+        if self.drag is not None:
+            self.drag['owner'].setCursor(Qt.OpenHandCursor)
+        self.drag = None
+        self.refresh_bounds()
+
+
+def image_stack_key(item):
+    """图片在层叠顺序中的位置，与标注记录的 AnnotationLayer.stack_key 可比较"""
+    return item.zValue(), item.stack_seq
+
+
+class AnnotationSlice(QGraphicsItem):
+    """绘制被某张图片压住的那部分标注
+
+    紧贴在这张图片下方（Z 值相同，插入顺序排在它前面），记录、选中和拖动仍由
+    标注层管理，这里只负责按自己的层叠位置绘制和接收鼠标事件。
+    """
+    def __init__(self, layer):
+        super().__init__()
+        self.layer = layer
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption, True)
         self.setCursor(Qt.OpenHandCursor)
-        super().mouseReleaseEvent(event)
 
+    def boundingRect(self):
+        return self.layer.bounds
+
+    def contains(self, point):
+        return self.layer.record_at(point, owner=self) is not None
+
+    def collidesWithPath(self, path, mode=Qt.IntersectsItemShape):
+        return self.layer.owner_collides(self, path)
+
+    def paint(self, painter, option, widget=None):
+        self.layer.paint_records(painter, option, self)
+
+    def mousePressEvent(self, event):
+        self.layer.press(event, self)
+
+    def mouseMoveEvent(self, event):
+        self.layer.mouseMoveEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        self.layer.mouseReleaseEvent(event)
+
+
+class DraggablePixmapItem(QGraphicsPixmapItem):
+    """可拖拽的图片项
+
+    显示用的 pixmap 可以是缩小的代理图：source_size 记录原始分辨率，
+    图片项在场景中始终按原始尺寸占位，绘制时把代理图拉伸到这个区域。
+    需要原始像素时（导出、合并、放大查看）再从 file_path 重新解码。
+    pixmap 是唯一常驻的像素缓冲，不另外保留 PIL 原图。
+    缩小后重采样的图片项如果没有 file_path，原 pixmap 保留在 full_pixmap 里。
+    crop 是非破坏性裁剪（原图坐标），只显示这一块，像素和原图都不变。
+    """
+    _placeholder_pixmap = None  # 所有占位项共享的占位图
 
-class TextItem(QGraphicsTextItem):
-    """可拖拽的红色文本"""
-    def __init__(self, text, position, font_size=24):
-        super().__init__(text)
+    def __init__(self, pixmap, file_path=None, source_size=None):
+        super().__init__(pixmap)
         self.setFlag(QGraphicsItem.ItemIsMovable, True)
         self.setFlag(QGraphicsItem.ItemIsSelectable, True)
         self.setFlag(QGraphicsItem.ItemSendsGeometryChanges, True)
+        self.setTransformationMode(Qt.SmoothTransformation)
 
-        # 设置红色字体
-        self.font_size = font_size
-        font = QFont("Microsoft YaHei", font_size)
-        font.setBold(True)
-        self.setFont(font)
-        self.setDefaultTextColor(QColor(255, 0, 0))
+        # 原始分辨率和显示缩放比例
+        self.source_size = QSize(source_size) if source_size is not None else pixmap.size()
+        self.display_scale = 1.0  # 原始图片到显示图片的缩放比例
+        self.user_scale = 1.0  # 用户编辑时的缩放比例
+        self.file_path = file_path  # 保存原始文件路径
+        self.loading = False  # 是否仍是等待解码的占位项
+        self.full_resolution_requested = False  # 是否已在后台请求原始分辨率
+        self.full_pixmap = None  # 没有文件可重新解码时保留的原始分辨率 pixmap
+        self.crop = None  # 只显示原图中的这一块（None 表示完整显示）
+        self.stack_seq = 0  # 加入场景的顺序，Z 值相同时后加入的在上面（见 image_stack_key）
+        self.update_display_scale()
 
-        # 设置位置
-        self.setPos(position)
+        # 设置变换原点为中心
+        self.setTransformOriginPoint(self.boundingRect().center())
 
+        # 设置光标
         self.setCursor(Qt.OpenHandCursor)
 
-    def increase_font_size(self, delta=2):
-        """增大字体"""
-        self.font_size = min(200, self.font_size + delta)
-        font = self.font()
-        font.setPointSize(self.font_size)
-        self.setFont(font)
+    @classmethod
+    def placeholder(cls, file_path):
+        """创建解码完成前显示的占位图片项"""
+        if cls._placeholder_pixmap is None:
+            pixmap = QPixmap(320, 240)
+            pixmap.fill(QColor(230, 230, 230))
+            painter = QPainter(pixmap)
+            painter.setPen(QColor(120, 120, 120))
+            painter.drawRect(0, 0, 319, 239)
+            painter.drawText(pixmap.rect(), Qt.AlignCenter, "加载中...")
+            painter.end()
+            cls._placeholder_pixmap = pixmap
+        item = cls(cls._placeholder_pixmap, file_path=file_path)
+        item.loading = True
+        return item
+
+    def update_display_scale(self):
+        if self.source_size.width() > 0:
+            self.display_scale = self.pixmap().width() / self.source_size.width()
+        else:
+            self.display_scale = 1.0
+
+    def is_proxy(self):
+        """当前显示的是否是缩小的代理图"""
+        return self.display_scale < 1.0
+
+    def set_image(self, pixmap, source_size=None):
+        """解码完成后替换占位图为真实像素（也用于代理图和原图之间的切换）"""
+        self.prepareGeometryChange()
+        self.setPixmap(pixmap)
+        self.source_size = QSize(source_size) if source_size is not None else pixmap.size()
+        self.update_display_scale()
+        if not self.is_proxy():
+            self.full_pixmap = None
+        self.loading = False
+        self.full_resolution_requested = False
+        self.setTransformOriginPoint(self.boundingRect().center())
 
-    def decrease_font_size(self, delta=2):
-        """减小字体"""
-        self.font_size = max(8, self.font_size - delta)
-        font = self.font()
-        font.setPointSize(self.font_size)
-        self.setFont(font)
+    def visible_rect(self):
+        """显示出来的区域（图片项坐标，即原图坐标），裁剪后是裁剪框"""
+        if self.crop is not None:
+            return QRectF(self.crop)
+        return QRectF(self.offset(), QSizeF(self.source_size))
+
+    def set_crop(self, crop):
+        """设置非破坏性裁剪；变换原点保持不变，未裁掉的部分在场景中的位置不动"""
+        self.prepareGeometryChange()
+        self.crop = QRectF(crop) if crop is not None else None
+        self.update()
+
+    def full_resolution_pixmap(self):
+        """能直接拿到的最高分辨率 pixmap（有 file_path 的代理图仍需重新解码）"""
+        return self.full_pixmap if self.full_pixmap is not None else self.pixmap()
+
+    def resample(self, display_scale):
+        """把显示用的 pixmap 平滑缩小到原图的 display_scale 倍，图片在场景中的大小不变"""
+        if self.loading or display_scale >= self.display_scale:
+            return
+        if self.file_path:
+            full_pixmap = None  # 需要原图时从文件重新解码
+        else:
+            full_pixmap = self.full_resolution_pixmap()
+        pixmap = self.pixmap().scaled(max(1, round(self.source_size.width() * display_scale)),
+                                      max(1, round(self.source_size.height() * display_scale)),
+                                      Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        self.set_image(pixmap, self.source_size)
+        self.full_pixmap = full_pixmap
+
+    def restore_full_pixmap(self):
+        """换回保留在内存里的原始分辨率 pixmap"""
+        if sip.isdeleted(self) or self.full_pixmap is None:
+            return
+        self.set_image(self.full_pixmap, self.source_size)
+
+    def request_full_resolution(self):
+        """在后台加载原始分辨率像素，完成后自动替换代理图"""
+        if self.full_resolution_requested or not self.is_proxy():
+            return
+        if self.full_pixmap is not None:
+            # 原图就在内存里；绘制过程中不能改几何形状，放到下一轮事件循环
+            self.full_resolution_requested = True
+            QTimer.singleShot(0, self.restore_full_pixmap)
+        elif self.file_path:
+            self.full_resolution_requested = True
+            FullResolutionLoader.instance().load(self)
+
+    def boundingRect(self):
+        if not self.is_proxy() and self.crop is None:
+            return super().boundingRect()
+        rect = self.visible_rect()
+        if self.transformationMode() == Qt.SmoothTransformation:
+            # 与 QGraphicsPixmapItem 相同：平滑缩放时四周各留半个像素
+            rect.adjust(-0.5, -0.5, 0.5, 0.5)
+        return rect
+
+    def shape(self):
+        if self.crop is not None:
+            shape = QPainterPath()
+            shape.addRect(self.crop)
+            return shape
+        shape = super().shape()
+        if self.is_proxy():
+            shape = QTransform.fromScale(1 / self.display_scale, 1 / self.display_scale).map(shape)
+        return shape
+
+    def paint(self, painter, option, widget=None):
+        device = painter.device()
+        device_scale = option.levelOfDetailFromTransform(painter.worldTransform())
+        if device is not None:
+            device_scale *= device.devicePixelRatioF()
+
+        # 代理图被放大显示时（视图放大到接近原始分辨率），在后台换成原图
+        if self.is_proxy() and device_scale > self.display_scale * 1.1:
+            self.request_full_resolution()
+
+        pixmap = self.pixmap()
+        smooth = self.transformationMode() == Qt.SmoothTransformation
+        pixel_scale = device_scale / self.display_scale  # 每个 pixmap 像素对应的目标像素数
+        expanded = (smooth and isinstance(device, QImage)
+                    and painter.worldTransform().type() > QTransform.TxTranslate)
+        if expanded:
+            # 导出时的平滑变换按展开后的 32 位像素计算，与紧凑格式之前的导出结果逐像素一致；
+            # 大幅缩小时先平滑缩放像素再绘制，避免双线性采样产生锯齿
+            pixmap = export_pixmap(pixmap, pixel_scale)
+        elif smooth and not self.loading and mipmap_level_for(pixel_scale) > 0:
+            # 视图缩小时绘制尺寸最接近的 mipmap 层级（还没生成时先绘制原图）
+            level_pixmap = MipmapCache.instance().level_pixmap(self, pixmap, mipmap_level_for(pixel_scale))
+            if level_pixmap is not None:
+                pixmap = level_pixmap
+            elif not self.is_proxy() and self.crop is None:
+                super().paint(painter, option, widget)
+                return
+        elif not self.is_proxy() and self.crop is None:
+            super().paint(painter, option, widget)
+            return
+
+        # 只绘制显示区域对应的那部分像素（pixmap 可能是代理图、mipmap 层级或预缩小的图）
+        target = self.visible_rect()
+        factor = pixmap.width() / self.source_size.width()
+        source = QRectF((target.topLeft() - self.offset()) * factor, target.size() * factor)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, smooth)
+        painter.drawPixmap(target, pixmap, source)
+
+        if option.state & QStyle.State_Selected:
+            # 与 QGraphicsPixmapItem 一致的虚线选中框
+            painter.setPen(QPen(option.palette.windowText(), 0, Qt.DashLine))
+            painter.setBrush(Qt.NoBrush)
+            painter.drawRect(self.boundingRect())
+
+    def scale_by(self, factor):
+        """按比例缩放图片"""
+        self.user_scale *= factor
+        self.setScale(self.user_scale)
 
     def mousePressEvent(self, event):
         self.setCursor(Qt.ClosedHandCursor)
-        # 选中时自动置顶
+        # 选中时自动置顶：放到场景中所有图片之上
         if self.scene():
-            max_z = 0
-            for item in self.scene().items():
-                if isinstance(item, (DraggablePixmapItem, ArrowItem, LineItem, RectItem, TextItem)):
-                    max_z = max(max_z, item.zValue())
-            self.setZValue(max_z + 1)
+            self.scene().bring_to_front(self, (DraggablePixmapItem,))
         super().mousePressEvent(event)
 
     def mouseReleaseEvent(self, event):
@@ -735,110 +1906,1757 @@ class TextItem(QGraphicsTextItem):
         super().mouseReleaseEvent(event)
 
 
-class ArrowItem(QGraphicsItemGroup):
-    """可拖拽的箭头"""
-    def __init__(self, start_point, end_point):
+# ===== 画布场景 =====
+
+# 场景登记的顶层项目类型（箭头、线条、矩形框和文字是标注层里的记录，不是场景项目）
+SCENE_ITEM_TYPES = (DraggablePixmapItem,)
+
+
+class ComposerScene(QGraphicsScene):
+    """画布场景：按类型登记顶层项目，并记录每种类型当前的最大 Z 值
+
+    添加/删除项目时更新登记，置顶时不再遍历 scene.items()。最大 Z 值只在该
+    类型的最高项目被删除或降低时才标记为过期，下次查询时只在这一种类型里
+    重新计算。场景始终带着一个标注层（annotations），clear() 后保留；
+    图片加入、移除或改变 Z 值时通知标注层重新确定标注和图片的上下关系。
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.registry = {item_type: {} for item_type in SCENE_ITEM_TYPES}  # 类型 -> {项目: None}（保持添加顺序）
+        self.top_z = {item_type: 0 for item_type in SCENE_ITEM_TYPES}
+        self.stale_top_z = set()
+        self.stack_seq = 0  # 图片和标注共用的加入顺序计数
+        self.annotations = AnnotationLayer()
+        super().addItem(self.annotations)
+
+    def next_stack_seq(self):
+        self.stack_seq += 1
+        return self.stack_seq
+
+    @staticmethod
+    def registry_type(item):
+        for item_type in SCENE_ITEM_TYPES:
+            if isinstance(item, item_type):
+                return item_type
+        return None
+
+    def addItem(self, item):
+        super().addItem(item)
+        item_type = self.registry_type(item)
+        if item_type is not None:
+            item.stack_seq = self.next_stack_seq()
+            self.registry[item_type][item] = None
+            self.top_z[item_type] = max(self.top_z[item_type], item.zValue())
+            self.annotations.restack()
+
+    def removeItem(self, item):
+        item_type = self.registry_type(item)
+        registered = item_type is not None and item in self.registry[item_type]
+        if registered:
+            del self.registry[item_type][item]
+            if item.zValue() >= self.top_z[item_type]:
+                self.stale_top_z.add(item_type)
+        super().removeItem(item)
+        if registered:
+            self.annotations.restack()
+
+    def clear(self):
+        # 标注层先移出场景，避免被 QGraphicsScene.clear() 删除
+        super().removeItem(self.annotations)
+        super().clear()
+        self.annotations.clear()
+        super().addItem(self.annotations)
+        for item_type in SCENE_ITEM_TYPES:
+            self.registry[item_type].clear()
+            self.top_z[item_type] = 0
+        self.stale_top_z.clear()
+
+    def items_of(self, *item_types):
+        """登记的项目（默认所有类型），按类型和添加顺序排列"""
+        return [item for item_type in (item_types or SCENE_ITEM_TYPES) for item in self.registry[item_type]]
+
+    def has_items(self, *item_types):
+        return any(self.registry[item_type] for item_type in (item_types or SCENE_ITEM_TYPES))
+
+    def has_content(self):
+        """画布上是否有图片或标注"""
+        return self.has_items() or bool(self.annotations.records)
+
+    def itemsBoundingRect(self):
+        # 删除或移动标注后标注层的边界可能偏大，先收紧
+        self.annotations.refresh_bounds()
+        return super().itemsBoundingRect()
+
+    def max_z(self, item_types):
+        """这些类型的项目中最大的 Z 值（没有项目时为 0）"""
+        for item_type in item_types:
+            if item_type in self.stale_top_z:
+                self.top_z[item_type] = max((item.zValue() for item in self.registry[item_type]), default=0)
+                self.stale_top_z.discard(item_type)
+        return max(0, max(self.top_z[item_type] for item_type in item_types))
+
+    def set_item_z(self, item, z_value):
+        """设置项目的 Z 值并更新该类型的最大值"""
+        old_z = item.zValue()
+        item.setZValue(z_value)
+        item_type = self.registry_type(item)
+        if item_type is None or item not in self.registry[item_type]:
+            return
+        if z_value >= self.top_z[item_type]:
+            self.top_z[item_type] = z_value
+        elif old_z >= self.top_z[item_type]:
+            self.stale_top_z.add(item_type)
+        if z_value != old_z:
+            self.annotations.restack()
+
+    def bring_to_front(self, item, item_types):
+        """把项目放到 item_types 这些类型的所有项目之上"""
+        self.set_item_z(item, self.max_z(item_types) + 1)
+
+
+# ===== 异步导入管线 =====
+
+# PIL 模式 -> (QImage 格式, 每像素字节数)；这些模式的 tobytes() 布局与 Qt 格式完全一致
+PIL_QIMAGE_FORMATS = {
+    'RGB': (QImage.Format_RGB888, 3),
+    'RGBA': (QImage.Format_RGBA8888, 4),
+    'L': (QImage.Format_Grayscale8, 1),
+    'P': (QImage.Format_Indexed8, 1),
+}
+
+
+def pil_palette_color_table(pil_image):
+    """把P模式图片的调色板（含透明索引）转换为QImage颜色表"""
+    palette = pil_image.getpalette() or []
+    colors = [QColor(*palette[i:i + 3]).rgb() for i in range(0, len(palette) - 2, 3)]
+
+    transparency = pil_image.info.get('transparency')
+    if isinstance(transparency, int):
+        if transparency < len(colors):
+            colors[transparency] &= 0x00FFFFFF
+    elif isinstance(transparency, (bytes, bytearray)):
+        for index, alpha in enumerate(transparency[:len(colors)]):
+            colors[index] = (colors[index] & 0x00FFFFFF) | (alpha << 24)
+
+    # 调色板不足256色时补齐，避免越界索引显示为未定义颜色
+    colors += [QColor(0, 0, 0).rgb()] * (256 - len(colors))
+    return colors
+
+
+def pil_image_has_alpha(pil_image):
+    """图片是否真正用到了透明度（全部不透明的 alpha 通道不算）"""
+    if 'transparency' in pil_image.info:
+        return True
+    bands = pil_image.getbands()
+    for alpha_band in ('A', 'a'):
+        if alpha_band in bands:
+            # 只取 alpha 通道统计，比对整张图 getextrema() 快得多
+            return pil_image.getchannel(alpha_band).getextrema()[0] < 255
+    return False
+
+
+def pil_to_qimage(pil_image):
+    """将PIL图片转换为QImage（可在工作线程中调用）
+
+    按图片实际内容选择最小的原生 Qt 格式：不透明图片用 RGB888，灰度用
+    Grayscale8，调色板用 Indexed8（透明索引写入颜色表），只有真正用到
+    透明度时才用 RGBA8888。tobytes() 是唯一的一次复制；QImage 不复制
+    缓冲区，PyQt 在 QImage 对象存活期间持有它的引用，需要长期保存的像素
+    应转成 QPixmap 或 copy()。
+    """
+    rawmode = pil_image.mode
+    # P 的透明度由颜色表表达；不带 tRNS 的 L/RGB 可直接使用
+    if not (rawmode == 'P' or (rawmode in ('L', 'RGB') and 'transparency' not in pil_image.info)):
+        grayscale = set(pil_image.getbands()) <= {'1', 'L', 'I', 'F', 'A', 'a'}
+        if pil_image_has_alpha(pil_image):
+            rawmode = 'RGBA'
+        else:
+            rawmode = 'L' if grayscale else 'RGB'
+
+        # 不透明的 RGBA 直接按 RGB 打包，省去一次 convert
+        if not (pil_image.mode == 'RGBA' and rawmode == 'RGB'):
+            pil_image = pil_image.convert(rawmode)
+
+    qformat, bytes_per_pixel = PIL_QIMAGE_FORMATS[rawmode]
+    width, height = pil_image.size
+
+    # 行与行之间紧密排列，必须显式传入 bytesPerLine（Qt 默认按 4 字节对齐）
+    data = pil_image.tobytes('raw', rawmode)
+    qimage = QImage(data, width, height, width * bytes_per_pixel, qformat)
+    if qformat == QImage.Format_Indexed8:
+        qimage.setColorTable(pil_palette_color_table(pil_image))
+    return qimage
+
+
+def qimage_to_qpixmap(qimage):
+    """QImage -> QPixmap（只能在主线程调用）
+
+    默认情况下 Qt 会把所有图片展开成32位；RGB888/灰度/调色板图片保留原格式，
+    分别节省 25%/75% 的显示内存，绘制结果不变。
+    """
+    if qimage.format() in (QImage.Format_RGB888, QImage.Format_Grayscale8, QImage.Format_Indexed8):
+        # 不做格式转换时 QPixmap 会直接共享 QImage 的内存，而 pil_to_qimage 的缓冲区
+        # 只随 Python 对象存活，所以先复制一份由 Qt 自己管理的缓冲区
+        return QPixmap.fromImage(qimage.copy(), Qt.NoFormatConversion)
+    return QPixmap.fromImage(qimage)
+
+
+def expanded_pixmap(pixmap):
+    """qimage_to_qpixmap 保留的紧凑格式展开成 Qt 默认的 32 位格式
+
+    Qt 对 RGB888/灰度/调色板像素做平滑缩放和变换时走的计算路径与 32 位格式不同，
+    结果会有几个色阶的差别；导出时先展开，保证输出与以前完全相同。
+    """
+    if pixmap.depth() >= 32:
+        return pixmap
+    return QPixmap.fromImage(pixmap.toImage())
+
+
+class ExportPixmapCache:
+    """分块导出期间缓存 export_pixmap 的结果
+
+    分块导出每个条带都会调用一次 paint，不缓存时每个条带都要把整张图片重新展开、
+    缩放一遍。只在 with 块内生效，结束后立即释放，平时不多占内存。
+    """
+    active = None
+
+    def __init__(self):
+        self.pixmaps = {}  # (pixmap.cacheKey(), 宽, 高) -> 展开/缩放后的 pixmap
+
+    def __enter__(self):
+        ExportPixmapCache.active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        ExportPixmapCache.active = None
+        self.pixmaps.clear()
+
+    @classmethod
+    def lookup(cls, key, build):
+        cache = cls.active
+        if cache is None:
+            return build()
+        pixmap = cache.pixmaps.get(key)
+        if pixmap is None:
+            pixmap = cache.pixmaps[key] = build()
+        return pixmap
+
+
+def export_pixmap(pixmap, pixel_scale):
+    """导出时实际绘制的 pixmap：紧凑格式展开成 32 位，每个像素缩小到不足半个目标像素时先平滑缩放"""
+    size = pixmap.size()
+    if pixel_scale < 0.5:
+        size = QSize(max(1, round(size.width() * pixel_scale)), max(1, round(size.height() * pixel_scale)))
+
+    def build():
+        result = expanded_pixmap(pixmap)
+        if result.size() != size:
+            result = result.scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        return result
+
+    return ExportPixmapCache.lookup((pixmap.cacheKey(), size.width(), size.height()), build)
+
+
+def decode_image_file(file_path, max_edge=0, trim=False):
+    """解码图片文件（可在工作线程中调用）
+
+    max_edge > 0 且图片最长边超过它时，生成缩小的显示代理：JPEG 利用 draft
+    模式直接在 DCT 阶段按 1/2、1/4、1/8 解码，其余格式用 Image.reduce 整数倍缩小。
+    返回 {'qimage', 'source_size'}；qimage 与 PIL 图片共享缓冲区，转换成 QPixmap 后即可释放。
+    trim=True 时还返回 'trim'：去掉四周纯色边框后的内容区域（原图坐标），见 auto_trim_rect。
+    """
+    decoded = decode_image_pixels(file_path, max_edge)
+    if trim:
+        decoded['trim'] = auto_trim_rect(decoded['qimage'], decoded['source_size'])
+    return decoded
+
+
+def decode_image_pixels(file_path, max_edge):
+    """decode_image_file 的解码部分：返回 {'qimage', 'source_size'}"""
+    pil_image = Image.open(file_path)
+    source_size = QSize(*pil_image.size)
+
+    factor = math.ceil(max(pil_image.size) / max_edge) if max_edge > 0 else 1
+    if factor <= 1:
+        pil_image.load()
+        return {'qimage': pil_to_qimage(pil_image), 'source_size': source_size}
+
+    target = (max(1, pil_image.width // factor), max(1, pil_image.height // factor))
+    if pil_image.format == 'JPEG':
+        pil_image.draft(pil_image.mode, target)
+    pil_image.load()
+
+    # 调色板/二值图的像素值不能直接平均，先转换为真彩色或灰度
+    if pil_image.mode in ('P', '1', 'PA'):
+        if pil_image_has_alpha(pil_image):
+            pil_image = pil_image.convert('RGBA')
+        else:
+            pil_image = pil_image.convert('L' if pil_image.mode == '1' else 'RGB')
+
+    remaining = pil_image.width // target[0]
+    if remaining > 1:
+        pil_image = pil_image.reduce(remaining)
+    return {'qimage': pil_to_qimage(pil_image), 'source_size': source_size}
+
+
+# ===== 导入时自动裁边 =====
+
+# 每次从边缘往里检查的行（列）数：边框通常很窄，只扫描边框附近，不用遍历整张图
+TRIM_SCAN_CHUNK = 64
+
+# 每个通道 8 位的 QImage 格式 -> 每像素字节数
+QIMAGE_CHANNELS = {
+    QImage.Format_RGB888: 3,
+    QImage.Format_RGBA8888: 4,
+    QImage.Format_Grayscale8: 1,
+    QImage.Format_Indexed8: 1,
+    QImage.Format_RGB32: 4,
+    QImage.Format_ARGB32: 4,
+    QImage.Format_ARGB32_Premultiplied: 4,
+}
+
+
+def qimage_channels(qimage):
+    """QImage 像素的 (高, 宽, 通道) uint8 数组，与 QImage 共享内存；不支持的格式返回 None"""
+    channels = QIMAGE_CHANNELS.get(qimage.format())
+    if channels is None or qimage.isNull():
+        return None
+    data = qimage.constBits()
+    data.setsize(qimage.sizeInBytes())
+    rows = np.frombuffer(data, np.uint8).reshape(qimage.height(), qimage.bytesPerLine())
+    return rows[:, :qimage.width() * channels].reshape(qimage.height(), qimage.width(), channels)
+
+
+def uniform_lines(pixels, color, tolerance, axis, from_end=False):
+    """从一边往里数，有多少行（axis=0）或列（axis=1）的像素全部接近 color"""
+    height, width, channels = pixels.shape
+    # 范围检查用 uint8 回绕减法一次完成：(p - low) <= span 等价于 low <= p <= low + span，
+    # 低于 low 的值回绕成大数；每个通道的上下限按 width 平铺，和一整行像素逐字节对齐
+    low = np.maximum(color.astype(np.int16) - tolerance, 0).astype(np.uint8)
+    span = np.minimum(color.astype(np.int16) + tolerance, 255).astype(np.uint8) - low
+    lows, spans = np.tile(low, width), np.tile(span, width)
+    # 每块复用同一组缓冲区，避免反复分配大块临时数组
+    if axis == 0:
+        diff = np.empty((TRIM_SCAN_CHUNK, width * channels), np.uint8)
+    else:
+        diff = np.empty((height, TRIM_SCAN_CHUNK * channels), np.uint8)
+    near = np.empty(diff.shape, bool)
+
+    length = pixels.shape[axis]
+    count = 0
+    while count < length:
+        size = min(TRIM_SCAN_CHUNK, length - count)
+        start = length - count - size if from_end else count
+        if axis == 0:
+            block = pixels[start:start + size].reshape(size, width * channels)
+            d, n = diff[:size], near[:size]
+            np.subtract(block, lows, out=d)
+            np.less_equal(d, spans, out=n)
+            inside = n.all(axis=1)
+        else:
+            block = pixels[:, start:start + size].reshape(height, size * channels)
+            d, n = diff[:, :size * channels], near[:, :size * channels]
+            np.subtract(block, lows[:size * channels], out=d)
+            np.less_equal(d, spans[:size * channels], out=n)
+            inside = n.all(axis=0).reshape(size, channels).all(axis=1)
+        if from_end:
+            inside = inside[::-1]
+        if not inside.all():
+            return count + int(np.argmin(inside))
+        count += size
+    return length
+
+
+def content_bounds(qimage, tolerance=AUTO_TRIM_TOLERANCE):
+    """去掉四周纯色边框后的内容区域 (left, top, right, bottom)，右下不含
+
+    每条边分别以该边中点的颜色作为边框色，先裁上下，再在剩下的行里裁左右。
+    没有可裁的边框、整张图都是同一种颜色或格式不支持时返回 None。
+    """
+    pixels = qimage_channels(qimage)
+    if pixels is None:
+        return None
+    if qimage.format() == QImage.Format_Indexed8:
+        tolerance = 0  # 调色板序号之间没有远近之分
+    height, width = pixels.shape[:2]
+
+    top = uniform_lines(pixels, pixels[0, width // 2], tolerance, 0)
+    if top == height:
+        return None
+    bottom = height - uniform_lines(pixels, pixels[-1, width // 2], tolerance, 0, from_end=True)
+    rows = pixels[top:bottom]
+    middle = (bottom - top) // 2
+    left = uniform_lines(rows, rows[middle, 0], tolerance, 1)
+    right = width - uniform_lines(rows, rows[middle, -1], tolerance, 1, from_end=True)
+    if (left, top, right, bottom) == (0, 0, width, height):
+        return None
+    return left, top, right, bottom
+
+
+def auto_trim_rect(qimage, source_size, tolerance=AUTO_TRIM_TOLERANCE):
+    """自动裁边的裁剪框（原图坐标 QRectF，可直接交给 set_crop）；不需要裁剪时返回 None
+
+    qimage 是缩小的代理图时，按比例换算到原图坐标并向外取整，宁可少裁也不裁掉内容。
+    """
+    bounds = content_bounds(qimage, tolerance)
+    if bounds is None:
+        return None
+    left, top, right, bottom = bounds
+    scale_x = source_size.width() / qimage.width()
+    scale_y = source_size.height() / qimage.height()
+    left, top = math.floor(left * scale_x), math.floor(top * scale_y)
+    right = min(source_size.width(), math.ceil(right * scale_x))
+    bottom = min(source_size.height(), math.ceil(bottom * scale_y))
+    return QRectF(left, top, right - left, bottom - top)
+
+
+class ImageDecodeSignals(QObject):
+    """解码任务的信号（工作线程 -> 主线程）"""
+    decoded = pyqtSignal(int, int, object)  # batch_id, 序号, decode_image_file 的结果
+    failed = pyqtSignal(int, int, str)      # batch_id, 序号, 错误信息
+
+
+class ImageDecodeTask(QRunnable):
+    """在线程池中解码一张图片，并转换为 QImage"""
+    def __init__(self, batch, index, signals):
         super().__init__()
-        self.setFlag(QGraphicsItem.ItemIsMovable, True)
-        self.setFlag(QGraphicsItem.ItemIsSelectable, True)
-        
+        self.batch = batch
+        self.index = index
+        self.signals = signals
 
-        self.start_point = start_point
-        self.end_point = end_point
+    def run(self):
+        if self.batch.cancelled:
+            return
+        file_path = self.batch.file_paths[self.index]
+        try:
+            decoded = decode_image_file(file_path, PROXY_MAX_EDGE, trim=self.batch.auto_trim)
+        except Exception as e:
+            if not self.batch.cancelled:
+                self.signals.failed.emit(self.batch.batch_id, self.index, str(e))
+            return
+        if not self.batch.cancelled:
+            self.signals.decoded.emit(self.batch.batch_id, self.index, decoded)
 
-        # 箭头样式
-        self.pen = QPen(QColor(255, 0, 0), 3, Qt.SolidLine)
-        self.arrow_size = 15
 
-        # 创建箭头的线条和箭头头部
-        self.line = QGraphicsLineItem()
-        self.arrow_head = QGraphicsPolygonItem()
+class FullResolutionSignals(QObject):
+    loaded = pyqtSignal(object, object)  # 图片项, decode_image_file 的结果（失败时为 None）
 
-        self.addToGroup(self.line)
-        self.addToGroup(self.arrow_head)
 
-        self.update_arrow()
+class FullResolutionTask(QRunnable):
+    """在后台解码代理图片项对应的原图"""
+    def __init__(self, item, file_path, signals):
+        super().__init__()
+        self.item = item
+        self.file_path = file_path
+        self.signals = signals
 
-        self.setCursor(Qt.OpenHandCursor)
+    def run(self):
+        try:
+            decoded = decode_image_file(self.file_path)
+        except Exception as e:
+            print(f"无法加载原图 {os.path.basename(self.file_path)}: {e}")
+            decoded = None
+        self.signals.loaded.emit(self.item, decoded)
 
-    def update_arrow(self):
-        """更新箭头的位置和形状"""
-        # 设置线条
-        line = QLineF(self.start_point, self.end_point)
-        self.line.setLine(line)
-        self.line.setPen(self.pen)
-
-        # 计算箭头头部
-        arrow_p1 = self.end_point - QPointF(
-            self.arrow_size * (line.dx() / line.length() + 0.5 * line.dy() / line.length()),
-            self.arrow_size * (line.dy() / line.length() - 0.5 * line.dx() / line.length())
-        )
-        arrow_p2 = self.end_point - QPointF(
-            self.arrow_size * (line.dx() / line.length() - 0.5 * line.dy() / line.length()),
-            self.arrow_size * (line.dy() / line.length() + 0.5 * line.dx() / line.length())
-        )
 
-        arrow_head_polygon = QPolygonF([self.end_point, arrow_p1, arrow_p2])
-        self.arrow_head.setPolygon(arrow_head_polygon)
-        self.arrow_head.setPen(self.pen)
-        self.arrow_head.setBrush(QBrush(self.pen.color()))
+class FullResolutionLoader(QObject):
+    """按需把代理图替换为原始分辨率（放大查看时触发）"""
+    _instance = None
 
-    def mousePressEvent(self, event):
-        self.setCursor(Qt.ClosedHandCursor)
-        # 选中时自动置顶
-        if self.scene():
-            max_z = 0
-            for item in self.scene().items():
-                if isinstance(item, (DraggablePixmapItem, ArrowItem, LineItem, RectItem)):
-                    max_z = max(max_z, item.zValue())
-            self.setZValue(max_z + 1)
-        super().mousePressEvent(event)
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        super().__init__()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(2)
+        self.signals = FullResolutionSignals()
+        self.signals.loaded.connect(self.on_loaded)
+
+    def load(self, item):
+        self.pool.start(FullResolutionTask(item, item.file_path, self.signals))
+
+    def on_loaded(self, item, decoded):
+        # 加载期间图片项可能已被删除、合并，或已经同步加载过原图
+        if decoded is None or item.scene() is None or not item.is_proxy():
+            return
+        item.set_image(qimage_to_qpixmap(decoded['qimage']), decoded['source_size'])
+
+
+def load_full_resolution_items(items):
+    """导出/合并前把代理图片项换成原图（并行解码），返回加载失败的图片项"""
+    for item in items:
+        if item.is_proxy():
+            item.restore_full_pixmap()
+    proxies = [item for item in items if item.is_proxy() and item.file_path]
+    if not proxies:
+        return []
+
+    def decode(item):
+        try:
+            return decode_image_file(item.file_path)
+        except Exception as e:
+            print(f"无法加载原图 {os.path.basename(item.file_path)}: {e}")
+            return None
+
+    with ThreadPoolExecutor() as executor:
+        results = list(executor.map(decode, proxies))
+
+    failed = []
+    for item, decoded in zip(proxies, results):
+        if decoded is None:
+            failed.append(item)
+        else:
+            item.set_image(qimage_to_qpixmap(decoded['qimage']), decoded['source_size'])
+    return failed
+
+
+def failed_originals_message(items):
+    """原图加载失败时的提示文字"""
+    names = [os.path.basename(item.file_path) for item in items]
+    shown = "、".join(names[:3]) + (f" 等 {len(names)} 张" if len(names) > 3 else "")
+    return f"无法加载原图 {shown}"
+
+
+def mipmap_level_for(pixel_scale):
+    """每个 pixmap 像素对应 pixel_scale 个目标像素时应绘制的层级
+
+    第 k 层的宽高是原图的 1/2^k；取不低于目标分辨率的最小一层，0 表示直接绘制原图。
+    """
+    if pixel_scale >= 0.5 or pixel_scale <= 0:
+        return 0
+    return int(math.floor(math.log2(1 / pixel_scale)))
+
+
+class MipmapSignals(QObject):
+    built = pyqtSignal(object, int, QImage)  # pixmap 缓存键, 层级, 该层的图片
+
+
+class MipmapTask(QRunnable):
+    """在后台从已有的一层逐级减半，生成直到目标层级的每一层"""
+    def __init__(self, key, image, level, target_level, signals):
+        super().__init__()
+        self.key = key
+        self.image = image
+        self.level = level
+        self.target_level = target_level
+        self.signals = signals
+
+    def run(self):
+        image = self.image
+        for level in range(self.level + 1, self.target_level + 1):
+            image = image.scaled(max(1, image.width() // 2), max(1, image.height() // 2),
+                                 Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+            self.signals.built.emit(self.key, level, image)
+
+
+class MipmapCache(QObject):
+    """图片项缩小显示时使用的多级缩略图，按 (pixmap 缓存键, 层级) 做 LRU，受内存上限约束
+
+    视图缩小时每次重绘都对整张大图平滑采样很慢，改为绘制尺寸最接近的一层。
+    层级在后台生成，生成完成前照常绘制原 pixmap。
+    """
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(MIPMAP_CACHE_MB * 1024 * 1024)
+        return cls._instance
+
+    def __init__(self, max_bytes):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # (缓存键, 层级) -> QPixmap
+        self.total_bytes = 0
+        self.pending = {}  # 正在生成的 (缓存键, 层级) -> 生成后需要重绘的图片项
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.signals = MipmapSignals()
+        self.signals.built.connect(self.on_built)
+
+    @staticmethod
+    def pixmap_bytes(pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def level_pixmap(self, item, pixmap, level):
+        """返回 pixmap 第 level 层的缩略图；还没有时在后台生成，先返回 None"""
+        # 最小的一层短边不少于 1 像素
+        level = min(level, int(math.log2(max(1, min(pixmap.width(), pixmap.height())))))
+        if level <= 0 or self.max_bytes <= 0:
+            return None
+        key = pixmap.cacheKey()
+        cached = self.entries.get((key, level))
+        if cached is not None:
+            self.entries.move_to_end((key, level))
+            return cached
+
+        waiting = self.pending.get((key, level))
+        if waiting is not None:
+            if item not in waiting:
+                waiting.append(item)
+            return None
+
+        # 从已缓存的最近一层继续减半，没有时从原 pixmap 开始
+        base_level = next((l for l in range(level - 1, 0, -1) if (key, l) in self.entries), 0)
+        base = self.entries[(key, base_level)] if base_level else pixmap
+        for l in range(base_level + 1, level):
+            self.pending.setdefault((key, l), [])
+        self.pending[(key, level)] = [item]
+        self.pool.start(MipmapTask(key, base.toImage(), base_level, level, self.signals))
+        return None
+
+    def on_built(self, key, level, image):
+        waiting = self.pending.pop((key, level), [])
+        self.put((key, level), QPixmap.fromImage(image))
+        for item in waiting:
+            # 生成期间图片项可能已被删除或移出场景
+            if not sip.isdeleted(item) and item.scene() is not None:
+                item.update()
+
+    def put(self, key, pixmap):
+        size = self.pixmap_bytes(pixmap)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.total_bytes -= self.pixmap_bytes(self.entries.pop(key))
+        self.entries[key] = pixmap
+        self.total_bytes += size
+
+        # 超出内存上限时淘汰最久未使用的
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= self.pixmap_bytes(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+# ===== 缩略图磁盘缓存 =====
+
+class ThumbnailSignals(QObject):
+    ready = pyqtSignal(str, QImage)  # 原图路径, 缩略图
+
+
+class ThumbnailTask(QRunnable):
+    """在线程池中生成一张缩略图并写入磁盘缓存"""
+    def __init__(self, cache, file_path):
+        super().__init__()
+        self.cache = cache
+        self.file_path = file_path
+
+    def run(self):
+        try:
+            thumbnail = self.cache.load(self.file_path) or self.cache.generate(self.file_path)
+        except Exception as e:
+            print(f"无法生成缩略图 {os.path.basename(self.file_path)}: {e}")
+            thumbnail = None
+        finally:
+            self.cache.task_finished(self.file_path)
+        if thumbnail is not None:
+            self.cache.signals.ready.emit(self.file_path, thumbnail)
+
+
+class ThumbnailCache(QObject):
+    """选择器缩略图的磁盘缓存
+
+    缓存文件以 (路径, 修改时间, 大小) 的 SHA-1 命名，原图改动后自然失效。
+    缩略图由后台线程生成（JPEG 走 draft 模式，不需要完整解码大图）；命中时
+    更新文件修改时间，超出容量上限时按修改时间淘汰最久未用的缩略图。
+    """
+    SIZE = 200
+    EVICT_EVERY = 32  # 每写入多少张检查一次容量
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls(THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MB * 1024 * 1024)
+        return cls._instance
+
+    def __init__(self, directory, max_bytes):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max(1, min(4, QThreadPool.globalInstance().maxThreadCount())))
+        self.signals = ThumbnailSignals()
+        self.tasks = {}  # 原图路径 -> 排队/运行中的 ThumbnailTask
+        self.lock = threading.Lock()
+        self.writes_since_evict = self.EVICT_EVERY  # 首次写入时先检查一次
+
+    def cache_path(self, file_path):
+        """缩略图缓存文件路径；原图不存在时返回 None"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        key = f"{os.path.normcase(os.path.abspath(file_path))}|{stat.st_mtime_ns}|{stat.st_size}|{self.SIZE}"
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.png')
+
+    def load(self, file_path):
+        """读取已缓存的缩略图（很小，主线程直接读也很快）；未命中返回 None"""
+        path = self.cache_path(file_path)
+        if path is None or not os.path.exists(path):
+            return None
+        thumbnail = QImage(path)
+        if thumbnail.isNull():
+            return None
+        try:
+            os.utime(path)  # 记录最近使用时间，供淘汰参考
+        except OSError:
+            pass
+        return thumbnail
+
+    def generate(self, file_path):
+        """解码缩小版原图，缩放到 SIZE 以内并写入缓存"""
+        thumbnail = decode_image_file(file_path, self.SIZE * 2)['qimage']
+        if thumbnail.width() > self.SIZE or thumbnail.height() > self.SIZE:
+            thumbnail = thumbnail.scaled(self.SIZE, self.SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+        path = self.cache_path(file_path)
+        if path is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            # 先写临时文件再替换，避免其他线程读到写了一半的缩略图
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            if thumbnail.save(temp_path, 'PNG'):
+                os.replace(temp_path, path)
+                self.after_write()
+        return thumbnail
+
+    def after_write(self):
+        with self.lock:
+            self.writes_since_evict += 1
+            if self.writes_since_evict < self.EVICT_EVERY:
+                return
+            self.writes_since_evict = 0
+            self.evict()
+
+    def evict(self):
+        """总大小超过上限时，删除最久未使用的缩略图直到降到上限的 90%
+
+        只处理写完的 .png；其他线程正在写的 .tmp 不能动，否则它随后的 os.replace 会失败。
+        """
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.png'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+
+        entries.sort()
+        target = self.max_bytes * 9 // 10
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def request(self, file_path, priority=0):
+        """在后台读取或生成缩略图，完成后发出 signals.ready（priority 大的先执行）"""
+        with self.lock:
+            if file_path in self.tasks:
+                return
+            task = ThumbnailTask(self, file_path)
+            self.tasks[file_path] = task
+        self.pool.start(task, priority)
+
+    def cancel(self, file_path):
+        """撤回尚未开始的缩略图任务"""
+        with self.lock:
+            task = self.tasks.get(file_path)
+            if task is None or not self.pool.tryTake(task):
+                return
+            del self.tasks[file_path]
+
+    def task_finished(self, file_path):
+        with self.lock:
+            self.tasks.pop(file_path, None)
+
+
+# ===== 最新截图预解码缓存 =====
+
+class DecodedImageCache:
+    """已解码图片的 LRU 缓存，按 (路径, 修改时间, 大小) 索引，受内存上限约束
+
+    缓存的是已经转换好的 QPixmap，命中时只需要创建图片项插入场景。
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> decode_image_file 结果（qimage 换成 pixmap）
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(file_path):
+        """文件当前状态对应的缓存键；文件不存在时返回 None"""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return (os.path.normcase(os.path.abspath(file_path)), stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    def entry_bytes(entry):
+        pixmap = entry['pixmap']
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, file_path, count=True):
+        """查找文件的缓存；count 为 True 时同时更新命中/未命中计数"""
+        key = self.key_for(file_path)
+        entry = self.entries.get(key) if key else None
+        if entry is None:
+            self.misses += count
+            return None
+        self.entries.move_to_end(key)
+        self.hits += count
+        return entry
+
+    def put(self, key, entry):
+        size = self.entry_bytes(entry)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.total_bytes -= self.entry_bytes(self.entries.pop(key))
+        self.entries[key] = entry
+        self.total_bytes += size
+
+        # 超出内存上限时淘汰最久未使用的
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= self.entry_bytes(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+class PrefetchSignals(QObject):
+    decoded = pyqtSignal(object, object)  # 缓存键, decode_image_file 的结果（失败时为 None）
+
+
+class PrefetchTask(QRunnable):
+    """后台预解码一张新截图"""
+    def __init__(self, key, signals):
+        super().__init__()
+        self.key = key
+        self.signals = signals
+
+    def run(self):
+        file_path = self.key[0]
+        try:
+            # 裁边检测只扫描边框附近，顺带算好，导入时是否使用由设置决定
+            decoded = decode_image_file(file_path, PROXY_MAX_EDGE, trim=True)
+        except Exception:
+            decoded = None
+        # 解码期间文件仍在写入（截图工具还没保存完），结果作废
+        if decoded is not None and DecodedImageCache.key_for(file_path) != self.key:
+            decoded = None
+        self.signals.decoded.emit(self.key, decoded)
+
+
+class ImagePrefetcher(QObject):
+    """监视输入目录，把最新的几张截图提前解码到缓存里（Ctrl+1~4 直接命中）"""
+    MAX_RETRIES = 3
+
+    def __init__(self, recent_index, count=4, max_bytes=512 * 1024 * 1024):
+        super().__init__()
+        self.recent_index = recent_index
+        self.count = count
+        self.cache = DecodedImageCache(max_bytes)
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(2)
+        self.signals = PrefetchSignals()
+        self.signals.decoded.connect(self.on_decoded)
+        self.in_flight = set()
+        self.attempts = {}  # 缓存键 -> 解码失败次数
+
+        self.recent_index.changed.connect(self.prefetch)
+        QTimer.singleShot(0, self.prefetch)
+
+    def prefetch(self):
+        """提交最新 count 张中尚未缓存的图片"""
+        for file_path, _, _ in self.recent_index.newest(self.count):
+            key = DecodedImageCache.key_for(file_path)
+            if (key is None or key in self.cache or key in self.in_flight
+                    or self.attempts.get(key, 0) >= self.MAX_RETRIES):
+                continue
+            self.in_flight.add(key)
+            self.pool.start(PrefetchTask(key, self.signals))
+
+    def on_decoded(self, key, decoded):
+        self.in_flight.discard(key)
+        if decoded is None:
+            # 文件可能还在写入，稍后重试
+            self.attempts[key] = self.attempts.get(key, 0) + 1
+            if self.attempts[key] < self.MAX_RETRIES:
+                QTimer.singleShot(1000, self.prefetch)
+            return
+        self.attempts.pop(key, None)
+        self.cache.put(key, {
+            'pixmap': qimage_to_qpixmap(decoded['qimage']),
+            'source_size': decoded['source_size'],
+            'trim': decoded['trim'],
+        })
+
+    def eligible(self, file_path):
+        """文件是否在监视的输入目录里（只有这些文件可能被预解码）"""
+        return (os.path.normcase(os.path.dirname(os.path.abspath(file_path)))
+                == os.path.normcase(os.path.abspath(self.recent_index.directory)))
+
+    def lookup(self, file_path):
+        """查找预解码缓存；从其它目录导入的文件不会被预解码，不计入命中率"""
+        return self.cache.get(file_path, count=self.eligible(file_path))
+
+
+class ImportBatch:
+    """一次导入操作：占位项、进度和取消标记"""
+    def __init__(self, batch_id, file_paths, report_errors, play_sound, done_message, auto_trim=False):
+        self.batch_id = batch_id
+        self.file_paths = list(file_paths)
+        self.report_errors = report_errors  # True: 弹窗报告错误；False: 只打印
+        self.play_sound = play_sound
+        self.done_message = done_message    # 完成提示，支持 {count} 和 {total}
+        self.auto_trim = auto_trim          # 是否自动裁掉四周的纯色边框
+        self.items = {}                     # 序号 -> 占位图片项
+        self.tasks = {}                     # 序号 -> ImageDecodeTask（用于取消排队中的任务）
+        self.pending = set(range(len(self.file_paths)))
+        self.imported_count = 0
+        self.cache_hits = 0                 # 直接使用预解码缓存的张数
+        self.cancelled = False
+
+
+class ImageImportPipeline(QObject):
+    """共享的异步导入管线
+
+    解码和格式转换在线程池中进行；占位图片项会立即按阶梯位置放到画布上，
+    每张图片解码完成后再替换为真实像素。预解码缓存命中的图片直接插入真实图片项。
+    """
+    def __init__(self, main_window):
+        super().__init__()
+        self.main_window = main_window
+        self.pool = QThreadPool()
+        self.signals = ImageDecodeSignals()
+        self.signals.decoded.connect(self.on_decoded)
+        self.signals.failed.connect(self.on_failed)
+        self.batches = {}
+        self.next_batch_id = 1
+
+    def is_busy(self):
+        """是否有正在进行的导入"""
+        return bool(self.batches)
+
+    def start(self, file_paths, report_errors=True, play_sound=False,
+              done_message="已导入 {count} 张图片"):
+        """放置占位项并提交解码任务"""
+        batch = ImportBatch(self.next_batch_id, file_paths, report_errors, play_sound, done_message,
+                            auto_trim=self.main_window.settings.value("auto_trim", False, type=bool))
+        self.next_batch_id += 1
+        if not batch.file_paths:
+            return batch
+        self.batches[batch.batch_id] = batch
+
+        scene = self.main_window.scene
+
+        # 起始位置
+        offset_x = 100
+        offset_y = 100
+
+        prefetcher = self.main_window.prefetcher
+
+        for i, file_path in enumerate(batch.file_paths):
+            cached = prefetcher.lookup(file_path)
+            if cached is not None:
+                item = DraggablePixmapItem(cached['pixmap'], file_path, cached['source_size'])
+            else:
+                item = DraggablePixmapItem.placeholder(file_path)
+
+            # 设置位置（每张图片稍微错开）
+            item.setPos(offset_x + (i * 40), offset_y + (i * 40))
+            if cached is not None and batch.auto_trim:
+                self.apply_trim(item, cached['trim'])
+            scene.addItem(item)
+            batch.items[i] = item
+
+            if cached is not None:
+                batch.pending.discard(i)
+                batch.imported_count += 1
+                batch.cache_hits += 1
+                self.main_window.image_count += 1
+                continue
+
+            task = ImageDecodeTask(batch, i, self.signals)
+            batch.tasks[i] = task
+            self.pool.start(task)
+
+        if batch.pending:
+            self.show_progress(batch)
+        else:
+            self.finish(batch)
+        return batch
+
+    def cancel(self):
+        """取消所有进行中的导入，移除尚未完成的占位项"""
+        for batch in list(self.batches.values()):
+            batch.cancelled = True
+            for index in list(batch.pending):
+                self.pool.tryTake(batch.tasks[index])
+                item = batch.items.get(index)
+                if item is not None and self.in_scene(item):
+                    item.scene().removeItem(item)
+            batch.pending.clear()
+            self.finish(batch)
+
+    def on_decoded(self, batch_id, index, decoded):
+        batch = self.batches.get(batch_id)
+        if batch is None or index not in batch.pending:
+            return
+        batch.pending.discard(index)
+        batch.tasks.pop(index, None)
+
+        item = batch.items[index]
+        # 用户可能在解码期间删除了占位项
+        if self.in_scene(item):
+            item.set_image(qimage_to_qpixmap(decoded['qimage']), decoded['source_size'])
+            if batch.auto_trim:
+                self.apply_trim(item, decoded['trim'])
+            batch.imported_count += 1
+            self.main_window.image_count += 1
+
+        self.show_progress(batch)
+        if not batch.pending:
+            self.finish(batch)
+
+    @staticmethod
+    def in_scene(item):
+        """占位项是否还在场景里（scene.clear() 会直接删除底层 C++ 对象）"""
+        return not sip.isdeleted(item) and item.scene() is not None
+
+    @staticmethod
+    def apply_trim(item, trim):
+        """非破坏性地裁掉边框，并移动图片项，让留下的内容仍从原来的左上角开始"""
+        if trim is None:
+            return
+        item.setPos(item.pos() + item.mapToParent(QPointF(0, 0)) - item.mapToParent(trim.topLeft()))
+        item.set_crop(trim)
+
+    def on_failed(self, batch_id, index, error):
+        batch = self.batches.get(batch_id)
+        if batch is None or index not in batch.pending:
+            return
+        batch.pending.discard(index)
+        batch.tasks.pop(index, None)
+
+        item = batch.items[index]
+        if self.in_scene(item):
+            item.scene().removeItem(item)
+
+        file_name = os.path.basename(batch.file_paths[index])
+        if batch.report_errors:
+            QMessageBox.critical(
+                self.main_window,
+                "错误",
+                f"无法加载图片 {file_name}:\n{error}"
+            )
+        else:
+            print(f"无法加载图片 {file_name}: {error}")
+
+        self.show_progress(batch)
+        if not batch.pending:
+            self.finish(batch)
+
+    def show_progress(self, batch):
+        if batch.pending and not batch.cancelled:
+            total = len(batch.file_paths)
+            done = total - len(batch.pending)
+            self.main_window.status_bar.showMessage(f"正在导入图片 {done}/{total} ... (Esc 取消)")
+
+    def finish(self, batch):
+        """一批导入结束（完成或取消）"""
+        if self.batches.pop(batch.batch_id, None) is None:
+            return
+        window = self.main_window
+
+        # 更新场景矩形以适应导入的图片
+        window.update_scene_rect()
+
+        # 成功导入的图片作为一条添加记录，可以撤销
+        window.command_stack.push_add([item for item in batch.items.values()
+                                       if self.in_scene(item) and not item.loading and item.scene() is window.scene])
+
+        if batch.cancelled:
+            window.status_bar.showMessage(
+                f"已取消导入，完成 {batch.imported_count}/{len(batch.file_paths)} 张，画布共有 {window.image_count} 张图片")
+            return
+
+        # 导入成功后播放音效
+        if batch.play_sound and batch.imported_count > 0:
+            window.play_ctrl_s_sound()
+
+        message = batch.done_message.format(count=batch.imported_count, total=len(batch.file_paths))
+        if batch.cache_hits:
+            message += f"（预解码命中 {batch.cache_hits} 张）"
+        window.status_bar.showMessage(f"{message}，画布共有 {window.image_count} 张图片")
+
+
+# ===== 截图拼接 =====
+
+# 相邻截图的重叠部分至少要有这么多行（列）完全相同，才认为是滚动截图的重叠
+STITCH_MIN_OVERLAP = 16
+
+_line_hash_weights = np.zeros(0, dtype=np.uint64)
+
+
+def line_hash_weights(length):
+    """行哈希用的随机奇数权重（固定种子，按需加长）"""
+    global _line_hash_weights
+    if len(_line_hash_weights) < length:
+        rng = np.random.default_rng(0x5717C4)
+        _line_hash_weights = rng.integers(1, 2 ** 63, size=max(length, 4096), dtype=np.uint64) | np.uint64(1)
+    return _line_hash_weights[:length]
+
+
+_line_hash_powers = np.ones(1, dtype=np.uint64)
+
+
+def line_hash_powers(length):
+    """滚动哈希底数的 0 ~ length-1 次幂（对 2^64 取模，按需加长）"""
+    global _line_hash_powers
+    if len(_line_hash_powers) < length:
+        powers = np.full(max(length, 4096), 0x9E3779B97F4A7C15, dtype=np.uint64)
+        powers[0] = 1
+        _line_hash_powers = np.cumprod(powers, dtype=np.uint64)
+    return _line_hash_powers[:length]
+
+
+def qimage_pixels(qimage):
+    """QImage 的像素数组（高 x 宽，每个像素一个 uint32），与返回的 QImage 共享内存
+
+    调用方要在用完数组之前一直持有返回的 QImage。
+    """
+    if qimage.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32, QImage.Format_ARGB32_Premultiplied):
+        qimage = qimage.convertToFormat(QImage.Format_ARGB32)
+    data = qimage.constBits()
+    data.setsize(qimage.sizeInBytes())
+    pixels = np.frombuffer(data, np.uint32).reshape(qimage.height(), qimage.bytesPerLine() // 4)
+    return qimage, pixels[:, :qimage.width()]
+
+
+def line_hashes(qimage, axis):
+    """每一行（axis=0）或每一列（axis=1）像素的 64 位哈希，用来整行比较是否相同"""
+    qimage, pixels = qimage_pixels(qimage)
+    if axis == 0:
+        return np.multiply(pixels, line_hash_weights(pixels.shape[1]), dtype=np.uint64).sum(axis=1)
+    return np.multiply(pixels, line_hash_weights(pixels.shape[0])[:, None], dtype=np.uint64).sum(axis=0)
+
+
+def find_overlap(prev_hashes, next_hashes, min_overlap=STITCH_MIN_OVERLAP):
+    """在相邻两张截图的行哈希里找滚动重叠
+
+    两张图同一位置上相同的开头和结尾几行视为固定的标题栏/底栏，不参与匹配；
+    中间部分找 prev 末尾与 next 开头完全相同的最长一段。重叠里可以有空行、
+    纯色块和重复的文字行，不需要只出现一次的行作锚点。
+    返回 (标题栏行数, 底栏行数, 重叠行数)；两张图相同或没有找到重叠时返回 None。
+    """
+    length = min(len(prev_hashes), len(next_hashes))
+    same_head = prev_hashes[:length] == next_hashes[:length]
+    if same_head.all():
+        return None
+    same_tail = prev_hashes[len(prev_hashes) - length:][::-1] == next_hashes[len(next_hashes) - length:][::-1]
+    header = int(np.argmin(same_head))
+    footer = int(np.argmin(same_tail))
+
+    prev_body = prev_hashes[header:len(prev_hashes) - footer]
+    next_body = next_hashes[header:len(next_hashes) - footer]
+
+    # next 至少要带来一行新内容
+    longest = min(len(prev_body), len(next_body) - 1)
+    if longest < min_overlap:
+        return None
+
+    # 用多项式滚动哈希（uint64 自然溢出）一次比较所有长度 k 的 prev 末尾 k 行和 next 开头 k 行：
+    # prev 前缀和相减得到末尾一段乘以 base^(P-k) 的哈希，与 next 开头一段的哈希对齐后比较。
+    # 哈希相同的候选再从最长的开始逐行验证
+    size = len(prev_body)
+    powers = line_hash_powers(size)
+    prev_prefix = np.zeros(size + 1, dtype=np.uint64)
+    np.cumsum(prev_body * powers, out=prev_prefix[1:])
+    next_prefix = np.cumsum(next_body[:longest] * powers[:longest])
+    lengths = np.arange(longest, max(min_overlap, 1) - 1, -1)
+    same = powers[size - lengths] * next_prefix[lengths - 1] == prev_prefix[size] - prev_prefix[size - lengths]
+    for overlap in lengths[same].tolist():
+        if np.array_equal(prev_body[len(prev_body) - overlap:], next_body[:overlap]):
+            return header, footer, overlap
+    return None
+
+
+def plan_stitch(images, axis):
+    """拼接截图（QImage 列表），axis=0 上下拼接，axis=1 左右拼接
+
+    先后顺序由重叠决定，不依赖图片在画布上的排列（Ctrl+3 导入时最新的截图在最前）：
+    每两张图的两种先后都检测一次，按重叠从长到短把图片连成链，每张图最多一个前驱和
+    一个后继。链与链之间、没有重叠的图片保持列表里原来的顺序。
+    返回 (拼接顺序, 每张图在拼接方向上开头和结尾要裁掉的像素数, 找到重叠的相邻对数)，
+    裁剪量按原列表下标排列。后一张裁掉标题栏和重叠部分，前一张裁掉底栏，
+    拼起来标题栏和底栏各只出现一次。
+    """
+    hashes = [line_hashes(image, axis) for image in images]
+    cross_sizes = [image.width() if axis == 0 else image.height() for image in images]
+    links = []
+    for i in range(len(images)):
+        for j in range(len(images)):
+            # 垂直于拼接方向的尺寸不同时，行不可能完全相同
+            if i == j or cross_sizes[i] != cross_sizes[j]:
+                continue
+            overlap = find_overlap(hashes[i], hashes[j])
+            if overlap is not None:
+                links.append((i, j) + overlap)
+    links.sort(key=lambda link: -link[4])
+
+    successors = {}  # 前一张下标 -> (后一张下标, 标题栏行数, 底栏行数, 重叠行数)
+    predecessors = {}
+    for i, j, header, footer, rows in links:
+        if i in successors or j in predecessors:
+            continue
+        head = i
+        while head in predecessors:
+            head = predecessors[head]
+        if head == j:
+            continue  # 会连成环
+        successors[i] = (j, header, footer, rows)
+        predecessors[j] = i
+
+    order = []
+    for start in range(len(images)):
+        if start in predecessors:
+            continue
+        index = start
+        while index is not None:
+            order.append(index)
+            index = successors[index][0] if index in successors else None
+
+    cuts = [[0, 0] for _ in images]
+    for j, header, _, rows in successors.values():
+        cuts[j][0] = header + rows
+    for i, (_, _, footer, _) in successors.items():
+        if cuts[i][0] + footer < len(hashes[i]):
+            cuts[i][1] = footer
+    return order, cuts, len(successors)
+
+
+# ===== 拼图（按尺寸精确拼接） =====
+
+JOIN_MODES = {'row': '横向一行', 'column': '纵向一列', 'grid': '网格'}
+
+
+def join_layout(sizes, mode='row', columns=0, gutter=0):
+    """只根据图片尺寸算出拼图布局，返回 (总宽, 总高, 每张图左上角的 QPoint 列表)
+
+    三种模式都按网格处理：row 是一行 N 列，column 是 N 行一列，grid 按行依次填满
+    columns 列（0 表示接近正方形的列数）。每列宽度取该列最宽的图，每行高度取该行
+    最高的图，图片放在格子左上角，相邻格子之间留 gutter 像素。
+    """
+    count = len(sizes)
+    if mode == 'row':
+        columns = count
+    elif mode == 'column':
+        columns = 1
+    elif mode == 'grid':
+        columns = min(columns if columns > 0 else math.ceil(math.sqrt(count)), count)
+    else:
+        raise ValueError(f"未知的拼图方式: {mode}")
+    columns = max(1, columns)
+    rows = max(1, math.ceil(count / columns))
+
+    column_widths = [0] * columns
+    row_heights = [0] * rows
+    for index, size in enumerate(sizes):
+        row, column = divmod(index, columns)
+        column_widths[column] = max(column_widths[column], size.width())
+        row_heights[row] = max(row_heights[row], size.height())
+
+    xs = [0] * columns
+    for column in range(1, columns):
+        xs[column] = xs[column - 1] + column_widths[column - 1] + gutter
+    ys = [0] * rows
+    for row in range(1, rows):
+        ys[row] = ys[row - 1] + row_heights[row - 1] + gutter
+
+    width = max(1, sum(column_widths) + gutter * (columns - 1))
+    height = max(1, sum(row_heights) + gutter * (rows - 1))
+    positions = [QPoint(xs[index % columns], ys[index // columns]) for index in range(count)]
+    return width, height, positions
+
+
+def join_images(images, mode='row', columns=0, gutter=0, sources=None, background=Qt.white):
+    """把 QImage 列表按 join_layout 的布局原样拼成一张 RGB32 图片（不缩放、不插值，可在工作线程中调用）
+
+    输出缓冲只分配一次；不透明图片直接按行拷贝像素，带透明通道的图片用 QPainter
+    叠加到背景上。sources 可以为每张图指定只取其中的一块（QRect，None 表示整张）。
+    """
+    sources = sources or [None] * len(images)
+    rects = [image.rect() if source is None else QRect(source).intersected(image.rect())
+             for image, source in zip(images, sources)]
+    width, height, positions = join_layout([rect.size() for rect in rects], mode, columns, gutter)
+
+    output = QImage(width, height, QImage.Format_RGB32)
+    if output.isNull():
+        raise MemoryError(f"无法分配 {width}x{height} 的拼图")
+    data = output.bits()
+    data.setsize(output.sizeInBytes())
+    canvas = np.frombuffer(data, np.uint32).reshape(height, output.bytesPerLine() // 4)
+    canvas[:] = QColor(background).rgb()
+
+    blended = []
+    for image, rect, position in zip(images, rects, positions):
+        if image.hasAlphaChannel():
+            blended.append((image, rect, position))
+            continue
+        image, pixels = qimage_pixels(image)
+        canvas[position.y():position.y() + rect.height(), position.x():position.x() + rect.width()] = \
+            pixels[rect.top():rect.top() + rect.height(), rect.left():rect.left() + rect.width()]
+
+    if blended:
+        painter = QPainter(output)
+        for image, rect, position in blended:
+            painter.drawImage(position, image, rect)
+        painter.end()
+    return output
+
+
+def join_image_files(file_paths, output_path, mode='row', columns=0, gutter=0):
+    """不依赖界面的拼图入口：并行解码文件，拼接后保存（格式由扩展名决定），返回 (宽, 高)"""
+    with ThreadPoolExecutor() as executor:
+        images = [decoded['qimage'] for decoded in executor.map(decode_image_file, file_paths)]
+    image = join_images(images, mode, columns, gutter)
+    del images
+    if not image.save(output_path):
+        raise IOError(f"无法写入 {output_path}")
+    return image.width(), image.height()
+
+
+# ===== 自动排列（天际线装箱） =====
+
+ARRANGE_ASPECTS = {0.0: '自动（面积最小）', 16 / 9: '16:9', 4 / 3: '4:3', 1.0: '1:1', 3 / 4: '3:4', 9 / 16: '9:16'}
+
+
+def skyline_pack(sizes, bin_width, gutter=0):
+    """在宽度为 bin_width 的区域里用天际线算法依次放置矩形（sizes 需已排好顺序）
+
+    天际线是覆盖 [0, bin_width) 的一串水平线段 [x, y, 宽]；每个矩形放在使其底边
+    最高点最小的位置（相同时取更靠上、更靠左的），然后更新天际线。
+    返回 (每个矩形左上角的 (x, y) 列表, 占用宽度, 占用高度)。
+    """
+    bin_width += gutter  # 每个矩形右侧和下方都带一个间距，最后一个间距不算在占用尺寸里
+    skyline = [[0, 0, bin_width]]
+    positions = []
+    used_width = used_height = 0
+    for width, height in sizes:
+        width += gutter
+        height += gutter
+        best = None
+        for start in range(len(skyline)):
+            x = skyline[start][0]
+            if x + width > bin_width:
+                break
+            # 矩形覆盖的线段里最高的一条决定它能放多高
+            y = 0
+            covered = 0
+            index = start
+            while covered < width:
+                y = max(y, skyline[index][1])
+                covered += skyline[index][2]
+                index += 1
+            if best is None or (y + height, y, x) < best[:3]:
+                best = (y + height, y, x, start)
+        if best is None:
+            raise ValueError(f"矩形宽度 {width - gutter} 超出排列宽度 {bin_width - gutter}")
+        top, y, x, start = best
+        positions.append((x, y))
+        used_width = max(used_width, x + width - gutter)
+        used_height = max(used_height, top - gutter)
+
+        # 用新线段替换被覆盖的部分，最后一条被部分覆盖的线段保留右侧剩余
+        end = x + width
+        index = start
+        while index < len(skyline) and skyline[index][0] + skyline[index][2] <= end:
+            index += 1
+        new_segments = [[x, top, width]]
+        if index < len(skyline) and skyline[index][0] < end:
+            segment = skyline[index]
+            new_segments.append([end, segment[1], segment[0] + segment[2] - end])
+            index += 1
+        skyline[start:index] = new_segments
+
+        # 合并相邻的等高线段
+        merged = [skyline[0]]
+        for segment in skyline[1:]:
+            if segment[1] == merged[-1][1]:
+                merged[-1] = [merged[-1][0], merged[-1][1], merged[-1][2] + segment[2]]
+            else:
+                merged.append(segment)
+        skyline = merged
+    return positions, used_width, used_height
+
+
+def arrange_layout(sizes, aspect=0.0, gutter=0, samples=16):
+    """为一组矩形（(宽, 高)，整数）找紧凑的排列，返回 (左上角位置列表, 总宽, 总高)
+
+    先按高度从大到小排序，再在几种排列宽度下做天际线装箱：aspect 为 0 时取总面积最小的，
+    否则在面积和宽高比偏离 aspect 的程度之间折中。先粗扫一遍宽度，再在最优值附近细扫。
+    """
+    if not sizes:
+        return [], 0, 0
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+    ordered = [sizes[i] for i in order]
+    narrowest = max(width for width, _ in sizes)
+    widest = sum(width for width, _ in sizes) + gutter * (len(sizes) - 1)
+
+    def score(width, height):
+        area = width * height
+        if aspect <= 0:
+            return area
+        ratio = width / height if height else 1.0
+        return area * max(ratio / aspect, aspect / ratio)
+
+    results = {}
+
+    def evaluate(bin_width):
+        bin_width = int(min(max(bin_width, narrowest), widest))
+        if bin_width not in results:
+            positions, width, height = skyline_pack(ordered, bin_width, gutter)
+            results[bin_width] = (score(width, height), positions, width, height)
+        return results[bin_width]
+
+    # 粗扫：在最窄和最宽之间按几何级数取样，再加上按总面积估计的宽度
+    ratio = widest / narrowest
+    candidates = [narrowest * ratio ** (step / (samples - 1)) for step in range(samples)]
+    total_area = sum((width + gutter) * (height + gutter) for width, height in sizes)
+    candidates.append(math.sqrt(total_area * (aspect if aspect > 0 else 1.0)))
+    for candidate in candidates:
+        evaluate(candidate)
+
+    # 细扫：在当前最优宽度两侧的取样点之间再均匀取样
+    best_width = min(results, key=lambda width: results[width][0])
+    tried = sorted(results)
+    index = tried.index(best_width)
+    low = tried[max(0, index - 1)]
+    high = tried[min(len(tried) - 1, index + 1)]
+    for step in range(1, samples // 2):
+        evaluate(low + (high - low) * step / (samples // 2))
+
+    _, positions, width, height = min(results.values(), key=lambda result: result[0])
+    placed = [None] * len(sizes)
+    for original, position in zip(order, positions):
+        placed[original] = position
+    return placed, width, height
+
+
+# ===== 导出渲染 =====
+
+# 导出图片的最长边（像素）
+EXPORT_MAX_SIZE = 1920
+
+
+def export_target_size(source_rect, max_size=EXPORT_MAX_SIZE):
+    """导出图片的像素尺寸：按比例缩小到最长边不超过 max_size（0 表示不限制）"""
+    width = int(source_rect.width())
+    height = int(source_rect.height())
+    if max_size > 0 and (width > max_size or height > max_size):
+        if width > height:
+            height = max(1, int(height * max_size / width))
+            width = max_size
+        else:
+            width = max(1, int(width * max_size / height))
+            height = max_size
+    return width, height
+
+
+def items_needing_full_resolution(items, render_scale):
+    """以 render_scale（输出像素/场景单位）渲染时，代理图分辨率不够的图片项"""
+    return [item for item in items
+            if isinstance(item, DraggablePixmapItem) and item.is_proxy()
+            and render_scale * item.scale() > item.display_scale]
+
+
+def integral_layout_items(scene, source_rect, width, height):
+    """source_rect 按 1:1 输出、所有图片都只是平移时，返回按绘制顺序排列的图片项（含 AnnotationSlice）；否则返回 None
+
+    输出尺寸与 source_rect 相差不到 1 像素也算 1:1（调用方通常用 int() 截断
+    itemsBoundingRect 的小数宽高，箭头超出图片时尤其常见）。
+    """
+    if abs(width - source_rect.width()) >= 1 or abs(height - source_rect.height()) >= 1:
+        return None
+    items = []
+    for item in scene.items(source_rect, Qt.IntersectsItemBoundingRect, Qt.AscendingOrder):
+        if item is scene.annotations or not item.isVisible():
+            continue
+        if isinstance(item, AnnotationSlice):
+            # 被图片压住的标注，按层叠顺序夹在图片之间绘制
+            items.append(item)
+            continue
+        if not isinstance(item, DraggablePixmapItem):
+            return None
+        if item.is_proxy() or item.graphicsEffect() is not None or item.effectiveOpacity() < 1.0:
+            return None
+        if item.sceneTransform().type() > QTransform.TxTranslate or item.pixmap().devicePixelRatio() != 1:
+            return None
+        visible = item.visible_rect()
+        if QRectF(visible.toRect()) != visible:
+            return None  # 裁剪框不在整像素上，拷贝不出同样的像素
+        items.append(item)
+    return items
+
+
+def paste_position(item, origin):
+    """图片显示区域左上角在输出图片里的整数像素位置（小数偏移四舍五入，0.5 向上取整）"""
+    position = item.scenePos() + item.visible_rect().topLeft() - origin
+    return QPoint(math.floor(position.x() + 0.5), math.floor(position.y() + 0.5))
+
+
+def compose_scene_image(scene, source_rect, width, height, image_format=QImage.Format_RGB32):
+    """不经过 scene.render，直接把图片按整数偏移拷贝到输出图片，再在上面绘制标注
+
+    图片像素原样拷贝（不开平滑变换、不插值），与原图逐像素一致；只有箭头、线条、
+    矩形框和文字按矢量栅格化。背景只填充没有被不透明图片覆盖的部分。
+    不满足 integral_layout_items 的条件时返回 None，由调用方退回 scene.render。
+    """
+    items = integral_layout_items(scene, source_rect, width, height)
+    if items is None:
+        return None
+
+    image = QImage(width, height, image_format)
+    origin = source_rect.topLeft()
+
+    # 每张图片的粘贴位置和 pixmap 中对应的源矩形（未缩放的原图，pixmap 坐标即原图坐标减去 offset）
+    pastes = {}
+    background = QRegion(0, 0, width, height)
+    for item in items:
+        if isinstance(item, DraggablePixmapItem):
+            source = item.visible_rect().translated(-item.offset()).toRect()
+            target = QRect(paste_position(item, origin), source.size())
+            pastes[item] = (target, source)
+            if not item.pixmap().hasAlphaChannel():
+                background -= QRegion(target)
+
+    painter = QPainter(image)
+    for rect in background.rects():
+        painter.fillRect(rect, Qt.white)
+
+    option = QStyleOptionGraphicsItem()
+    for item in items:
+        if item in pastes and not item.isSelected():
+            target, source = pastes[item]
+            painter.setRenderHints(QPainter.Antialiasing | QPainter.SmoothPixmapTransform, False)
+            painter.resetTransform()
+            painter.drawPixmap(target.topLeft(), item.pixmap(), source)
+            continue
+
+        # 选中的图片交给 paint 画出和 scene.render 一样的选中框；不开平滑变换时
+        # 光栅引擎同样按四舍五入后的整数偏移拷贝像素
+        painter.setRenderHint(QPainter.Antialiasing, True)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, item not in pastes)
+        painter.setWorldTransform(QTransform.fromTranslate(item.scenePos().x() - origin.x(),
+                                                           item.scenePos().y() - origin.y()))
+        option.state = QStyle.State_Selected if item.isSelected() else QStyle.State_None
+        option.exposedRect = (item.mapRectFromScene(source_rect) if isinstance(item, AnnotationSlice)
+                              else item.boundingRect())
+        painter.save()
+        item.paint(painter, option, None)
+        painter.restore()
+
+    # 没有被图片压住的箭头、线条、矩形框和文字由标注层绘制，在所有图片之上
+    layer = scene.annotations
+    if layer.records:
+        painter.setRenderHints(QPainter.Antialiasing | QPainter.SmoothPixmapTransform, True)
+        painter.setWorldTransform(QTransform.fromTranslate(layer.scenePos().x() - origin.x(),
+                                                           layer.scenePos().y() - origin.y()))
+        option.state = QStyle.State_None
+        option.exposedRect = layer.mapRectFromScene(source_rect)
+        layer.paint(painter, option, None)
+    painter.end()
+    return image
+
+
+def render_scene_image(scene, source_rect, width, height, image_format=QImage.Format_RGB32):
+    """把场景的 source_rect 区域直接渲染到 width x height 的图片里
+
+    不先按场景原尺寸渲染再缩小：目标图片多大就只分配多大，缩小倍数越大，
+    省下的内存和时间越多。需要的代理图要提前换成原图（items_needing_full_resolution）。
+    1:1 输出且图片都没有缩放旋转时走 compose_scene_image（图片按整数偏移直接拷贝）。
+    """
+    image = compose_scene_image(scene, source_rect, width, height, image_format)
+    if image is not None:
+        return image
 
-    def mouseReleaseEvent(self, event):
-        self.setCursor(Qt.OpenHandCursor)
-        super().mouseReleaseEvent(event)
+    image = QImage(width, height, image_format)
+    image.fill(Qt.white)
 
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.setRenderHint(QPainter.SmoothPixmapTransform)
+    scene.render(painter, QRectF(0, 0, width, height), source_rect, Qt.IgnoreAspectRatio)
+    painter.end()
+    return image
 
-class DraggablePixmapItem(QGraphicsPixmapItem):
-    """可拖拽的图片项"""
-    def __init__(self, pixmap, original_image, display_scale=1.0, file_path=None):
-        super().__init__(pixmap)
-        self.setFlag(QGraphicsItem.ItemIsMovable, True)
-        self.setFlag(QGraphicsItem.ItemIsSelectable, True)
-        self.setFlag(QGraphicsItem.ItemSendsGeometryChanges, True)
-        self.setTransformationMode(Qt.SmoothTransformation)
 
-        # 保存原始图片和显示缩放比例
-        self.original_image = original_image
-        self.display_scale = display_scale  # 原始图片到显示图片的缩放比例
-        self.user_scale = 1.0  # 用户编辑时的缩放比例
-        self.file_path = file_path  # 保存原始文件路径
+# 分块导出时每个条带占用的最大字节数（RGB32 渲染缓冲）
+EXPORT_BAND_BYTES = 32 * 1024 * 1024
 
-        # 设置变换原点为中心
-        self.setTransformOriginPoint(self.boundingRect().center())
 
-        # 设置光标
-        self.setCursor(Qt.OpenHandCursor)
+class StreamingPNGWriter:
+    """逐行写入的 PNG 编码器（RGB，8 位）
 
-    def scale_by(self, factor):
-        """按比例缩放图片"""
-        self.user_scale *= factor
-        self.setScale(self.user_scale)
+    QImage/PIL 只能一次性编码整张图片；这里把扫描行边压缩边写成多个 IDAT 块，
+    内存占用只和一次写入的行数有关。
+    """
+    SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+    def __init__(self, file_path, width, height, compress_level=6):
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compress_level)
+        self.file = open(file_path, 'wb')
+        self.file.write(self.SIGNATURE)
+        # IHDR: 宽、高、位深 8、颜色类型 2（RGB）、压缩 0、滤波 0、无隔行
+        self.write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def write_chunk(self, chunk_type, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type)) & 0xFFFFFFFF))
+
+    def write_rows(self, data, row_count, stride):
+        """写入 row_count 行 RGB 像素；data 中每行占 stride 字节（可含对齐填充）"""
+        row_bytes = self.width * 3
+        view = memoryview(data)
+        compressed = []
+        for y in range(row_count):
+            compressed.append(self.compressor.compress(b'\x00'))  # 滤波类型 None
+            compressed.append(self.compressor.compress(view[y * stride:y * stride + row_bytes]))
+        compressed = b''.join(compressed)
+        if compressed:
+            self.write_chunk(b'IDAT', compressed)
+        self.rows_written += row_count
+
+    def close(self):
+        try:
+            if self.rows_written != self.height:
+                raise IOError(f"PNG 行数不完整: {self.rows_written}/{self.height}")
+            self.write_chunk(b'IDAT', self.compressor.flush())
+            self.write_chunk(b'IEND', b'')
+        finally:
+            self.file.close()
 
-    def mousePressEvent(self, event):
-        self.setCursor(Qt.ClosedHandCursor)
-        # 选中时自动置顶：找到场景中所有图片的最大Z值，然后设置为比它更大
-        if self.scene():
-            max_z = 0
-            for item in self.scene().items():
-                if isinstance(item, DraggablePixmapItem):
-                    max_z = max(max_z, item.zValue())
-            self.setZValue(max_z + 1)
-        super().mousePressEvent(event)
 
-    def mouseReleaseEvent(self, event):
-        self.setCursor(Qt.OpenHandCursor)
-        super().mouseReleaseEvent(event)
+def export_scene_banded_png(scene, source_rect, file_path):
+    """按原始分辨率把场景导出为 PNG，逐条带渲染并流式写入
+
+    每个条带通过 scene.render 的源矩形单独渲染（1:1，条带之间无缝），
+    编码和写文件在后台线程进行，同时主线程渲染下一个条带；
+    内存峰值只和条带大小有关，与画布尺寸无关。返回 (宽, 高)。
+    只有 PNG 需要分块：JPEG 导出的最长边不超过 EXPORT_MAX_SIZE，整张图片也只有几 MB。
+    """
+    # 尺寸与合并/JPEG 导出一样按 int() 截断（itemsBoundingRect 四周的半像素选中框边距不多出一行一列），
+    # 原点保持 source_rect 的左上角，图片落在和非分块导出相同的整数像素上
+    left = source_rect.left()
+    top = source_rect.top()
+    width = max(1, int(source_rect.width()))
+    height = max(1, int(source_rect.height()))
+    band_height = max(1, min(height, EXPORT_BAND_BYTES // (width * 4)))
+
+    writer = StreamingPNGWriter(file_path, width, height)
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor, ExportPixmapCache():
+            pending = None
+            for y in range(0, height, band_height):
+                rows = min(band_height, height - y)
+                band = render_scene_image(scene, QRectF(left, top + y, width, rows), width, rows,
+                                          QImage.Format_RGB888)
+                data = band.constBits()
+                data.setsize(band.sizeInBytes())
+                # 上一个条带写完再提交下一个，最多同时持有两个条带
+                if pending is not None:
+                    pending.result()
+                # band 随任务一起传递，保证写入期间像素缓冲有效
+                pending = executor.submit(lambda band, data: writer.write_rows(data, band.height(), band.bytesPerLine()),
+                                          band, data)
+            pending.result()
+    except BaseException:
+        writer.file.close()
+        os.remove(file_path)
+        raise
+    writer.close()
+    return width, height
+
+
+class ExportJob:
+    """一次后台导出：已渲染好的图片、目标文件和导出成功后要删除的源文件"""
+    def __init__(self, image, file_path, source_files, pending_files, items, shape_count,
+                 saved_label, error_label):
+        self.image = image
+        self.file_path = file_path
+        self.size = image.size()
+        self.source_files = source_files    # 导出成功后删除
+        self.pending_files = pending_files  # 其中来自合并前 pending_delete_files 的部分（导出失败时恢复）
+        self.items = items                  # 已从画布移除的项目（导出失败时放回）
+        self.shape_count = shape_count
+        self.saved_label = saved_label
+        self.error_label = error_label
+        self.deleted_files = []
+        self.failed_deletions = []
+
+
+class ExportSignals(QObject):
+    finished = pyqtSignal(object)      # ExportJob
+    failed = pyqtSignal(object, str)   # ExportJob, 错误信息
+
+
+class ExportTask(QRunnable):
+    """在线程池中编码、写入导出图片，成功后删除源文件"""
+    def __init__(self, job, signals):
+        super().__init__()
+        self.job = job
+        self.signals = signals
+
+    def run(self):
+        job = self.job
+        # 保存为 JPEG 格式，质量 85%
+        if not job.image.save(job.file_path, 'JPEG', 85):
+            self.signals.failed.emit(job, f"无法写入 {job.file_path}")
+            return
+        job.image = None  # 尽早释放渲染结果
+
+        # 只有导出文件写入成功才删除源文件
+        for source_file in job.source_files:
+            if os.path.exists(source_file):
+                try:
+                    os.remove(source_file)
+                    job.deleted_files.append(os.path.basename(source_file))
+                except Exception as e:
+                    job.failed_deletions.append(f"{os.path.basename(source_file)}: {str(e)}")
+        self.signals.finished.emit(job)
 
 
 class CustomGraphicsView(QGraphicsView):
@@ -846,6 +3664,57 @@ class CustomGraphicsView(QGraphicsView):
     def __init__(self, scene, parent=None):
         super().__init__(scene, parent)
         self.main_window = None
+        self.gesture_start = {}    # 拖动开始时的 {项目: (位置, 层级)}
+        self.gesture_records = {}  # 拖动开始时的 {标注 uid: (记录, 位置, 层级)}
+        self.drag_anchor = None    # Qt 正在拖动的图片（选中的标注跟着它移动）
+        self.rubber_band_base = set()
+        self.rubberBandChanged.connect(self.on_rubber_band_changed)
+        self.preview = None        # 绘制中的箭头/细线/矩形预览 {'kind', 'start', 'end'}
+
+    def start_preview(self, kind, scene_pos):
+        self.clear_preview()
+        self.preview = {'kind': kind, 'start': QPointF(scene_pos), 'end': QPointF(scene_pos)}
+
+    def update_preview(self, scene_pos):
+        """移动预览终点：只重绘预览原来和现在覆盖的区域"""
+        if self.preview is None:
+            return
+        old_rect = self.preview_viewport_rect()
+        self.preview['end'] = QPointF(scene_pos)
+        self.viewport().update(old_rect)
+        self.viewport().update(self.preview_viewport_rect())
+
+    def clear_preview(self):
+        if self.preview is None:
+            return
+        self.viewport().update(self.preview_viewport_rect())
+        self.preview = None
+
+    def preview_viewport_rect(self):
+        """预览在视口中覆盖的区域（含线宽）"""
+        rect = self.mapFromScene(QRectF(self.preview['start'], self.preview['end']).normalized()).boundingRect()
+        margin = math.ceil(ANNOTATION_PEN_WIDTHS[self.preview['kind']] * self.transform().m11() / 2) + 2
+        return rect.adjusted(-margin, -margin, margin, margin)
+
+    def drawForeground(self, painter, rect):
+        """预览画在前景层：不是场景项目，移动时不触发场景索引更新和大范围重绘"""
+        if self.preview is None:
+            return
+        kind = self.preview['kind']
+        painter.setPen(QPen(QColor(255, 0, 0, 150), ANNOTATION_PEN_WIDTHS[kind], Qt.DashLine))
+        painter.setBrush(Qt.NoBrush)
+        if kind == 'rect':
+            painter.drawRect(QRectF(self.preview['start'], self.preview['end']).normalized())
+        else:
+            painter.drawLine(QLineF(self.preview['start'], self.preview['end']))
+
+    def on_rubber_band_changed(self, rubber_band_rect, from_scene_point, to_scene_point):
+        """框选时同时选中范围内的标注（松开鼠标时 rubber_band_rect 为空，保留当前选中）"""
+        if rubber_band_rect.isNull():
+            return
+        # 场景坐标参数是上一次移动时的位置，用当前的视口矩形换算
+        self.scene().annotations.select_in(self.mapToScene(rubber_band_rect).boundingRect(),
+                                           self.rubber_band_base)
 
     def mousePressEvent(self, event):
         if self.main_window and self.main_window.arrow_mode and event.button() == Qt.LeftButton:
@@ -853,11 +3722,8 @@ class CustomGraphicsView(QGraphicsView):
             scene_pos = self.mapToScene(event.pos())
             self.main_window.arrow_start_point = scene_pos
 
-            # 创建临时线条用于预览
-            pen = QPen(QColor(255, 0, 0, 150), 3, Qt.DashLine)
-            self.main_window.temp_arrow_line = self.scene().addLine(
-                scene_pos.x(), scene_pos.y(), scene_pos.x(), scene_pos.y(), pen
-            )
+            # 开始绘制预览
+            self.start_preview('arrow', scene_pos)
             # 重置定时器（用户有操作）
             self.main_window.arrow_mode_timer.start(60000)
             event.accept()  # 标记事件已处理
@@ -866,11 +3732,8 @@ class CustomGraphicsView(QGraphicsView):
             scene_pos = self.mapToScene(event.pos())
             self.main_window.line_start_point = scene_pos
 
-            # 创建临时线条用于预览
-            pen = QPen(QColor(255, 0, 0, 150), 2, Qt.DashLine)
-            self.main_window.temp_line = self.scene().addLine(
-                scene_pos.x(), scene_pos.y(), scene_pos.x(), scene_pos.y(), pen
-            )
+            # 开始绘制预览
+            self.start_preview('line', scene_pos)
             # 重置定时器（用户有操作）
             self.main_window.line_mode_timer.start(60000)
             event.accept()  # 标记事件已处理
@@ -879,11 +3742,8 @@ class CustomGraphicsView(QGraphicsView):
             scene_pos = self.mapToScene(event.pos())
             self.main_window.rect_start_point = scene_pos
 
-            # 创建临时矩形用于预览
-            pen = QPen(QColor(255, 0, 0, 150), 3, Qt.DashLine)
-            self.main_window.temp_rect = self.scene().addRect(
-                scene_pos.x(), scene_pos.y(), 0, 0, pen
-            )
+            # 开始绘制预览
+            self.start_preview('rect', scene_pos)
             # 重置定时器（用户有操作）
             self.main_window.rect_mode_timer.start(60000)
             event.accept()  # 标记事件已处理
@@ -891,95 +3751,131 @@ class CustomGraphicsView(QGraphicsView):
             # 文本输入模式
             scene_pos = self.mapToScene(event.pos())
 
-            # 检查点击位置是否有现有的 TextItem（需要临时启用项目来检测）
-            existing_text_item = None
-            for item in self.scene().items(scene_pos):
-                if isinstance(item, TextItem):
-                    existing_text_item = item
-                    break
+            # 检查点击位置是否有现有的文字
+            layer = self.scene().annotations
+            existing_text_item = layer.record_at(scene_pos, kinds=('text',))
 
             # 弹出多行文本输入对话框（支持Ctrl+Enter确认）
             dialog = MultiLineTextDialog(self.main_window)
             if existing_text_item:
                 # 编辑现有文本
                 dialog.setWindowTitle("编辑文本")
-                dialog.text_edit.setPlainText(existing_text_item.toPlainText())
+                dialog.text_edit.setPlainText(existing_text_item['text'])
 
             if dialog.exec_() == QDialog.Accepted:
                 text = dialog.get_text()
+                command_stack = self.main_window.command_stack
                 if existing_text_item:
                     # 更新现有文本
                     if text.strip():
-                        existing_text_item.setPlainText(text.strip())
+                        old_text = existing_text_item['text']
+                        layer.set_text(existing_text_item, text.strip())
+                        command_stack.push_changes('text', [(existing_text_item, old_text, text.strip())])
                     else:
                         # 如果文本为空，删除该文本项
-                        self.scene().removeItem(existing_text_item)
+                        layer.remove_record(existing_text_item)
+                        command_stack.push_remove([existing_text_item])
                 else:
                     # 创建新文本项
                     if text.strip():
-                        text_item = TextItem(text.strip(), scene_pos)
-                        self.scene().addItem(text_item)
+                        text_item = AnnotationLayer.make_record('text', scene_pos, text=text.strip(), font_size=24)
+                        layer.add_record(text_item)
+                        command_stack.push_add([text_item])
 
             # 重置定时器
             self.main_window.text_mode_timer.start(60000)
             event.accept()
         else:
+            layer = self.scene().annotations
+            scene_pos = self.mapToScene(event.pos())
+            left_button = event.button() == Qt.LeftButton
+            item_under_mouse = self.itemAt(event.pos())
+            if item_under_mouse is not None:
+                item_under_mouse = item_under_mouse.topLevelItem()
+            on_layer = layer.owns(item_under_mouse)
+            record_under_mouse = layer.record_at(scene_pos, owner=item_under_mouse) if on_layer else None
+
+            # 点到图片或空白处：与 Qt 对图片的处理一致，不按 Ctrl 且没点到已选中的项目时取消标注的选中
+            ctrl = bool(event.modifiers() & Qt.ControlModifier)
+            if left_button and not on_layer and not ctrl and not (
+                    item_under_mouse is not None and item_under_mouse.isSelected()):
+                layer.clear_selection()
+            self.rubber_band_base = set(layer.selected) if ctrl else set()
+
+            # 记录拖动前的位置和层级（按下时被点中的项目会置顶），松开时生成移动记录
+            gesture_items = set(self.scene().selectedItems()) if left_button else set()
+            if item_under_mouse is not None and not on_layer and left_button:
+                gesture_items.add(item_under_mouse)
+            self.gesture_start = {item: (QPointF(item.pos()), item.zValue()) for item in gesture_items}
+            gesture_records = layer.selected_records() if left_button else []
+            if record_under_mouse is not None and left_button:
+                gesture_records.append(record_under_mouse)
+            self.gesture_records = {record['uid']: (record, QPointF(record['pos']), record['z_value'])
+                                    for record in gesture_records}
+
             super().mousePressEvent(event)
 
+            # 按下时新选中的项目（Ctrl 点选等）此时还没有移动
+            for item in self.scene().selectedItems():
+                if item not in self.gesture_start:
+                    self.gesture_start[item] = (QPointF(item.pos()), item.zValue())
+            for record in layer.selected_records():
+                if record['uid'] not in self.gesture_records:
+                    self.gesture_records[record['uid']] = (record, QPointF(record['pos']), record['z_value'])
+
+            # Qt 拖动选中的图片时，选中的标注跟着移动
+            self.drag_anchor = None
+            if left_button and item_under_mouse is not None and not on_layer \
+                    and item_under_mouse.isSelected() and layer.selected:
+                self.drag_anchor = item_under_mouse
+
     def mouseMoveEvent(self, event):
         if self.main_window and self.main_window.arrow_mode:
             # 强制保持十字光标
             self.viewport().setCursor(Qt.CrossCursor)
             if self.main_window.arrow_start_point:
-                # 更新临时箭头线条
-                scene_pos = self.mapToScene(event.pos())
-                if self.main_window.temp_arrow_line:
-                    line = QLineF(self.main_window.arrow_start_point, scene_pos)
-                    self.main_window.temp_arrow_line.setLine(line)
+                # 更新箭头预览
+                self.update_preview(self.mapToScene(event.pos()))
             event.accept()  # 标记事件已处理
         elif self.main_window and self.main_window.line_mode:
             # 强制保持十字光标
             self.viewport().setCursor(Qt.CrossCursor)
             if self.main_window.line_start_point:
-                # 更新临时细线
-                scene_pos = self.mapToScene(event.pos())
-                if self.main_window.temp_line:
-                    line = QLineF(self.main_window.line_start_point, scene_pos)
-                    self.main_window.temp_line.setLine(line)
+                # 更新细线预览
+                self.update_preview(self.mapToScene(event.pos()))
             event.accept()  # 标记事件已处理
         elif self.main_window and self.main_window.rect_mode:
             # 强制保持十字光标
             self.viewport().setCursor(Qt.CrossCursor)
             if self.main_window.rect_start_point:
-                # 更新临时矩形
-                scene_pos = self.mapToScene(event.pos())
-                if self.main_window.temp_rect:
-                    start = self.main_window.rect_start_point
-                    x = min(start.x(), scene_pos.x())
-                    y = min(start.y(), scene_pos.y())
-                    width = abs(scene_pos.x() - start.x())
-                    height = abs(scene_pos.y() - start.y())
-                    self.main_window.temp_rect.setRect(x, y, width, height)
+                # 更新矩形预览
+                self.update_preview(self.mapToScene(event.pos()))
             event.accept()  # 标记事件已处理
         else:
             super().mouseMoveEvent(event)
 
+            if self.drag_anchor is not None and self.drag_anchor in self.gesture_start:
+                layer = self.scene().annotations
+                delta = self.drag_anchor.pos() - self.gesture_start[self.drag_anchor][0]
+                for record in layer.selected_records():
+                    start = self.gesture_records.get(record['uid'])
+                    if start is not None:
+                        layer.set_record_pos(record, start[1] + delta)
+
     def mouseReleaseEvent(self, event):
         if self.main_window and self.main_window.arrow_mode and event.button() == Qt.LeftButton:
             if self.main_window.arrow_start_point:
                 scene_pos = self.mapToScene(event.pos())
 
-                # 移除临时线条
-                if self.main_window.temp_arrow_line:
-                    self.scene().removeItem(self.main_window.temp_arrow_line)
-                    self.main_window.temp_arrow_line = None
+                # 清除预览
+                self.clear_preview()
 
                 # 创建箭头（只有当起点和终点不同时）
                 if (self.main_window.arrow_start_point - scene_pos).manhattanLength() > 10:
-                    arrow = ArrowItem(self.main_window.arrow_start_point, scene_pos)
-                    self.scene().addItem(arrow)
+                    arrow = AnnotationLayer.make_record('arrow', start=self.main_window.arrow_start_point, end=scene_pos)
+                    self.scene().annotations.add_record(arrow)
                     # 添加到撤销栈
-                    self.main_window.drawing_undo_stack.push_add_item(self.scene(), arrow)
+                    self.main_window.command_stack.push_add([arrow])
 
                 self.main_window.arrow_start_point = None
             event.accept()  # 标记事件已处理
@@ -987,17 +3883,15 @@ class CustomGraphicsView(QGraphicsView):
             if self.main_window.line_start_point:
                 scene_pos = self.mapToScene(event.pos())
 
-                # 移除临时线条
-                if self.main_window.temp_line:
-                    self.scene().removeItem(self.main_window.temp_line)
-                    self.main_window.temp_line = None
+                # 清除预览
+                self.clear_preview()
 
                 # 创建细线（只有当起点和终点不同时）
                 if (self.main_window.line_start_point - scene_pos).manhattanLength() > 10:
-                    line = LineItem(self.main_window.line_start_point, scene_pos)
-                    self.scene().addItem(line)
+                    line = AnnotationLayer.make_record('line', start=self.main_window.line_start_point, end=scene_pos)
+                    self.scene().annotations.add_record(line)
                     # 添加到撤销栈
-                    self.main_window.drawing_undo_stack.push_add_item(self.scene(), line)
+                    self.main_window.command_stack.push_add([line])
 
                 self.main_window.line_start_point = None
             event.accept()  # 标记事件已处理
@@ -1005,23 +3899,34 @@ class CustomGraphicsView(QGraphicsView):
             if self.main_window.rect_start_point:
                 scene_pos = self.mapToScene(event.pos())
 
-                # 移除临时矩形
-                if self.main_window.temp_rect:
-                    self.scene().removeItem(self.main_window.temp_rect)
-                    self.main_window.temp_rect = None
+                # 清除预览
+                self.clear_preview()
 
                 # 创建矩形框（只有当起点和终点不同时）
                 if (self.main_window.rect_start_point - scene_pos).manhattanLength() > 10:
-                    rect = RectItem(self.main_window.rect_start_point, scene_pos)
-                    self.scene().addItem(rect)
+                    rect = AnnotationLayer.make_record('rect', start=self.main_window.rect_start_point, end=scene_pos)
+                    self.scene().annotations.add_record(rect)
                     # 添加到撤销栈
-                    self.main_window.drawing_undo_stack.push_add_item(self.scene(), rect)
+                    self.main_window.command_stack.push_add([rect])
 
                 self.main_window.rect_start_point = None
             event.accept()  # 标记事件已处理
         else:
             super().mouseReleaseEvent(event)
 
+            # 拖动结束：记录位置和层级发生变化的项目和标注
+            if (self.gesture_start or self.gesture_records) and event.button() == Qt.LeftButton and self.main_window:
+                layer = self.scene().annotations
+                changes = [(item, pos, z, QPointF(item.pos()), item.zValue())
+                           for item, (pos, z) in self.gesture_start.items() if item.scene() is self.scene()]
+                changes += [(record, pos, z, QPointF(record['pos']), record['z_value'])
+                            for record, pos, z in self.gesture_records.values() if layer.contains_record(record)]
+                self.main_window.command_stack.push_changes('move', changes)
+                self.gesture_start = {}
+                self.gesture_records = {}
+                self.drag_anchor = None
+                layer.refresh_bounds()
+
 
 class ImageComposer(QMainWindow):
     def __init__(self):
@@ -1036,11 +3941,9 @@ class ImageComposer(QMainWindow):
         # 全局快捷键对象（使用 Windows 原生 RegisterHotKey）
         self.global_hotkey = None
 
-        # 创建箭头操作的撤销栈
-        self.drawing_undo_stack = DrawingUndoStack()
-
-        # 创建快照管理器
+        # 创建快照管理器（旧快照转存到磁盘后刷新状态栏的内存占用）
         self.snapshot_manager = SnapshotManager()
+        self.snapshot_manager.spill_signals.spilled.connect(self.update_snapshot_status)
 
         # 初始化音频播放器
         self.media_player = QMediaPlayer()
@@ -1067,9 +3970,12 @@ class ImageComposer(QMainWindow):
             self.setWindowIcon(QIcon(icon_path))
 
         # 创建场景和视图
-        self.scene = QGraphicsScene()
+        self.scene = ComposerScene()
         self.scene.setSceneRect(-5000, -5000, 10000, 10000)  # 设置更大的场景，允许负坐标
 
+        # 统一的撤销/重做栈（添加、删除、移动、缩放、文字、合并）
+        self.command_stack = CommandStack(self.scene, self.snapshot_manager)
+
         self.view = CustomGraphicsView(self.scene)
         self.view.main_window = self  # 设置对主窗口的引用
         self.view.setRenderHint(QPainter.Antialiasing)
@@ -1089,7 +3995,6 @@ class ImageComposer(QMainWindow):
         # 箭头绘制模式
         self.arrow_mode = False
         self.arrow_start_point = None
-        self.temp_arrow_line = None
 
         # 箭头模式自动退出定时器（1分钟）
         self.arrow_mode_timer = QTimer()
@@ -1099,7 +4004,6 @@ class ImageComposer(QMainWindow):
         # 画线绘制模式
         self.line_mode = False
         self.line_start_point = None
-        self.temp_line = None
 
         # 画线模式自动退出定时器（1分钟）
         self.line_mode_timer = QTimer()
@@ -1109,7 +4013,6 @@ class ImageComposer(QMainWindow):
         # 矩形绘制模式
         self.rect_mode = False
         self.rect_start_point = None
-        self.temp_rect = None
 
         # 矩形模式自动退出定时器（1分钟）
         self.rect_mode_timer = QTimer()
@@ -1119,6 +4022,12 @@ class ImageComposer(QMainWindow):
         # 移动模式（框选和移动图片/形状）
         self.move_mode = False
 
+        # 缩放停止后把缩小很多的图片重采样到实际显示尺寸
+        self.resample_timer = QTimer()
+        self.resample_timer.timeout.connect(self.resample_scaled_items)
+        self.resample_timer.setSingleShot(True)
+        self.resample_timer.setInterval(500)
+
         # 文本绘制模式
         self.text_mode = False
 
@@ -1135,12 +4044,35 @@ class ImageComposer(QMainWindow):
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("就绪 | Ctrl+S 合并 | Ctrl+Z 撤销 | Ctrl+O 导入 | Alt+S 导出 | Ctrl+A 箭头 | Ctrl+L 线 | Ctrl+R 矩形 | Ctrl+T 文字 | Ctrl+M 移动")
 
+        # 状态栏右侧常驻显示撤销快照的内存占用
+        self.snapshot_label = QLabel()
+        self.status_bar.addPermanentWidget(self.snapshot_label)
+        self.update_snapshot_status()
+
         # 图片计数
         self.image_count = 0
 
         # 待删除的原始文件路径（用于合并后导出时删除）
         self.pending_delete_files = []
 
+        # 异步导入管线（后台解码图片）
+        self.import_pipeline = ImageImportPipeline(self)
+
+        # 后台导出（JPEG 编码、写文件、删除源文件）
+        self.export_pool = QThreadPool()
+        self.export_pool.setMaxThreadCount(1)
+        self.export_signals = ExportSignals()
+        self.export_signals.finished.connect(self.on_export_finished)
+        self.export_signals.failed.connect(self.on_export_failed)
+        self.export_jobs = []
+
+        # 输入目录的最近图片索引（选择器和 Ctrl+1~4 共用）
+        self.recent_index = RecentImageIndex(INPUT_DIR)
+
+        # 后台预解码最新的几张截图，Ctrl+1~4 命中时无需再解码
+        self.prefetcher = ImagePrefetcher(self.recent_index, count=4,
+                                          max_bytes=PREDECODE_CACHE_MB * 1024 * 1024)
+
     def create_system_tray(self):
         """创建系统托盘图标"""
         # 创建托盘图标
@@ -1287,6 +4219,9 @@ class ImageComposer(QMainWindow):
 
     def quit_application(self):
         """真正退出程序"""
+        # 等待后台导出写完文件，删除转存的快照
+        self.export_pool.waitForDone()
+        self.snapshot_manager.close()
         if self.global_hotkey:
             self.global_hotkey.stop()
         self.tray_icon.hide()
@@ -1352,6 +4287,12 @@ class ImageComposer(QMainWindow):
         export_desktop_action.triggered.connect(self.export_to_desktop)
         self.addAction(export_desktop_action)
 
+        # 绑定Alt+Shift+S快捷键（按原始分辨率分块导出 PNG 到桌面）
+        export_full_action = QAction(self)
+        export_full_action.setShortcut(QKeySequence("Alt+Shift+S"))
+        export_full_action.triggered.connect(self.export_full_resolution)
+        self.addAction(export_full_action)
+
         self.toolbar1.addSeparator()
 
         # 删除选中
@@ -1436,14 +4377,54 @@ class ImageComposer(QMainWindow):
         self.toolbar2.addAction(snapshot_action)
         self.addAction(snapshot_action)
 
+        # 拼接滚动截图 - 自动去掉重叠部分
+        stitch_action = QAction("🧩 拼接 (Ctrl+J)", self)
+        stitch_action.setShortcut(QKeySequence("Ctrl+J"))
+        stitch_action.setToolTip("自动检测选中截图之间的重叠，去掉重复部分后首尾相接 (Ctrl+J)")
+        stitch_action.triggered.connect(self.stitch_selected)
+        self.toolbar2.addAction(stitch_action)
+        self.addAction(stitch_action)
+
+        # 拼图 - 按原始像素横向/纵向/网格拼接并保存
+        join_action = QAction("🧱 拼图 (Ctrl+Shift+J)", self)
+        join_action.setShortcut(QKeySequence("Ctrl+Shift+J"))
+        join_action.setToolTip("把选中的图片（未选中时为全部图片）按原始像素拼成一行、一列或网格，保存到桌面 (Ctrl+Shift+J)")
+        join_action.triggered.connect(self.join_selected)
+        self.toolbar2.addAction(join_action)
+        self.addAction(join_action)
+
+        # 自动排列 - 紧凑排列图片，减小导出画布
+        arrange_action = QAction("🗂️ 排列 (Ctrl+Shift+A)", self)
+        arrange_action.setShortcut(QKeySequence("Ctrl+Shift+A"))
+        arrange_action.setToolTip("把选中的图片（未选中时为全部图片）紧凑排列，减小导出画布的面积 (Ctrl+Shift+A)")
+        arrange_action.triggered.connect(self.arrange_images)
+        self.toolbar2.addAction(arrange_action)
+        self.addAction(arrange_action)
+
+        # 导入时自动裁掉截图四周的纯色边框（非破坏性，保存在图片项的裁剪框里）
+        self.auto_trim_action = QAction("✂️ 自动裁边", self)
+        self.auto_trim_action.setToolTip("导入图片时自动裁掉四周的纯色边框（窗口边框、空白页边等）")
+        self.auto_trim_action.setCheckable(True)
+        self.auto_trim_action.setChecked(self.settings.value("auto_trim", False, type=bool))
+        self.auto_trim_action.toggled.connect(self.toggle_auto_trim)
+        self.toolbar2.addAction(self.auto_trim_action)
+
         # 撤销操作
         undo_action = QAction("↶ 撤销 (Ctrl+Z)", self)
         undo_action.setShortcut(QKeySequence("Ctrl+Z"))
-        undo_action.setToolTip("撤销绘图操作或合并 (Ctrl+Z)")
+        undo_action.setToolTip("撤销添加、删除、移动、缩放、文字编辑、合并或拼接 (Ctrl+Z)")
         undo_action.triggered.connect(self.undo_snapshot)
         self.toolbar2.addAction(undo_action)
         self.addAction(undo_action)
 
+        # 重做操作
+        redo_action = QAction("↷ 重做 (Ctrl+Y)", self)
+        redo_action.setShortcuts([QKeySequence("Ctrl+Y"), QKeySequence("Ctrl+Shift+Z")])
+        redo_action.setToolTip("重做被撤销的操作 (Ctrl+Y)")
+        redo_action.triggered.connect(self.redo_command)
+        self.toolbar2.addAction(redo_action)
+        self.addAction(redo_action)
+
         self.toolbar2.addSeparator()
 
         # 放大视图
@@ -1543,8 +4524,9 @@ class ImageComposer(QMainWindow):
         if not os.path.exists(default_path):
             default_path = os.path.expanduser("~")
 
-        # 使用自定义图片选择器
-        picker = CustomImagePicker(default_path, self)
+        # 使用自定义图片选择器（输入目录复用常驻索引）
+        recent_index = self.recent_index if default_path == INPUT_DIR else None
+        picker = CustomImagePicker(default_path, self, recent_index)
         if picker.exec_() != QDialog.Accepted:
             return
 
@@ -1552,43 +4534,8 @@ class ImageComposer(QMainWindow):
         if not file_paths:
             return
 
-        # 起始位置
-        offset_x = 100
-        offset_y = 100
-
-        for i, file_path in enumerate(file_paths):
-            try:
-                # 使用PIL加载原始图片
-                pil_image = Image.open(file_path)
-
-                # 直接使用原始图片，不进行缩放
-                display_image = pil_image
-
-                # 转换为QPixmap
-                pixmap = self.pil_to_qpixmap(display_image)
-
-                # 创建可拖拽的图片项（display_scale=1.0表示不缩放，传递文件路径）
-                item = DraggablePixmapItem(pixmap, pil_image, display_scale=1.0, file_path=file_path)
-
-                # 设置位置（每张图片稍微错开）
-                x = offset_x + (i * 40)
-                y = offset_y + (i * 40)
-                item.setPos(x, y)
-
-                # 添加到场景
-                self.scene.addItem(item)
-                self.image_count += 1
-
-            except Exception as e:
-                QMessageBox.critical(
-                    self,
-                    "错误",
-                    f"无法加载图片 {os.path.basename(file_path)}:\n{str(e)}"
-                )
-
-        # 更新场景矩形以适应导入的图片
-        self.update_scene_rect()
-        self.status_bar.showMessage(f"已导入 {len(file_paths)} 张图片，画布共有 {self.image_count} 张图片")
+        # 在后台线程解码，占位项会立即出现在画布上
+        self.import_pipeline.start(file_paths, report_errors=True)
 
     def import_images_from_anywhere(self):
         """从任意位置选择并导入图片 (Ctrl+Shift+O)"""
@@ -1603,43 +4550,8 @@ class ImageComposer(QMainWindow):
         if not file_paths:
             return
 
-        # 起始位置
-        offset_x = 100
-        offset_y = 100
-
-        for i, file_path in enumerate(file_paths):
-            try:
-                # 使用PIL加载原始图片
-                pil_image = Image.open(file_path)
-
-                # 直接使用原始图片，不进行缩放
-                display_image = pil_image
-
-                # 转换为QPixmap
-                pixmap = self.pil_to_qpixmap(display_image)
-
-                # 创建可拖拽的图片项（display_scale=1.0表示不缩放，传递文件路径）
-                item = DraggablePixmapItem(pixmap, pil_image, display_scale=1.0, file_path=file_path)
-
-                # 设置位置（每张图片稍微错开）
-                x = offset_x + (i * 40)
-                y = offset_y + (i * 40)
-                item.setPos(x, y)
-
-                # 添加到场景
-                self.scene.addItem(item)
-                self.image_count += 1
-
-            except Exception as e:
-                QMessageBox.critical(
-                    self,
-                    "错误",
-                    f"无法加载图片 {os.path.basename(file_path)}:\n{str(e)}"
-                )
-
-        # 更新场景矩形以适应导入的图片
-        self.update_scene_rect()
-        self.status_bar.showMessage(f"已导入 {len(file_paths)} 张图片，画布共有 {self.image_count} 张图片")
+        # 在后台线程解码，占位项会立即出现在画布上
+        self.import_pipeline.start(file_paths, report_errors=True)
 
     def import_recent_images(self, count):
         """自动导入最近的N张图片（不打开对话框）"""
@@ -1652,88 +4564,21 @@ class ImageComposer(QMainWindow):
             QApplication.beep()
             return
 
-        # 支持的图片格式
-        image_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-
-        # 获取所有图片文件及其创建时间
-        files_with_time = []
-        for filename in os.listdir(default_path):
-            if filename.lower().endswith(image_extensions):
-                file_path = os.path.join(default_path, filename)
-                try:
-                    # 获取文件创建时间
-                    create_time = os.path.getctime(file_path)
-                    files_with_time.append((file_path, create_time))
-                except Exception:
-                    continue
-
-        # 按创建时间从新到旧排序（时间大的在前）
-        files_with_time.sort(key=lambda x: x[1], reverse=True)
-
-        # 只取前N张图片
-        files_with_time = files_with_time[:count]
+        # 从常驻索引中取最近N张图片（按创建时间从新到旧）
+        files_with_time = self.recent_index.newest(count)
 
         if not files_with_time:
             self.status_bar.showMessage(f"在 {default_path} 中没有找到图片")
             QApplication.beep()
             return
 
-        # 起始位置
-        offset_x = 100
-        offset_y = 100
-
-        imported_count = 0
-        for i, (file_path, _) in enumerate(files_with_time):
-            try:
-                # 使用PIL加载原始图片
-                pil_image = Image.open(file_path)
-
-                # 直接使用原始图片，不进行缩放
-                display_image = pil_image
-
-                # 转换为QPixmap
-                pixmap = self.pil_to_qpixmap(display_image)
-
-                # 创建可拖拽的图片项（display_scale=1.0表示不缩放，传递文件路径）
-                item = DraggablePixmapItem(pixmap, pil_image, display_scale=1.0, file_path=file_path)
-
-                # 设置位置（每张图片稍微错开）
-                x = offset_x + (i * 40)
-                y = offset_y + (i * 40)
-                item.setPos(x, y)
-
-                # 添加到场景
-                self.scene.addItem(item)
-                self.image_count += 1
-                imported_count += 1
-
-            except Exception as e:
-                print(f"无法加载图片 {os.path.basename(file_path)}: {str(e)}")
-                continue
-
-        # 更新场景矩形以适应导入的图片
-        self.update_scene_rect()
-
-        # 导入成功后播放音效
-        if imported_count > 0:
-            self.play_ctrl_s_sound()
-
-        self.status_bar.showMessage(f"已自动导入最近的 {imported_count} 张图片，画布共有 {self.image_count} 张图片")
-
-    def pil_to_qpixmap(self, pil_image):
-        """将PIL图片转换为QPixmap"""
-        # 转换为RGBA模式
-        if pil_image.mode != 'RGBA':
-            pil_image = pil_image.convert('RGBA')
-
-        # 获取图片数据
-        data = pil_image.tobytes('raw', 'RGBA')
-
-        # 创建QImage
-        qimage = QImage(data, pil_image.width, pil_image.height, QImage.Format_RGBA8888)
-
-        # 转换为QPixmap
-        return QPixmap.fromImage(qimage)
+        # 在后台线程解码；失败只打印，不弹窗打断
+        self.import_pipeline.start(
+            [file_path for file_path, _, _ in files_with_time],
+            report_errors=False,
+            play_sound=True,
+            done_message="已自动导入最近的 {count} 张图片"
+        )
 
     def set_items_interactive(self, interactive):
         """设置场景交互性
@@ -1806,9 +4651,7 @@ class ImageComposer(QMainWindow):
             self.arrow_mode_timer.stop()
 
             # 清理未完成的临时线条
-            if self.temp_arrow_line:
-                self.scene.removeItem(self.temp_arrow_line)
-                self.temp_arrow_line = None
+            self.view.clear_preview()
             self.arrow_start_point = None
 
     def auto_exit_arrow_mode(self):
@@ -1874,9 +4717,7 @@ class ImageComposer(QMainWindow):
             self.line_mode_timer.stop()
 
             # 清理未完成的临时线条
-            if self.temp_line:
-                self.scene.removeItem(self.temp_line)
-                self.temp_line = None
+            self.view.clear_preview()
             self.line_start_point = None
 
     def auto_exit_line_mode(self):
@@ -1943,9 +4784,7 @@ class ImageComposer(QMainWindow):
             self.rect_mode_timer.stop()
 
             # 清理未完成的临时矩形
-            if self.temp_rect:
-                self.scene.removeItem(self.temp_rect)
-                self.temp_rect = None
+            self.view.clear_preview()
             self.rect_start_point = None
 
     def auto_exit_rect_mode(self):
@@ -2062,13 +4901,26 @@ class ImageComposer(QMainWindow):
 
     def save_snapshot(self):
         """合并当前画布内容为一张图片 (Ctrl+S) - 保持当前显示状态完全不变"""
-        all_items = self.scene.items()
-        if not all_items:
+        if not self.scene.has_content():
             self.status_bar.showMessage("画布为空，无法合并")
             return
 
+        if self.import_pipeline.is_busy():
+            QApplication.beep()
+            self.status_bar.showMessage("图片仍在导入中，请稍候再合并（Esc 取消导入）")
+            return
+
         # 先保存当前状态到快照（用于撤销）
-        count = self.snapshot_manager.save_snapshot(self.scene, None)
+        snapshot_id = self.snapshot_manager.save_snapshot(self.scene)
+
+        # 快照里保留代理图即可，合并按 1:1 渲染，分辨率不够的代理图换成原图
+        failed = load_full_resolution_items(items_needing_full_resolution(self.scene.items_of(DraggablePixmapItem), 1.0))
+        if failed:
+            # 合并后源文件会在导出时删除，不能把代理图的像素当成原图合并进去
+            self.snapshot_manager.discard_snapshot(snapshot_id)
+            QApplication.beep()
+            self.status_bar.showMessage(f"合并已取消: {failed_originals_message(failed)}")
+            return
 
         # 获取当前显示状态的边界框
         display_rect = self.scene.itemsBoundingRect()
@@ -2080,29 +4932,26 @@ class ImageComposer(QMainWindow):
         width = int(display_rect.width())
         height = int(display_rect.height())
 
-        image = QImage(width, height, QImage.Format_ARGB32)
-        image.fill(Qt.white)
-
-        painter = QPainter(image)
-        painter.setRenderHint(QPainter.Antialiasing)
-        painter.setRenderHint(QPainter.SmoothPixmapTransform)
-        self.scene.render(painter, QRectF(0, 0, width, height), display_rect)
-        painter.end()
+        # 背景是不透明的白色，用不带透明通道的格式，转换成 QPixmap 时不需要再预乘
+        image = render_scene_image(self.scene, display_rect, width, height)
 
         # 收集所有原始图片的文件路径（用于导出时删除）
-        for item in all_items:
-            if isinstance(item, DraggablePixmapItem):
-                if item.file_path and item.file_path not in self.pending_delete_files:
-                    self.pending_delete_files.append(item.file_path)
+        for item in self.scene.items_of(DraggablePixmapItem):
+            if item.file_path and item.file_path not in self.pending_delete_files:
+                self.pending_delete_files.append(item.file_path)
 
         # 清空场景
         self.scene.clear()
 
-        # 创建合并后的图片，位置与原来完全一致
+        # 创建合并后的图片，位置与原来完全一致（只保留 pixmap，渲染用的 QImage 随即释放）
         pixmap = QPixmap.fromImage(image)
-        merged_item = DraggablePixmapItem(pixmap, image, file_path=None)
+        del image
+        merged_item = DraggablePixmapItem(pixmap, file_path=None)
         merged_item.setPos(display_rect.topLeft())
         self.scene.addItem(merged_item)
+        self.command_stack.push({'type': 'merge', 'snapshot_id': snapshot_id,
+                                 'merged_item': merged_item, 'restored_items': []})
+        self.update_snapshot_status()
 
         # 更新场景矩形
         self.update_scene_rect()
@@ -2111,83 +4960,234 @@ class ImageComposer(QMainWindow):
         self.play_ctrl_s_sound()
         self.status_bar.showMessage(f"✓ 已合并 ({width}x{height} 像素) | 按 Ctrl+Z 可撤销")
 
+    def update_snapshot_status(self, *args):
+        """刷新状态栏上的快照内存占用"""
+        manager = self.snapshot_manager
+        used_mb = manager.memory_bytes() / (1024 * 1024)
+        budget_mb = manager.budget_bytes / (1024 * 1024)
+        self.snapshot_label.setText(f"快照 {manager.get_snapshot_count()} 个 | {used_mb:.0f}/{budget_mb:.0f} MB")
+
     def undo_snapshot(self):
-        """撤销操作 (Ctrl+Z) - 优先撤销绘图操作，没有时才撤销快照"""
-        # 首先检查是否有绘图操作可撤销
-        if self.drawing_undo_stack.can_undo():
-            if self.drawing_undo_stack.undo():
-                self.play_success_sound()
-                remaining = len(self.drawing_undo_stack.undo_stack)
-                self.status_bar.showMessage(f"✓ 已撤销绘图操作 | 剩余 {remaining} 个绘图操作可撤销")
-                return
+        """撤销操作 (Ctrl+Z)"""
+        command, delta = self.command_stack.undo()
+        self.finish_undo_redo(command, delta, "撤销")
+
+    def redo_command(self):
+        """重做操作 (Ctrl+Y / Ctrl+Shift+Z)"""
+        command, delta = self.command_stack.redo()
+        self.finish_undo_redo(command, delta, "重做")
+
+    def finish_undo_redo(self, command, delta, action_name):
+        if command is None:
+            self.status_bar.showMessage(f"没有可{action_name}的操作")
+            return
+        self.image_count += delta
+        if command['type'] in ('add', 'remove', 'merge', 'scale', 'stitch'):
+            self.update_scene_rect()
+            self.schedule_resample()
+        self.update_snapshot_status()
+        self.play_success_sound()
+        label = CommandStack.LABELS[command['type']]
+        stack = self.command_stack
+        self.status_bar.showMessage(
+            f"✓ 已{action_name}{label} | 可撤销 {len(stack.undo_stack)} 步，可重做 {len(stack.redo_stack)} 步")
+
+    def stitch_selected(self):
+        """拼接选中的滚动截图 (Ctrl+J)
+
+        上下和左右两个方向都检测重叠，取找到重叠更多的方向（相同时上下拼接）；
+        重复的部分用非破坏性裁剪去掉，然后按重叠确定的先后顺序首尾相接，
+        从原来排在最前的图片的位置开始。
+        """
+        items = [item for item in self.scene.selectedItems()
+                 if isinstance(item, DraggablePixmapItem) and not item.loading]
+        if len(items) < 2:
+            self.status_bar.showMessage("请先选中至少两张要拼接的截图")
+            return
+
+        # 重叠要按原始像素检测
+        if load_full_resolution_items(items):
+            QApplication.beep()
+            self.status_bar.showMessage("无法加载原图，拼接已取消")
+            return
+
+        # 先按当前排列顺序：横向排开的从左到右，否则从上到下（没有重叠的图片保持这个顺序）
+        centers = [item.sceneBoundingRect().center() for item in items]
+        spread_x = max(c.x() for c in centers) - min(c.x() for c in centers)
+        spread_y = max(c.y() for c in centers) - min(c.y() for c in centers)
+        if spread_x > spread_y:
+            items.sort(key=lambda item: (item.sceneBoundingRect().left(), item.sceneBoundingRect().top()))
+        else:
+            items.sort(key=lambda item: (item.sceneBoundingRect().top(), item.sceneBoundingRect().left()))
+
+        images = [item.pixmap().toImage() for item in items]
+        axis, (order, cuts, found) = 0, plan_stitch(images, 0)
+        horizontal = plan_stitch(images, 1)
+        if horizontal[2] > found:
+            axis, (order, cuts, found) = 1, horizontal
+
+        changes = []
+        cursor = items[0].mapRectToScene(items[0].visible_rect()).topLeft()
+        for index in order:
+            item, (start, end) = items[index], cuts[index]
+            old_pos, old_crop = QPointF(item.pos()), item.crop
+            full = QRectF(item.offset(), QSizeF(item.source_size))
+            if axis == 0:
+                crop = full.adjusted(0, start, 0, -end)
+            else:
+                crop = full.adjusted(start, 0, -end, 0)
+            item.set_crop(crop if crop != full else None)
+
+            # 依次接在前一张的末尾
+            visible = item.mapRectToScene(item.visible_rect())
+            item.setPos(item.pos() + cursor - visible.topLeft())
+            visible = item.mapRectToScene(item.visible_rect())
+            cursor = visible.bottomLeft() if axis == 0 else visible.topRight()
+            changes.append((item, old_pos, old_crop, QPointF(item.pos()), item.crop))
+        self.command_stack.push_changes('stitch', changes)
+        self.update_scene_rect()
+
+        direction = "上下" if axis == 0 else "左右"
+        if found:
+            self.status_bar.showMessage(f"已{direction}拼接 {len(items)} 张截图，去掉了 {found} 处重叠")
+        else:
+            self.status_bar.showMessage(f"没有检测到重叠，已把 {len(items)} 张截图{direction}首尾相接")
+
+    def join_selected(self):
+        """拼图 (Ctrl+Shift+J)：选中的图片（未选中时为全部图片）按原始像素拼接，保存 PNG 到桌面
 
-        # 没有绘图操作可撤销，尝试撤销快照
-        if not self.snapshot_manager.has_snapshots():
-            self.status_bar.showMessage("没有可撤销的操作")
+        布局只由图片尺寸决定，不经过场景渲染，也不受 EXPORT_MAX_SIZE 限制；
+        图片的缩放被忽略，裁剪保留。画布内容和源文件都不变。
+        """
+        items = [item for item in self.scene.selectedItems()
+                 if isinstance(item, DraggablePixmapItem) and not item.loading]
+        if not items:
+            items = [item for item in self.scene.items_of(DraggablePixmapItem) if not item.loading]
+        if not items:
+            QApplication.beep()
+            self.status_bar.showMessage("画布上没有图片可拼接！")
             return
 
-        success, remaining = self.snapshot_manager.restore_snapshot(self.scene)
-        if success:
-            self.play_success_sound()
-            self.status_bar.showMessage(f"✓ 已撤销到合并前的状态 | 剩余 {remaining} 个可撤销状态")
+        dialog = JoinDialog(len(items),
+                            mode=self.settings.value("join_mode", "row"),
+                            columns=self.settings.value("join_columns", 0, type=int),
+                            gutter=self.settings.value("join_gutter", 0, type=int),
+                            parent=self)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        mode, columns, gutter = dialog.get_options()
+        self.settings.setValue("join_mode", mode)
+        self.settings.setValue("join_columns", columns)
+        self.settings.setValue("join_gutter", gutter)
+
+        # 按画布上的排列顺序：一列时从上到下，否则从左到右、从上到下
+        if mode == 'row':
+            items.sort(key=lambda item: (item.sceneBoundingRect().left(), item.sceneBoundingRect().top()))
         else:
-            self.status_bar.showMessage("没有更多可撤销的操作")
+            items.sort(key=lambda item: (item.sceneBoundingRect().top(), item.sceneBoundingRect().left()))
+
+        try:
+            os.makedirs(DESKTOP_DIR, exist_ok=True)
+            timestamp = datetime.now().strftime("%Y-%m-%d %H %M %S")
+            file_path = os.path.join(DESKTOP_DIR, f"{timestamp} 拼图.png")
+
+            self.status_bar.showMessage(f"正在拼图: {file_path} ...")
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                if load_full_resolution_items(items):
+                    raise IOError("无法加载原图")
+                images = [item.pixmap().toImage() for item in items]
+                sources = [item.visible_rect().translated(-item.offset()).toRect() for item in items]
+                image = join_images(images, mode, columns, gutter, sources)
+                del images
+                if not image.save(file_path, 'PNG'):
+                    raise IOError(f"无法写入 {file_path}")
+            finally:
+                QApplication.restoreOverrideCursor()
+
+            self.play_alt_s_sound()
+            self.status_bar.showMessage(f"拼图已保存到桌面: {file_path} ({image.width()}x{image.height()})")
+        except Exception as e:
+            QApplication.beep()
+            self.status_bar.showMessage(f"拼图失败: {str(e)}")
+
+    def arrange_images(self):
+        """自动排列 (Ctrl+Shift+A)：用天际线装箱把选中的图片（未选中时为全部图片）紧凑排列
+
+        排列从这些图片原来所占区域的左上角开始，可以撤销；标注不跟着移动。
+        """
+        if self.import_pipeline.is_busy():
+            # 占位图的尺寸是临时的，解码完成后会变，不能按它排列
+            QApplication.beep()
+            self.status_bar.showMessage("图片仍在导入中，请稍候再排列（Esc 取消导入）")
+            return
+
+        items = [item for item in self.scene.selectedItems() if isinstance(item, DraggablePixmapItem)]
+        if not items:
+            items = self.scene.items_of(DraggablePixmapItem)
+        if len(items) < 2:
+            self.status_bar.showMessage("至少需要两张图片才能自动排列")
+            return
+
+        dialog = ArrangeDialog(len(items),
+                               aspect=self.settings.value("arrange_aspect", 0.0, type=float),
+                               gutter=self.settings.value("arrange_gutter", 0, type=int),
+                               parent=self)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        aspect, gutter = dialog.get_options()
+        self.settings.setValue("arrange_aspect", aspect)
+        self.settings.setValue("arrange_gutter", gutter)
+
+        # 按显示区域（含缩放和裁剪）排列
+        visible_rects = [item.mapRectToScene(item.visible_rect()) for item in items]
+        sizes = [(math.ceil(rect.width()), math.ceil(rect.height())) for rect in visible_rects]
+        positions, width, height = arrange_layout(sizes, aspect, gutter)
+
+        origin = QPointF(min(rect.left() for rect in visible_rects), min(rect.top() for rect in visible_rects))
+        changes = []
+        for item, rect, (x, y) in zip(items, visible_rects, positions):
+            old_pos = QPointF(item.pos())
+            item.setPos(old_pos + origin + QPointF(x, y) - rect.topLeft())
+            changes.append((item, old_pos, item.zValue(), QPointF(item.pos()), item.zValue()))
+        self.command_stack.push_changes('move', changes)
+        self.update_scene_rect()
+        self.status_bar.showMessage(f"已自动排列 {len(items)} 张图片，占用 {width}x{height}")
+
+    def toggle_auto_trim(self, checked):
+        """开启/关闭导入时自动裁边（只影响之后导入的图片）"""
+        self.settings.setValue("auto_trim", checked)
+        self.status_bar.showMessage("导入时自动裁掉纯色边框" if checked else "已关闭自动裁边")
 
     def delete_selected(self):
         """删除选中的图片、箭头、线条、矩形框或文字"""
         selected_items = self.scene.selectedItems()
+        layer = self.scene.annotations
+        selected_records = layer.selected_records()
 
-        if not selected_items:
+        if not selected_items and not selected_records:
             self.status_bar.showMessage("没有选中的项目")
             return
 
         image_count = 0
-        arrow_count = 0
-        line_count = 0
-        rect_count = 0
-        text_count = 0
-        arrows_to_delete = []
-        lines_to_delete = []
-        rects_to_delete = []
-        texts_to_delete = []
-
+        removed_items = []
         for item in selected_items:
             if isinstance(item, DraggablePixmapItem):
                 image_count += 1
-                self.image_count -= 1
-                self.scene.removeItem(item)
-            elif isinstance(item, ArrowItem):
-                arrow_count += 1
-                arrows_to_delete.append(item)
-                self.scene.removeItem(item)
-            elif isinstance(item, LineItem):
-                line_count += 1
-                lines_to_delete.append(item)
-                self.scene.removeItem(item)
-            elif isinstance(item, RectItem):
-                rect_count += 1
-                rects_to_delete.append(item)
-                self.scene.removeItem(item)
-            elif isinstance(item, TextItem):
-                text_count += 1
-                texts_to_delete.append(item)
+                if not item.loading:
+                    self.image_count -= 1
+                    removed_items.append(item)
                 self.scene.removeItem(item)
 
-        # 将箭头删除操作添加到撤销栈
-        if arrows_to_delete:
-            self.drawing_undo_stack.push_delete_items(self.scene, arrows_to_delete)
-
-        # 将线条删除操作添加到撤销栈
-        if lines_to_delete:
-            self.drawing_undo_stack.push_delete_items(self.scene, lines_to_delete)
-
-        # 将矩形框删除操作添加到撤销栈
-        if rects_to_delete:
-            self.drawing_undo_stack.push_delete_items(self.scene, rects_to_delete)
+        kind_counts = {'arrow': 0, 'line': 0, 'rect': 0, 'text': 0}
+        for record in selected_records:
+            kind_counts[record['kind']] += 1
+            layer.remove_record(record)
 
-        # 将文字删除操作添加到撤销栈
-        if texts_to_delete:
-            self.drawing_undo_stack.push_delete_items(self.scene, texts_to_delete)
+        # 图片和标注的删除作为一条记录添加到撤销栈（仍在加载的占位项不记录）
+        self.command_stack.push_remove(removed_items + selected_records)
+        arrow_count, line_count = kind_counts['arrow'], kind_counts['line']
+        rect_count, text_count = kind_counts['rect'], kind_counts['text']
 
         msg = []
         if image_count > 0:
@@ -2212,8 +5212,10 @@ class ImageComposer(QMainWindow):
             self.status_bar.showMessage("请先选中要放大的图片")
             return
 
+        old_scales = [item.user_scale for item in selected_items]
         for item in selected_items:
             item.scale_by(1.1)
+        self.push_scale_changes(selected_items, old_scales)
 
         # 更新场景矩形以适应放大后的图片
         self.update_scene_rect()
@@ -2228,8 +5230,10 @@ class ImageComposer(QMainWindow):
             self.status_bar.showMessage("请先选中要缩小的图片")
             return
 
+        old_scales = [item.user_scale for item in selected_items]
         for item in selected_items:
             item.scale_by(0.9)
+        self.push_scale_changes(selected_items, old_scales)
 
         # 更新场景矩形
         self.update_scene_rect()
@@ -2244,15 +5248,46 @@ class ImageComposer(QMainWindow):
             self.status_bar.showMessage("请先选中要重置的图片")
             return
 
+        old_scales = [item.user_scale for item in selected_items]
         for item in selected_items:
             item.user_scale = 1.0
             item.setScale(1.0)
+        self.push_scale_changes(selected_items, old_scales)
 
         self.status_bar.showMessage(f"已重置 {len(selected_items)} 张图片的大小")
 
+    def push_scale_changes(self, items, old_scales):
+        self.command_stack.push_changes(
+            'scale', [(item, old_scale, item.user_scale) for item, old_scale in zip(items, old_scales)])
+        self.schedule_resample()
+
+    def schedule_resample(self):
+        """连续缩放时推迟重采样，停止 500ms 后再做"""
+        if RESAMPLE_BELOW_SCALE > 0:
+            self.resample_timer.start()
+
+    def resample_scaled_items(self):
+        """把显示像素远多于实际显示尺寸的图片重采样，减少重绘时的采样量和常驻内存
+
+        按当前视图缩放计算显示尺寸（视图缩小时不重采样到更小，交给 mipmap），
+        之后放大查看时代理图机制会自动换回原图。和 paint 一样乘上屏幕的设备像素比，
+        否则高 DPI 屏幕上重采样后的图片会被立刻判定为分辨率不够而换回原图。
+        """
+        view_scale = max(1.0, QStyleOptionGraphicsItem.levelOfDetailFromTransform(self.view.transform()))
+        view_scale *= self.view.viewport().devicePixelRatioF()
+        for item in self.scene.items_of(DraggablePixmapItem):
+            display_scale = min(1.0, item.user_scale * view_scale)
+            if display_scale < item.display_scale * RESAMPLE_BELOW_SCALE:
+                item.resample(display_scale)
+
     def clear_canvas(self):
-        """清空画布"""
+        """清空画布（同时清空撤销历史）"""
+        # 先取消进行中的导入，占位项不能在解码期间被 scene.clear() 删除
+        self.import_pipeline.cancel()
         self.scene.clear()
+        self.command_stack.clear()
+        self.snapshot_manager.clear()
+        self.update_snapshot_status()
         self.image_count = 0
         self.status_bar.showMessage("画布已清空")
 
@@ -2267,304 +5302,199 @@ class ImageComposer(QMainWindow):
 
     def export_image(self):
         """导出合成后的图片（自动保存到指定路径）"""
-        all_items = self.scene.items()
+        self.export_canvas(INPUT_DIR, "已保存到", "导出失败")
 
-        # 检查是否有图片、箭头、线条或矩形框
-        has_content = any(isinstance(item, (DraggablePixmapItem, ArrowItem, LineItem, RectItem, TextItem)) for item in all_items)
+    def export_to_desktop(self):
+        """导出合成后的图片到桌面"""
+        self.export_canvas(DESKTOP_DIR, "已保存到桌面", "导出到桌面失败")
 
-        if not has_content:
-            # 播放错误提示音
+    def export_full_resolution(self):
+        """按原始分辨率分块导出 PNG 到桌面（不清空画布、不删除源文件）"""
+        if not self.scene.has_content():
             QApplication.beep()
             self.status_bar.showMessage("画布上没有内容可导出！")
             return
 
-        try:
-            # 从环境变量获取保存目录
-            save_dir = INPUT_DIR
-
-            # 如果目录不存在，创建它
-            os.makedirs(save_dir, exist_ok=True)
+        if self.import_pipeline.is_busy():
+            QApplication.beep()
+            self.status_bar.showMessage("图片仍在导入中，请稍候再导出（Esc 取消导入）")
+            return
 
-            # 生成时间戳文件名（使用 JPEG 格式以减小文件大小）
+        try:
+            os.makedirs(DESKTOP_DIR, exist_ok=True)
             timestamp = datetime.now().strftime("%Y-%m-%d %H %M %S")
-            file_path = os.path.join(save_dir, f"{timestamp}.jpg")
-
-            # 获取当前显示状态的边界框
-            display_rect = self.scene.itemsBoundingRect()
-
-            # 计算原始像素尺寸（临时将所有图片 scale 设为 1.0）
-            saved_scales = {}
-            for item in all_items:
-                if isinstance(item, DraggablePixmapItem):
-                    saved_scales[item] = item.scale()
-                    item.setScale(1.0)
-
-            original_rect = self.scene.itemsBoundingRect()
-
-            # 恢复所有图片的 scale
-            for item, scale in saved_scales.items():
-                item.setScale(scale)
+            file_path = os.path.join(DESKTOP_DIR, f"{timestamp} 原图.png")
 
-            # 计算缩放因子
-            if original_rect.width() > 0:
-                scale_factor = display_rect.width() / original_rect.width()
-            else:
-                scale_factor = 1.0
-
-            # 使用显示尺寸渲染（保持所有图形位置正确）
-            display_width = int(display_rect.width())
-            display_height = int(display_rect.height())
-
-            # 使用 RGB 格式（JPEG 不支持透明通道）
-            image = QImage(display_width, display_height, QImage.Format_RGB32)
-            image.fill(Qt.white)
-
-            painter = QPainter(image)
-            painter.setRenderHint(QPainter.Antialiasing)
-            painter.setRenderHint(QPainter.SmoothPixmapTransform)
-            self.scene.render(painter, QRectF(0, 0, display_width, display_height), display_rect)
-            painter.end()
-
-            # 设置最大像素尺寸限制（宽或高不超过 1920 像素）
-            MAX_SIZE = 1920
-            current_width = image.width()
-            current_height = image.height()
-
-            # 如果图片超过最大尺寸，按比例缩小
-            if current_width > MAX_SIZE or current_height > MAX_SIZE:
-                if current_width > current_height:
-                    target_width = MAX_SIZE
-                    target_height = int(current_height * MAX_SIZE / current_width)
-                else:
-                    target_height = MAX_SIZE
-                    target_width = int(current_width * MAX_SIZE / current_height)
-                image = image.scaled(target_width, target_height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-
-            # 保存为 JPEG 格式，质量 85%
-            image.save(file_path, 'JPEG', 85)
+            self.status_bar.showMessage(f"正在按原始分辨率导出: {file_path} ...")
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                failed = load_full_resolution_items(
+                    items_needing_full_resolution(self.scene.items_of(DraggablePixmapItem), 1.0))
+                if failed:
+                    raise IOError(failed_originals_message(failed))
+                width, height = export_scene_banded_png(self.scene, self.scene.itemsBoundingRect(), file_path)
+            finally:
+                QApplication.restoreOverrideCursor()
 
-            # 播放 Alt+S 导出提示音
             self.play_alt_s_sound()
-
-            # 更新状态栏，显示完整路径和实际尺寸
-            final_width = image.width()
-            final_height = image.height()
-            self.status_bar.showMessage(f"已保存到: {file_path} ({final_width}x{final_height})")
-
-            # 导出成功后，删除画布中的所有图片和形状，并删除源文件
-            deleted_files = []
-            failed_deletions = []
-            shape_count = 0
-
-            for item in list(all_items):  # 使用list()创建副本，避免在迭代时修改
-                if isinstance(item, DraggablePixmapItem):
-                    # 尝试删除源文件
-                    if item.file_path and os.path.exists(item.file_path):
-                        try:
-                            os.remove(item.file_path)
-                            deleted_files.append(os.path.basename(item.file_path))
-                        except Exception as e:
-                            failed_deletions.append(f"{os.path.basename(item.file_path)}: {str(e)}")
-
-                    # 从场景中删除图片
-                    self.scene.removeItem(item)
-                    self.image_count -= 1
-                elif isinstance(item, (ArrowItem, LineItem, RectItem, TextItem)):
-                    # 删除所有形状（箭头、线条、矩形框）
-                    self.scene.removeItem(item)
-                    shape_count += 1
-
-            # 删除合并前保存的原始文件（pending_delete_files）
-            for pending_file in self.pending_delete_files:
-                if os.path.exists(pending_file):
-                    try:
-                        os.remove(pending_file)
-                        deleted_files.append(os.path.basename(pending_file))
-                    except Exception as e:
-                        failed_deletions.append(f"{os.path.basename(pending_file)}: {str(e)}")
-            self.pending_delete_files.clear()
-
-            # 清空撤销栈和快照（因为所有内容都被删除了）
-            self.drawing_undo_stack.clear()
-            self.snapshot_manager.clear()
-
-            # 更新状态栏消息，包含删除信息
-            status_msg = f"已保存到: {file_path} ({final_width}x{final_height})"
-            if deleted_files:
-                status_msg += f" | 已删除 {len(deleted_files)} 个源文件"
-            if shape_count > 0:
-                status_msg += f" | 已清除 {shape_count} 个形状"
-            if failed_deletions:
-                status_msg += f" | {len(failed_deletions)} 个文件删除失败"
-
-            self.status_bar.showMessage(status_msg)
-
+            self.status_bar.showMessage(f"已按原始分辨率保存到桌面: {file_path} ({width}x{height})")
         except Exception as e:
-            # 播放错误提示音
             QApplication.beep()
-            self.status_bar.showMessage(f"导出失败: {str(e)}")
-
-    def export_to_desktop(self):
-        """导出合成后的图片到桌面（不删除源文件和画布内容）"""
-        all_items = self.scene.items()
+            self.status_bar.showMessage(f"原始分辨率导出失败: {str(e)}")
 
-        # 检查是否有图片、箭头、线条或矩形框
-        has_content = any(isinstance(item, (DraggablePixmapItem, ArrowItem, LineItem, RectItem, TextItem)) for item in all_items)
+    def export_canvas(self, save_dir, saved_label, error_label):
+        """导出画布为 JPEG（最长边不超过 EXPORT_MAX_SIZE），然后清空画布并删除源文件
 
-        if not has_content:
+        主线程只负责渲染；JPEG 编码、写文件和删除源文件在后台线程完成，
+        画布立即清空可继续使用，导出失败时再把内容放回画布。
+        """
+        # 检查是否有图片、箭头、线条、矩形框或文字
+        if not self.scene.has_content():
             # 播放错误提示音
             QApplication.beep()
             self.status_bar.showMessage("画布上没有内容可导出！")
             return
 
-        try:
-            # 从环境变量获取桌面路径
-            desktop_path = DESKTOP_DIR
+        if self.import_pipeline.is_busy():
+            QApplication.beep()
+            self.status_bar.showMessage("图片仍在导入中，请稍候再导出（Esc 取消导入）")
+            return
 
+        try:
             # 如果目录不存在，创建它
-            os.makedirs(desktop_path, exist_ok=True)
+            os.makedirs(save_dir, exist_ok=True)
 
-            # 生成时间戳文件名（使用 JPEG 格式以减小文件大小）
+            # 生成时间戳文件名（使用 JPEG 格式以减小文件大小），同一秒内多次导出时加序号
             timestamp = datetime.now().strftime("%Y-%m-%d %H %M %S")
-            file_path = os.path.join(desktop_path, f"{timestamp}.jpg")
+            file_path = os.path.join(save_dir, f"{timestamp}.jpg")
+            suffix = 1
+            while os.path.exists(file_path) or any(job.file_path == file_path for job in self.export_jobs):
+                file_path = os.path.join(save_dir, f"{timestamp} ({suffix}).jpg")
+                suffix += 1
 
-            # 获取当前显示状态的边界框
+            # 获取当前显示状态的边界框，直接按导出尺寸渲染
             display_rect = self.scene.itemsBoundingRect()
-
-            # 计算原始像素尺寸（临时将所有图片 scale 设为 1.0）
-            saved_scales = {}
-            for item in all_items:
-                if isinstance(item, DraggablePixmapItem):
-                    saved_scales[item] = item.scale()
-                    item.setScale(1.0)
-
-            original_rect = self.scene.itemsBoundingRect()
-
-            # 恢复所有图片的 scale
-            for item, scale in saved_scales.items():
-                item.setScale(scale)
-
-            # 计算缩放因子
-            if original_rect.width() > 0:
-                scale_factor = display_rect.width() / original_rect.width()
-            else:
-                scale_factor = 1.0
-
-            # 使用显示尺寸渲染（保持所有图形位置正确）
-            display_width = int(display_rect.width())
-            display_height = int(display_rect.height())
-
-            # 使用 RGB 格式（JPEG 不支持透明通道）
-            image = QImage(display_width, display_height, QImage.Format_RGB32)
-            image.fill(Qt.white)
-
-            painter = QPainter(image)
-            painter.setRenderHint(QPainter.Antialiasing)
-            painter.setRenderHint(QPainter.SmoothPixmapTransform)
-            self.scene.render(painter, QRectF(0, 0, display_width, display_height), display_rect)
-            painter.end()
-
-            # 设置最大像素尺寸限制（宽或高不超过 1920 像素）
-            MAX_SIZE = 1920
-            current_width = image.width()
-            current_height = image.height()
-
-            # 如果图片超过最大尺寸，按比例缩小
-            if current_width > MAX_SIZE or current_height > MAX_SIZE:
-                if current_width > current_height:
-                    target_width = MAX_SIZE
-                    target_height = int(current_height * MAX_SIZE / current_width)
-                else:
-                    target_height = MAX_SIZE
-                    target_width = int(current_width * MAX_SIZE / current_height)
-                image = image.scaled(target_width, target_height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-
-            # 保存为 JPEG 格式，质量 85%
-            image.save(file_path, 'JPEG', 85)
-
-            # 播放 Alt+S 导出提示音
-            self.play_alt_s_sound()
-
-            # 更新状态栏，显示完整路径和实际尺寸
-            final_width = image.width()
-            final_height = image.height()
-
-            # 导出成功后，删除画布中的所有图片和形状，并删除源文件
-            deleted_files = []
-            failed_deletions = []
-            shape_count = 0
-
-            for item in list(all_items):  # 使用list()创建副本，避免在迭代时修改
-                if isinstance(item, DraggablePixmapItem):
-                    # 尝试删除源文件
-                    if item.file_path and os.path.exists(item.file_path):
-                        try:
-                            os.remove(item.file_path)
-                            deleted_files.append(os.path.basename(item.file_path))
-                        except Exception as e:
-                            failed_deletions.append(f"{os.path.basename(item.file_path)}: {str(e)}")
-
-                    # 从场景中删除图片
-                    self.scene.removeItem(item)
-                    self.image_count -= 1
-                elif isinstance(item, (ArrowItem, LineItem, RectItem, TextItem)):
-                    # 删除所有形状（箭头、线条、矩形框）
-                    self.scene.removeItem(item)
-                    shape_count += 1
-
-            # 删除合并前保存的原始文件（pending_delete_files）
-            for pending_file in self.pending_delete_files:
-                if os.path.exists(pending_file):
-                    try:
-                        os.remove(pending_file)
-                        deleted_files.append(os.path.basename(pending_file))
-                    except Exception as e:
-                        failed_deletions.append(f"{os.path.basename(pending_file)}: {str(e)}")
-            self.pending_delete_files.clear()
-
-            # 清空撤销栈和快照（因为所有内容都被删除了）
-            self.drawing_undo_stack.clear()
-            self.snapshot_manager.clear()
-
-            # 更新状态栏消息，包含删除信息
-            status_msg = f"已保存到桌面: {file_path} ({final_width}x{final_height})"
-            if deleted_files:
-                status_msg += f" | 已删除 {len(deleted_files)} 个源文件"
-            if shape_count > 0:
-                status_msg += f" | 已清除 {shape_count} 个形状"
-            if failed_deletions:
-                status_msg += f" | {len(failed_deletions)} 个文件删除失败"
-
-            self.status_bar.showMessage(status_msg)
-
+            final_width, final_height = export_target_size(display_rect)
+            render_scale = final_width / display_rect.width() if display_rect.width() > 0 else 1.0
+
+            # 只有代理图分辨率不够时才加载原图；加载失败时不导出，也不删除源文件
+            failed = load_full_resolution_items(
+                items_needing_full_resolution(self.scene.items_of(DraggablePixmapItem), render_scale))
+            if failed:
+                raise IOError(failed_originals_message(failed))
+
+            # 使用 RGB 格式（JPEG 不支持透明通道）；RGB888 比 RGB32 少 1/4 内存，
+            # 导入的不透明截图也是 RGB888，直接合成时按行拷贝，不需要逐像素转换
+            image = render_scene_image(self.scene, display_rect, final_width, final_height, QImage.Format_RGB888)
         except Exception as e:
             # 播放错误提示音
             QApplication.beep()
-            self.status_bar.showMessage(f"导出到桌面失败: {str(e)}")
+            self.status_bar.showMessage(f"{error_label}: {str(e)}")
+            return
+
+        # 从画布上移除图片和形状（保留引用，导出失败时放回）
+        source_files = []
+        removed_items = []
+        for item in self.scene.items_of(DraggablePixmapItem):
+            if item.file_path and item.file_path not in source_files:
+                source_files.append(item.file_path)
+            self.scene.removeItem(item)
+            removed_items.append(item)
+            self.image_count -= 1
+
+        # 删除所有标注（箭头、线条、矩形框、文字）
+        layer = self.scene.annotations
+        records = list(layer.records.values())
+        for record in records:
+            layer.remove_record(record)
+        removed_items += records
+        shape_count = len(records)
+
+        # 合并前保存的原始文件（pending_delete_files）也在导出成功后删除
+        pending_files = list(self.pending_delete_files)
+        for pending_file in pending_files:
+            if pending_file not in source_files:
+                source_files.append(pending_file)
+        self.pending_delete_files.clear()
+
+        # 清空撤销栈和快照（因为所有内容都被删除了）
+        self.command_stack.clear()
+        self.snapshot_manager.clear()
+        self.update_snapshot_status()
+
+        job = ExportJob(image, file_path, source_files, pending_files, removed_items, shape_count,
+                        saved_label, error_label)
+        self.export_jobs.append(job)
+        self.export_pool.start(ExportTask(job, self.export_signals))
+        self.status_bar.showMessage(f"正在保存: {file_path} ({final_width}x{final_height}) ...")
+
+    def on_export_finished(self, job):
+        """后台导出完成"""
+        self.export_jobs.remove(job)
+        job.items = []
+
+        # 播放 Alt+S 导出提示音
+        self.play_alt_s_sound()
+
+        # 更新状态栏消息，包含删除信息
+        status_msg = f"{job.saved_label}: {job.file_path} ({job.size.width()}x{job.size.height()})"
+        if job.deleted_files:
+            status_msg += f" | 已删除 {len(job.deleted_files)} 个源文件"
+        if job.shape_count > 0:
+            status_msg += f" | 已清除 {job.shape_count} 个形状"
+        if job.failed_deletions:
+            status_msg += f" | {len(job.failed_deletions)} 个文件删除失败"
+
+        self.status_bar.showMessage(status_msg)
+
+    def on_export_failed(self, job, error):
+        """后台导出失败：把内容放回画布，源文件保持不动"""
+        self.export_jobs.remove(job)
+        for item in job.items:
+            if isinstance(item, dict):
+                self.scene.annotations.add_record(item)
+                continue
+            self.scene.addItem(item)
+            if isinstance(item, DraggablePixmapItem):
+                self.image_count += 1
+        for pending_file in job.pending_files:
+            if pending_file not in self.pending_delete_files:
+                self.pending_delete_files.append(pending_file)
+        self.update_scene_rect()
+
+        # 播放错误提示音
+        QApplication.beep()
+        self.status_bar.showMessage(f"{job.error_label}: {error}")
 
     def increase_text_font_size(self):
         """放大选中文字的字体"""
-        selected_texts = [item for item in self.scene.selectedItems()
-                         if isinstance(item, TextItem)]
+        layer = self.scene.annotations
+        selected_texts = layer.selected_records(kinds=('text',))
         if not selected_texts:
             self.status_bar.showMessage("请先选中要放大的文字")
             return
 
+        old_sizes = [text_item['font_size'] for text_item in selected_texts]
         for text_item in selected_texts:
-            text_item.increase_font_size()
+            layer.set_font_size(text_item, min(200, text_item['font_size'] + 2))
+        self.command_stack.push_changes(
+            'font', [(item, old, item['font_size']) for item, old in zip(selected_texts, old_sizes)])
 
         self.status_bar.showMessage(f"已放大 {len(selected_texts)} 个文字的字体")
 
     def decrease_text_font_size(self):
         """缩小选中文字的字体"""
-        selected_texts = [item for item in self.scene.selectedItems()
-                         if isinstance(item, TextItem)]
+        layer = self.scene.annotations
+        selected_texts = layer.selected_records(kinds=('text',))
         if not selected_texts:
             self.status_bar.showMessage("请先选中要缩小的文字")
             return
 
+        old_sizes = [text_item['font_size'] for text_item in selected_texts]
         for text_item in selected_texts:
-            text_item.decrease_font_size()
+            layer.set_font_size(text_item, max(8, text_item['font_size'] - 2))
+        self.command_stack.push_changes(
+            'font', [(item, old, item['font_size']) for item, old in zip(selected_texts, old_sizes)])
 
         self.status_bar.showMessage(f"已缩小 {len(selected_texts)} 个文字的字体")
 
@@ -2572,6 +5502,9 @@ class ImageComposer(QMainWindow):
         """键盘事件处理"""
         if event.key() == Qt.Key_Delete:
             self.delete_selected()
+        elif event.key() == Qt.Key_Escape and self.import_pipeline.is_busy():
+            # Esc: 取消正在进行的导入
+            self.import_pipeline.cancel()
         elif event.modifiers() == (Qt.ControlModifier | Qt.ShiftModifier):
             # Ctrl+Shift 组合键
             if event.key() == Qt.Key_Greater or event.key() == Qt.Key_Period: